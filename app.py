@@ -1,15 +1,17 @@
 from os.path import dirname, realpath, basename
 from os import curdir
+from functools import partial
 import sys
 import logging
-from selenium import webdriver
 
-from app.config import load_configuration
-from app.storage import InstagramStorage
-from app.scraping import scrape_instagram
+from app.config import load_configuration, parse_arguments
 
 from utils.logging import configure_logging
 
+# Only the configuration is imported up front. pandas, selenium and PIL are
+# imported in main() once the arguments are valid, selenium only if a stage
+# needs a browser, so --help, --check-config and images-only runs start fast.
+
 
 def init():
     loglevel = logging.INFO
@@ -28,16 +30,67 @@ def init():
         exit(0)
 
 
+def start_browser(configuration):
+    from app.driver import create_driver
+
+    return create_driver(
+        headless=configuration.HEADLESS,
+        block_resources=configuration.BLOCK_RESOURCES,
+    )
+
+
 def main():
     global ROOT_DIR
+    args = parse_arguments()
     init()
-    configuration = load_configuration(ROOT_DIR)
-    storage = InstagramStorage(folder_path=configuration.SCRAPER_OUTPUT_PATH)
-    driver = webdriver.Chrome()
+    configuration = load_configuration(ROOT_DIR, args)
+    if args.check_config:
+        logging.info("Configuration is valid")
+        return
+
+    if configuration.DISTRIBUTED_ROLE == "worker":
+        # no storage, results go to the coordinator
+        from app.distributed import run_worker
+
+        run_worker(configuration, partial(start_browser, configuration))
+        return
+
+    from app.storage import create_storage
+
+    if configuration.ASYNC_MODE:
+        from app.async_scraping import run_scrape_instagram_async as scrape_instagram
+    else:
+        from app.scraping import scrape_instagram
+
+    storage = create_storage(
+        folder_path=configuration.SCRAPER_OUTPUT_PATH,
+        backend=configuration.STORAGE_BACKEND,
+        journal=configuration.STORAGE_JOURNAL,
+        image_max_size=configuration.IMAGE_MAX_SIZE or None,
+        image_layout=configuration.IMAGE_LAYOUT,
+        phash_dedup=configuration.PHASH_DEDUP,
+    )
     try:
-        scrape_instagram(storage, driver, configuration)
+        if configuration.DISTRIBUTED_ROLE == "coordinator":
+            from app.distributed import run_coordinator
+
+            # workers scrape, this process merges their results
+            run_coordinator(storage, configuration)
+        elif configuration.SCRAPE_POSTS or configuration.SCRAPE_COMMENTS:
+            from app.driver_pool import DriverPool
+
+            driver_factory = partial(start_browser, configuration)
+            with DriverPool(configuration.BROWSER_WORKERS, driver_factory) as pool:
+                scrape_instagram(storage, pool, configuration)
+        else:
+            # images are downloaded over http, no browser is started
+            scrape_instagram(storage, None, configuration)
+        if configuration.EXPORT_PARQUET_PATH:
+            from app.export import export_parquet
+
+            export_parquet(storage, configuration.EXPORT_PARQUET_PATH)
     finally:
-        driver.quit()
+        storage.close()
 
 
 if __name__ == "__main__":
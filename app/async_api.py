@@ -0,0 +1,155 @@
+import typing as tp
+import asyncio
+import logging
+import time
+
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
+
+from .async_downloader import AsyncImageDownloader
+from .instagram_api import (
+    INSTAGRAM_TAG_EXPLORE_PATH,
+    PAGE_ENDPOINT,
+    PAGE_HEIGHT_SCRIPT,
+    POST_IMAGE_SELECTOR,
+    SCROLL_TO_BOTTOM_SCRIPT,
+    InstagramApi,
+    _TagPage,
+)
+from .metrics import EXTRACTION_SECONDS, POSTS_FOUND
+from .post import Post
+from .session import SessionStore
+
+
+class AsyncInstagramApi:
+    # asyncio front of an InstagramApi. Waiting is what takes the time in a
+    # browser: rate limit delays, page loads and scrolls are awaited, so one
+    # event loop drives all browsers next to hundreds of image downloads.
+    # Webdriver commands themselves are short blocking http calls to
+    # chromedriver, they run in the loop's default thread pool. A webdriver
+    # is not thread safe: an api is used by one task at a time.
+
+    def __init__(
+        self,
+        api: InstagramApi,
+        image_downloader: tp.Optional[AsyncImageDownloader] = None,
+    ):
+        self.api = api
+        self.driver = api.driver
+        self.waiter = api.waiter
+        self.rate_limiter = api.rate_limiter
+        self.image_downloader = image_downloader or AsyncImageDownloader(
+            rate_limiter=api.rate_limiter
+        )
+
+    async def _call(self, function: tp.Callable, *args, **kwargs) -> tp.Any:
+        return await asyncio.to_thread(function, *args, **kwargs)
+
+    async def login(
+        self,
+        username: str,
+        password: str,
+        session_store: tp.Optional[SessionStore] = None,
+    ):
+        # once per run, the blocking version is good enough
+        await self._call(self.api.login, username, password, session_store)
+
+    async def scrape_posts_by_tag(
+        self,
+        tag: str,
+        filter_function,
+        maximum_posts: int = 50,
+        known_post_ids: tp.Optional[tp.Collection[str]] = None,
+    ) -> tp.List[Post]:
+        # see InstagramApi.scrape_posts_by_tag; filter_function runs in the
+        # event loop
+        tag_url = self.api.base_url + INSTAGRAM_TAG_EXPLORE_PATH.format(tag_name=tag)
+        logging.info(f"scraping posts by tag, link: {tag_url}")
+        if not await self._open_page(
+            PAGE_ENDPOINT,
+            tag_url,
+            "tag_page",
+            EC.presence_of_all_elements_located((By.CSS_SELECTOR, POST_IMAGE_SELECTOR)),
+            timeout=30,
+        ):
+            # not an empty page: the tag is left as it was, tried again later
+            raise TimeoutException(f"Error loading the page by timeout: {tag_url}")
+
+        page = _TagPage(self.api, tag, filter_function, maximum_posts, known_post_ids)
+        while True:
+            with EXTRACTION_SECONDS.time(kind="tag_tiles"):
+                tiles = await self._call(self.api._extract_tag_tiles)
+            if not page.add_tiles(tiles) or not await self._scroll_for_more():
+                break
+            page.scrolls += 1
+        POSTS_FOUND.inc(len(page.posts))
+        return page.posts
+
+    async def _open_page(
+        self, endpoint: str, url: str, operation: str, condition, timeout: float
+    ) -> bool:
+        bucket = self.rate_limiter.bucket(endpoint)
+        await bucket.acquire_async()
+        started = time.perf_counter()
+        await self._call(self.driver.get, url)
+        try:
+            await self.waiter.until_async(operation, condition, timeout=timeout)
+        except TimeoutException:
+            self.api._record_page(bucket, operation, started, loaded=False)
+            return False
+        self.api._record_page(bucket, operation, started, loaded=True)
+        return True
+
+    async def _scroll_for_more(self) -> bool:
+        height = await self._call(self.driver.execute_script, SCROLL_TO_BOTTOM_SCRIPT)
+        return await self.waiter.until_changed_async(
+            "scroll",
+            lambda: self.driver.execute_script(PAGE_HEIGHT_SCRIPT),
+            timeout=self.api.scroll_timeout,
+            initial_value=height,
+        )
+
+    async def scrape_comments(
+        self,
+        post: Post,
+        max_comments: int = 400,
+        filter=None,  # filter function
+    ) -> bool:
+        # see InstagramApi.scrape_comments
+        post_url = self.api._post_url(post)
+        if not await self._open_page(
+            PAGE_ENDPOINT, post_url, "post_page", self.api._post_page_loaded, timeout=20
+        ):
+            logging.info(
+                f"Couldn't scrape comments for post: {post_url}: Timeout, skipping"
+            )
+            return False
+        # clicking "more comments" waits between short webdriver calls
+        await self._call(self.api._collect_comments, post, max_comments, filter)
+        return True
+
+    async def scrape_comments_batch(
+        self,
+        posts: tp.List[Post],
+        max_comments: int = 400,
+        filter=None,  # filter function
+        tabs: int = 4,
+    ) -> tp.List[tp.Tuple[Post, bool]]:
+        # one batch of tabs of InstagramApi.scrape_comments_batch in a
+        # worker thread: switching between tabs is not worth interleaving
+        return await self._call(
+            lambda: list(
+                self.api.scrape_comments_batch(posts, max_comments, filter, tabs)
+            )
+        )
+
+    async def scrape_image_by_url(self, image_url: str):
+        return await self.image_downloader.fetch(image_url)
+
+    def scrape_images_for_posts(
+        self, posts: tp.Iterable[Post], to_directory: tp.Optional[str] = None
+    ) -> tp.AsyncIterator[tp.Tuple[Post, tp.Any]]:
+        return self.image_downloader.fetch_many(
+            ((post, post.image_url) for post in posts), to_directory=to_directory
+        )
@@ -0,0 +1,224 @@
+import typing as tp
+import asyncio
+from io import BytesIO
+import logging
+import os
+import random
+import tempfile
+
+from PIL import Image
+
+try:
+    import aiohttp
+except ImportError:  # optional, only the asyncio mode needs it
+    aiohttp = None  # type: ignore
+
+from .downloader import THROTTLE_STATUS_CODES
+from .images import image_format, SIGNATURE_LENGTH
+from .metrics import (
+    DOWNLOAD_BYTES,
+    DOWNLOAD_RETRIES,
+    DOWNLOAD_SECONDS,
+    DOWNLOADS,
+    HTTP_RESPONSES,
+    THROTTLED,
+)
+from .rate_limit import RateLimiter, retry_after_seconds
+
+Key = tp.TypeVar("Key")
+
+
+class AsyncImageDownloader:
+    # ImageDownloader for asyncio: every download is a coroutine on one
+    # aiohttp session, so hundreds can be in flight without a thread each.
+    # Retries, backoff, rate limiting and metrics work like ImageDownloader.
+
+    def __init__(
+        self,
+        max_in_flight: int = 256,
+        max_per_host: int = 64,
+        max_attempts: int = 3,
+        backoff_base: float = 1.0,
+        backoff_max: float = 30.0,
+        timeout: float = 30.0,
+        validate_format: bool = True,
+        chunk_size: int = 64 * 1024,
+        rate_limiter: tp.Optional[RateLimiter] = None,
+    ):
+        if aiohttp is None:
+            raise RuntimeError("The asyncio mode needs aiohttp: pip install aiohttp")
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_per_host = max(1, max_per_host)
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.validate_format = validate_format
+        self.chunk_size = chunk_size
+        self.rate_limiter = rate_limiter or RateLimiter()
+        # created on first use, it has to be inside the running event loop
+        self._session: tp.Optional["aiohttp.ClientSession"] = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self) -> "aiohttp.ClientSession":
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_in_flight, limit_per_host=self.max_per_host
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    def _backoff_delay(self, attempt: int) -> float:
+        # exponential backoff with full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    async def _get(self, image_url: str) -> "aiohttp.ClientResponse":
+        # rate limited request, throttling answers slow the host's bucket down;
+        # the response has to be released by the caller
+        bucket = self.rate_limiter.bucket(RateLimiter.url_endpoint("image", image_url))
+        await bucket.acquire_async()
+        try:
+            response = await self._get_session().get(image_url)
+        except aiohttp.ClientConnectorError:
+            # dns failure, refused connection: not the host slowing us down
+            HTTP_RESPONSES.inc(status="error")
+            raise
+        except (asyncio.TimeoutError, aiohttp.ClientConnectionError):
+            HTTP_RESPONSES.inc(status="error")
+            THROTTLED.inc(endpoint="image")
+            bucket.on_throttle()
+            raise
+        HTTP_RESPONSES.inc(status=response.status)
+        if response.status in THROTTLE_STATUS_CODES:
+            THROTTLED.inc(endpoint="image")
+            bucket.on_throttle(retry_after_seconds(response.headers.get("Retry-After")))
+        else:
+            bucket.on_success()
+        return response
+
+    async def _with_retries(self, image_url: str, read_function) -> tp.Any:
+        # read_function(response) is awaited for 200 answers, its result returned
+        logging.info(f"Downloading img: {image_url}")
+        for attempt in range(self.max_attempts):
+            if attempt:
+                DOWNLOAD_RETRIES.inc()
+            attempts = f"{attempt + 1}/{self.max_attempts}"
+            try:
+                response = await self._get(image_url)
+                async with response:
+                    if response.status == 200:
+                        return await read_function(response)
+                logging.info(
+                    f"Failed to download image, attempt {attempts}: "
+                    f"bad request {response.status}"
+                )
+            except aiohttp.ClientConnectorError as e:
+                # retrying won't resolve the host or open the port
+                logging.info(f"Failed to download image: {e!r}")
+                return None
+            except Exception as e:
+                logging.info(f"Failed to download image, attempt {attempts}: {e!r}")
+            if attempt + 1 < self.max_attempts:
+                await asyncio.sleep(self._backoff_delay(attempt))
+        return None
+
+    async def fetch(self, image_url: str) -> tp.Optional[Image.Image]:
+        async def read_image(response) -> Image.Image:
+            content = await response.read()
+            DOWNLOAD_BYTES.inc(len(content))
+            image = Image.open(BytesIO(content))
+            image.load()
+            return image
+
+        with DOWNLOAD_SECONDS.time(target="memory"):
+            image = await self._with_retries(image_url, read_image)
+        DOWNLOADS.inc(result="ok" if image is not None else "failed")
+        return image
+
+    async def fetch_to_file(self, image_url: str, directory: str) -> tp.Optional[str]:
+        # streams the body into a temporary file in directory, see
+        # ImageDownloader.fetch_to_file
+        async def read_to_file(response) -> tp.Optional[str]:
+            return await self._stream_to_file(response, directory, image_url)
+
+        with DOWNLOAD_SECONDS.time(target="file"):
+            path = await self._with_retries(image_url, read_to_file)
+        DOWNLOADS.inc(result="ok" if path is not None else "failed")
+        return path
+
+    async def _stream_to_file(
+        self, response: "aiohttp.ClientResponse", directory: str, image_url: str
+    ) -> tp.Optional[str]:
+        # chunks are written as they arrive, local writes of this size don't
+        # hold the loop up noticeably
+        descriptor, path = tempfile.mkstemp(suffix=".part", dir=directory)
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                header = b""
+                size = 0
+                async for chunk in response.content.iter_chunked(self.chunk_size):
+                    if len(header) < SIGNATURE_LENGTH:
+                        header += chunk[: SIGNATURE_LENGTH - len(header)]
+                    file.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.remove(path)
+            raise
+        DOWNLOAD_BYTES.inc(size)
+        if self.validate_format and image_format(header) is None:
+            logging.info(f"Downloaded file is not an image: {image_url}")
+            os.remove(path)
+            return None
+        return path
+
+    async def fetch_many(
+        self,
+        items: tp.Iterable[tp.Tuple[Key, str]],
+        to_directory: tp.Optional[str] = None,
+    ) -> tp.AsyncIterator[tp.Tuple[Key, tp.Any]]:
+        # Yields (key, result) pairs in completion order like
+        # ImageDownloader.fetch_many, with up to max_in_flight downloads
+        # running at once.
+        async def fetch(url: str) -> tp.Any:
+            if to_directory is None:
+                return await self.fetch(url)
+            return await self.fetch_to_file(url, to_directory)
+
+        pending: tp.Dict[asyncio.Task, Key] = {}
+        items = iter(items)
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < self.max_in_flight:
+                    try:
+                        key, url = next(items)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending[asyncio.ensure_future(fetch(url))] = key
+                if not pending:
+                    return
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    key = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception:
+                        logging.exception(f"Unexpected error downloading image for {key}")
+                        result = None
+                    yield key, result
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,296 @@
+import asyncio
+from collections import defaultdict
+from datetime import timedelta
+from itertools import islice
+import logging
+import typing as tp
+
+from .async_downloader import AsyncImageDownloader
+from .config import Configuration
+from .frontier import Frontier
+from .metrics import METRICS, STAGE_SECONDS
+from .post import Post
+from .scraping import (
+    _Checkpoint,
+    _create_instagrams,
+    _create_rate_limiter,
+    _filter_small_comments,
+    _frontier_posts,
+    _images_to_download,
+    _load_companies,
+    _open_frontier,
+    _save_comments,
+    _save_downloaded_image,
+    _save_tag_posts,
+    _tag_work,
+    _write_metrics,
+)
+from .seen_index import SeenPostIndex
+from .storage import InstagramStorage
+
+if tp.TYPE_CHECKING:
+    from .async_api import AsyncInstagramApi
+    from .driver_pool import DriverPool
+
+# scrape_instagram on one asyncio event loop: a task per browser for tag
+# pages and comments, up to ASYNC_DOWNLOADS image downloads at once. Storage
+# is only touched from the loop, between awaits, so it needs no lock; its
+# calls are local and short enough to run there directly.
+
+
+def run_scrape_instagram_async(
+    storage: InstagramStorage,
+    driver_pool: tp.Optional["DriverPool"],
+    configuration: Configuration,
+):
+    asyncio.run(scrape_instagram_async(storage, driver_pool, configuration))
+
+
+async def scrape_instagram_async(
+    storage: InstagramStorage,
+    driver_pool: tp.Optional["DriverPool"],
+    configuration: Configuration,
+):
+    # driver_pool: None if no stage needs a browser (images only)
+    logging.info(
+        "Startig app in asyncio mode with "
+        + ("scraping images" if configuration.SCRAPE_IMAGES else "no image scraping")
+        + ", "
+        + (
+            "scraping comments"
+            if configuration.SCRAPE_COMMENTS
+            else "no comment scraping"
+        )
+    )
+
+    companies = _load_companies(
+        companies_file=configuration.COMPANIES_FILE_PATH,
+        list_of_companies=configuration.COMPANIES,
+    )
+    rate_limiter = _create_rate_limiter(configuration, configuration.ASYNC_DOWNLOADS)
+    image_downloader = AsyncImageDownloader(
+        max_in_flight=configuration.ASYNC_DOWNLOADS, rate_limiter=rate_limiter
+    )
+    # logging in is blocking, once per run
+    instagrams: tp.List["AsyncInstagramApi"] = []
+    if driver_pool is not None:
+        # selenium is loaded only when a stage needs a browser
+        from .async_api import AsyncInstagramApi
+
+        instagrams = [
+            AsyncInstagramApi(api, image_downloader)
+            for api in await asyncio.to_thread(
+                _create_instagrams,
+                storage.folder_path,
+                driver_pool,
+                configuration,
+                rate_limiter,
+            )
+        ]
+    frontier = _open_frontier(storage, configuration)
+
+    metrics_server = None
+    if configuration.METRICS_PORT:
+        metrics_server = METRICS.serve(configuration.METRICS_PORT)
+
+    status = "failed"
+    try:
+        await _scrape_stages(
+            storage, instagrams, image_downloader, companies, configuration, frontier
+        )
+        status = "completed"
+    finally:
+        await image_downloader.close()
+        if frontier is not None:
+            frontier.close()
+        _write_metrics(storage, configuration, status)
+        if metrics_server is not None:
+            metrics_server.shutdown()
+
+    for api in instagrams:
+        api.waiter.log_stats()
+    rate_limiter.log_stats()
+
+
+async def _scrape_stages(
+    storage: InstagramStorage,
+    instagrams: tp.List["AsyncInstagramApi"],
+    image_downloader: AsyncImageDownloader,
+    companies: tp.Dict[str, tp.List[str]],
+    configuration: Configuration,
+    frontier: tp.Optional[Frontier],
+):
+    if configuration.SCRAPE_POSTS:
+        with STAGE_SECONDS.time(stage="posts"):
+            scraped_posts = await scrape_posts_by_tags(
+                storage,
+                instagrams,
+                companies,
+                maximum_posts=configuration.MAXIMUM_POSTS,
+                frontier=frontier,
+                incremental=configuration.INCREMENTAL_TAGS,
+                tag_backoff=timedelta(hours=configuration.TAG_BACKOFF_HOURS),
+            )
+
+    if configuration.SCRAPE_IMAGES:
+        if configuration.SCRAPE_POSTS:
+            posts, number_posts = scraped_posts, len(scraped_posts)
+        else:
+            posts = storage.iter_posts_with_no_image()
+            number_posts = storage.count_with_no_image()
+        logging.info(f"Scraping images for {number_posts} posts")
+        with STAGE_SECONDS.time(stage="images"):
+            await scrape_images_for_posts(
+                posts,
+                storage,
+                image_downloader,
+                checkpoint_every=configuration.CHECKPOINT_EVERY,
+                frontier=frontier,
+            )
+
+    if configuration.SCRAPE_COMMENTS:
+        if configuration.SCRAPE_POSTS:
+            posts, number_posts = scraped_posts, len(scraped_posts)
+        else:
+            posts = storage.iter_posts_with_no_comment()
+            number_posts = storage.count_with_no_comment()
+        logging.info(f"Scraping comments for {number_posts} posts")
+        with STAGE_SECONDS.time(stage="comments"):
+            await scrape_comments_for_posts(
+                posts,
+                storage,
+                instagrams,
+                checkpoint_every=configuration.CHECKPOINT_EVERY,
+                frontier=frontier,
+                tabs=configuration.COMMENT_TABS,
+            )
+
+
+async def scrape_posts_by_tags(
+    storage: InstagramStorage,
+    instagrams: tp.List["AsyncInstagramApi"],
+    companies: tp.Dict[str, tp.List[str]],
+    maximum_posts=50,
+    frontier: tp.Optional[Frontier] = None,
+    incremental: bool = True,
+    tag_backoff: timedelta = timedelta(hours=1),
+) -> tp.List[Post]:
+    # see scraping.scrape_posts_by_tags; every browser's task takes the next
+    # (company, tag) pair from the shared work iterator when it is free
+    seen_posts = SeenPostIndex(storage)
+    posts_per_company: tp.Dict[str, int] = defaultdict(int)
+    work = _tag_work(
+        storage, companies, frontier, incremental, tag_backoff, len(instagrams)
+    )
+    posts: tp.List[Post] = []
+
+    async def scrape_tags(api: "AsyncInstagramApi"):
+        for key, company, tag in work:
+            result = None
+            remaining = maximum_posts - posts_per_company[company]
+            if remaining > 0:
+                known_post_ids = None
+                if incremental:
+                    known_post_ids = set(storage.get_tag_state(tag).recent_post_ids)
+                page_post_ids: tp.List[str] = []
+
+                def filter_tag_post(post: Post) -> bool:
+                    page_post_ids.append(post.id)
+                    return not seen_posts.is_seen(post.id)
+
+                try:
+                    tag_posts = await api.scrape_posts_by_tag(
+                        tag,
+                        filter_function=filter_tag_post,
+                        maximum_posts=remaining,
+                        known_post_ids=known_post_ids,
+                    )
+                except Exception as error:
+                    logging.exception(f"Failed scraping a tag of company {company}")
+                    if frontier is not None:
+                        frontier.fail("tag", key, repr(error))
+                    continue
+                result = tag_posts, page_post_ids
+            posts.extend(
+                _save_tag_posts(
+                    storage,
+                    seen_posts,
+                    posts_per_company,
+                    maximum_posts,
+                    company,
+                    tag,
+                    result,
+                    incremental,
+                )
+            )
+            if frontier is not None:
+                storage.save_table_changes()
+                frontier.complete("tag", [key])
+
+    try:
+        await asyncio.gather(*(scrape_tags(api) for api in instagrams))
+    finally:
+        seen_posts.close()
+    storage.save_table_changes()  # don't forget this step :)
+    return posts
+
+
+async def scrape_images_for_posts(
+    posts: tp.Iterable[Post],
+    storage: InstagramStorage,
+    image_downloader: AsyncImageDownloader,
+    checkpoint_every: int = 0,
+    frontier: tp.Optional[Frontier] = None,
+):
+    checkpoint = _Checkpoint(storage, checkpoint_every, frontier, "image")
+    if frontier is not None:
+        posts = _frontier_posts(posts, frontier, "image")
+
+    downloads = image_downloader.fetch_many(
+        _images_to_download(posts, storage, checkpoint),
+        to_directory=storage.incoming_path,
+    )
+    try:
+        async for post, downloaded_path in downloads:
+            _save_downloaded_image(post, downloaded_path, storage, checkpoint)
+    finally:
+        await downloads.aclose()
+        checkpoint.save()  # don't forget this step :)
+
+
+async def scrape_comments_for_posts(
+    posts: tp.Iterable[Post],
+    storage: InstagramStorage,
+    instagrams: tp.List["AsyncInstagramApi"],
+    checkpoint_every: int = 0,
+    frontier: tp.Optional[Frontier] = None,
+    tabs: int = 4,
+):
+    # every browser loads `tabs` posts at a time, all browsers at once
+    checkpoint = _Checkpoint(storage, checkpoint_every, frontier, "comment")
+    if frontier is not None:
+        posts = _frontier_posts(posts, frontier, "comment")
+    posts = iter(posts)
+
+    async def scrape_comments(api: "AsyncInstagramApi"):
+        while True:
+            batch = list(islice(posts, tabs))
+            if not batch:
+                return
+            try:
+                scraped = await api.scrape_comments_batch(
+                    batch, max_comments=100, filter=_filter_small_comments, tabs=tabs
+                )
+            except Exception as error:
+                # a dead browser fails its batch, not the whole stage
+                logging.exception(f"Failed scraping comments of {len(batch)} posts")
+                for post in batch:
+                    checkpoint.failed(post.id, repr(error))
+                continue
+            for post, success in scraped:
+                _save_comments(post, success, storage, checkpoint)
+
+    try:
+        await asyncio.gather(*(scrape_comments(api) for api in instagrams))
+    finally:
+        checkpoint.save()  # don't forget this step :)
@@ -2,6 +2,7 @@ import os
 import logging
 from dotenv import load_dotenv
 import argparse
+import typing as tp
 
 
 class Configuration:
@@ -11,6 +12,9 @@ class Configuration:
     # instagram authentification
     INSTAGRAM_LOGIN = None
     INSTAGRAM_PASSWORD = None
+    # keep login cookies in the output folder and reuse them on the next run
+    KEEP_SESSION = True
+    SESSION_FILE_NAME = "session.json"
 
     # optionally we could only scrape parts of what we need
     SCRAPE_POSTS = True
@@ -18,6 +22,78 @@ class Configuration:
     SCRAPE_COMMENTS = False
 
     MAXIMUM_POSTS = 52
+    # how many times a tag page is scrolled down to load more posts
+    MAX_SCROLLS = 10
+    # stop reading a tag page at the posts seen at its top in the last run
+    INCREMENTAL_TAGS = True
+    # skip tags without new posts for this long, doubled with every such run
+    TAG_BACKOFF_HOURS = 1.0
+
+    # where the content table is kept: "csv" (content.csv) or "sqlite" (content.db)
+    STORAGE_BACKEND = "csv"
+    # csv backend: append changed posts to a journal instead of rewriting the table
+    STORAGE_JOURNAL = False
+    # save table changes every N posts while scraping images/comments, 0 - only at the end
+    CHECKPOINT_EVERY = 0
+    # keep tag/image/comment work in a persistent queue (frontier.db) to resume runs
+    USE_FRONTIER = False
+    # frontier: attempts per work item before it is given up
+    FRONTIER_MAX_ATTEMPTS = 3
+
+    # "script" - extract posts/comments with one script call per page,
+    # "elements" - one webdriver call per element
+    EXTRACTION_MODE = "script"
+
+    # browser profile: no window, no images/videos/fonts loaded in the browser
+    HEADLESS = False
+    BLOCK_RESOURCES = False
+
+    # number of browsers scraping tag pages and comments in parallel
+    BROWSER_WORKERS = 1
+    # post pages loaded at once (one tab each) while scraping comments
+    COMMENT_TABS = 4
+    # save the html of every post page to <output>/debug/
+    DEBUG_PAGES = False
+    DEBUG_FOLDER_NAME = "debug"
+
+    # counters and timings of the run, written to the output folder at exit:
+    # prometheus text format (for the node exporter textfile collector) and json
+    METRICS_FILE_NAME = "metrics.prom"
+    RUN_SUMMARY_FILE_NAME = "run_summary.json"
+    # also serve them on http://<host>:<port>/metrics while running, 0 - don't
+    METRICS_PORT = 0
+
+    # shrink saved images to fit this many pixels per side, 0 - keep as downloaded
+    IMAGE_MAX_SIZE = 0
+    # "sequential" - img_<N>.jpg, "content" - named by content hash, stored once
+    IMAGE_LAYOUT = "sequential"
+    # content layout: also detect near-duplicate images by perceptual hash
+    PHASH_DEDUP = False
+
+    # number of images downloaded in parallel
+    DOWNLOAD_WORKERS = 8
+
+    # run all stages on one asyncio event loop instead of threads (needs aiohttp)
+    ASYNC_MODE = False
+    # asyncio mode: images downloaded at once, replaces DOWNLOAD_WORKERS
+    ASYNC_DOWNLOADS = 256
+
+    # several nodes: a "coordinator" hands out the work and is the only one
+    # writing the output folder, "worker"s scrape what they are given
+    DISTRIBUTED_ROLE = "single"
+    # host:port the coordinator listens on and its workers connect to
+    COORDINATOR_ADDRESS = "127.0.0.1:50505"
+    # shared secret of a coordinator and its workers
+    COORDINATOR_AUTHKEY = None
+
+    # requests per second: page loads (tag and post pages together) over all
+    # browsers, image downloads per cdn host; lowered automatically when
+    # throttled, 0 - unlimited (page loads were unlimited before PAGE_RATE)
+    PAGE_RATE = 0.5
+    IMAGE_RATE = 20.0
+
+    # write a parquet dataset of all posts here after scraping, None - don't
+    EXPORT_PARQUET_PATH = None
 
     # list of comapny names that are being scraped
     COMPANIES = []
@@ -36,11 +112,77 @@ class Configuration:
         self.INSTAGRAM_LOGIN = args.instagram_login or self.INSTAGRAM_LOGIN
         self.INSTAGRAM_PASSWORD = args.instagram_password or self.INSTAGRAM_PASSWORD
 
+        self.KEEP_SESSION = self.KEEP_SESSION and not args.no_keep_session
+
         self.SCRAPE_POSTS = self.SCRAPE_POSTS if not args.scrape_posts else True
         self.SCRAPE_IMAGES = args.scrape_images or self.SCRAPE_IMAGES
         self.SCRAPE_COMMENTS = args.scrape_comments or self.SCRAPE_COMMENTS
 
         self.COMPANIES = args.companies or self.COMPANIES
+        self.EXPORT_PARQUET_PATH = args.export_parquet or self.EXPORT_PARQUET_PATH
+
+        self.STORAGE_BACKEND = args.storage_backend or self.STORAGE_BACKEND
+        self.STORAGE_JOURNAL = args.storage_journal or self.STORAGE_JOURNAL
+        self.CHECKPOINT_EVERY = (
+            args.checkpoint_every
+            if args.checkpoint_every is not None
+            else self.CHECKPOINT_EVERY
+        )
+        self.USE_FRONTIER = args.frontier or self.USE_FRONTIER
+        self.FRONTIER_MAX_ATTEMPTS = (
+            args.frontier_max_attempts
+            if args.frontier_max_attempts is not None
+            else self.FRONTIER_MAX_ATTEMPTS
+        )
+        self.MAX_SCROLLS = (
+            args.max_scrolls if args.max_scrolls is not None else self.MAX_SCROLLS
+        )
+        self.INCREMENTAL_TAGS = self.INCREMENTAL_TAGS and not args.no_incremental_tags
+        self.TAG_BACKOFF_HOURS = (
+            args.tag_backoff_hours
+            if args.tag_backoff_hours is not None
+            else self.TAG_BACKOFF_HOURS
+        )
+        self.EXTRACTION_MODE = args.extraction_mode or self.EXTRACTION_MODE
+        self.HEADLESS = args.headless or self.HEADLESS
+        self.BLOCK_RESOURCES = args.block_resources or self.BLOCK_RESOURCES
+        self.BROWSER_WORKERS = (
+            args.browser_workers
+            if args.browser_workers is not None
+            else self.BROWSER_WORKERS
+        )
+        self.COMMENT_TABS = (
+            args.comment_tabs if args.comment_tabs is not None else self.COMMENT_TABS
+        )
+        self.DEBUG_PAGES = args.debug_pages or self.DEBUG_PAGES
+        self.METRICS_PORT = (
+            args.metrics_port if args.metrics_port is not None else self.METRICS_PORT
+        )
+        self.DOWNLOAD_WORKERS = (
+            args.download_workers
+            if args.download_workers is not None
+            else self.DOWNLOAD_WORKERS
+        )
+        self.ASYNC_MODE = args.async_mode or self.ASYNC_MODE
+        self.ASYNC_DOWNLOADS = (
+            args.async_downloads
+            if args.async_downloads is not None
+            else self.ASYNC_DOWNLOADS
+        )
+        self.DISTRIBUTED_ROLE = args.role or self.DISTRIBUTED_ROLE
+        self.COORDINATOR_ADDRESS = args.coordinator_address or self.COORDINATOR_ADDRESS
+        self.COORDINATOR_AUTHKEY = args.coordinator_authkey or self.COORDINATOR_AUTHKEY
+        self.PAGE_RATE = args.page_rate if args.page_rate is not None else self.PAGE_RATE
+        self.IMAGE_RATE = (
+            args.image_rate if args.image_rate is not None else self.IMAGE_RATE
+        )
+        self.IMAGE_MAX_SIZE = (
+            args.image_max_size
+            if args.image_max_size is not None
+            else self.IMAGE_MAX_SIZE
+        )
+        self.IMAGE_LAYOUT = args.image_layout or self.IMAGE_LAYOUT
+        self.PHASH_DEDUP = args.phash_dedup or self.PHASH_DEDUP
 
     def _load_from_env(self):
         if not self.ENV_PATH or not os.path.exists(self.ENV_PATH):
@@ -53,16 +195,109 @@ class Configuration:
         )
         self.INSTAGRAM_LOGIN = os.getenv("INSTAGRAM_LOGIN")
         self.INSTAGRAM_PASSWORD = os.getenv("INSTAGRAM_PASSWORD")
+        self.KEEP_SESSION = self._load_bool_var("KEEP_SESSION", self.KEEP_SESSION)
         self.SCRAPE_POSTS = self._load_bool_var("SCRAPE_POSTS")
         self.SCRAPE_IMAGES = self._load_bool_var("SCRAPE_IMAGES")
         self.SCRAPE_COMMENTS = self._load_bool_var("SCRAPE_COMMENTS")
+        self.STORAGE_BACKEND = os.getenv("STORAGE_BACKEND") or self.STORAGE_BACKEND
+        self.EXPORT_PARQUET_PATH = (
+            os.getenv("EXPORT_PARQUET_PATH") or self.EXPORT_PARQUET_PATH
+        )
+        self.STORAGE_JOURNAL = self._load_bool_var(
+            "STORAGE_JOURNAL", self.STORAGE_JOURNAL
+        )
+        self.CHECKPOINT_EVERY = self._load_int_var(
+            "CHECKPOINT_EVERY", self.CHECKPOINT_EVERY
+        )
+        self.USE_FRONTIER = self._load_bool_var("USE_FRONTIER", self.USE_FRONTIER)
+        self.FRONTIER_MAX_ATTEMPTS = self._load_int_var(
+            "FRONTIER_MAX_ATTEMPTS", self.FRONTIER_MAX_ATTEMPTS
+        )
+        self.MAX_SCROLLS = self._load_int_var("MAX_SCROLLS", self.MAX_SCROLLS)
+        self.INCREMENTAL_TAGS = self._load_bool_var(
+            "INCREMENTAL_TAGS", self.INCREMENTAL_TAGS
+        )
+        self.TAG_BACKOFF_HOURS = self._load_float_var(
+            "TAG_BACKOFF_HOURS", self.TAG_BACKOFF_HOURS
+        )
+        self.EXTRACTION_MODE = os.getenv("EXTRACTION_MODE") or self.EXTRACTION_MODE
+        self.HEADLESS = self._load_bool_var("HEADLESS", self.HEADLESS)
+        self.BLOCK_RESOURCES = self._load_bool_var(
+            "BLOCK_RESOURCES", self.BLOCK_RESOURCES
+        )
+        self.BROWSER_WORKERS = self._load_int_var(
+            "BROWSER_WORKERS", self.BROWSER_WORKERS
+        )
+        self.COMMENT_TABS = self._load_int_var("COMMENT_TABS", self.COMMENT_TABS)
+        self.DEBUG_PAGES = self._load_bool_var("DEBUG_PAGES", self.DEBUG_PAGES)
+        self.METRICS_PORT = self._load_int_var("METRICS_PORT", self.METRICS_PORT)
+        self.DOWNLOAD_WORKERS = self._load_int_var(
+            "DOWNLOAD_WORKERS", self.DOWNLOAD_WORKERS
+        )
+        self.ASYNC_MODE = self._load_bool_var("ASYNC_MODE", self.ASYNC_MODE)
+        self.ASYNC_DOWNLOADS = self._load_int_var(
+            "ASYNC_DOWNLOADS", self.ASYNC_DOWNLOADS
+        )
+        self.DISTRIBUTED_ROLE = os.getenv("DISTRIBUTED_ROLE") or self.DISTRIBUTED_ROLE
+        self.COORDINATOR_ADDRESS = (
+            os.getenv("COORDINATOR_ADDRESS") or self.COORDINATOR_ADDRESS
+        )
+        self.COORDINATOR_AUTHKEY = (
+            os.getenv("COORDINATOR_AUTHKEY") or self.COORDINATOR_AUTHKEY
+        )
+        self.PAGE_RATE = self._load_float_var("PAGE_RATE", self.PAGE_RATE)
+        self.IMAGE_RATE = self._load_float_var("IMAGE_RATE", self.IMAGE_RATE)
+        self.IMAGE_MAX_SIZE = self._load_int_var("IMAGE_MAX_SIZE", self.IMAGE_MAX_SIZE)
+        self.IMAGE_LAYOUT = os.getenv("IMAGE_LAYOUT") or self.IMAGE_LAYOUT
+        self.PHASH_DEDUP = self._load_bool_var("PHASH_DEDUP", self.PHASH_DEDUP)
 
     def _validate(self):
+        if self.STORAGE_BACKEND not in ("csv", "sqlite"):
+            raise ValueError(f"Unknown storage backend `{self.STORAGE_BACKEND}`")
+        if self.EXTRACTION_MODE not in ("script", "elements"):
+            raise ValueError(f"Unknown extraction mode `{self.EXTRACTION_MODE}`")
+        if self.BROWSER_WORKERS < 1:
+            raise ValueError("BROWSER_WORKERS must be a positive number")
+        if self.COMMENT_TABS < 1:
+            raise ValueError("COMMENT_TABS must be a positive number")
+        if self.DOWNLOAD_WORKERS < 1:
+            raise ValueError("DOWNLOAD_WORKERS must be a positive number")
+        if self.ASYNC_DOWNLOADS < 1:
+            raise ValueError("ASYNC_DOWNLOADS must be a positive number")
+        if self.FRONTIER_MAX_ATTEMPTS < 1:
+            raise ValueError("FRONTIER_MAX_ATTEMPTS must be a positive number")
+        if self.CHECKPOINT_EVERY < 0:
+            raise ValueError("CHECKPOINT_EVERY can't be negative")
+        if self.MAX_SCROLLS < 0:
+            raise ValueError("MAX_SCROLLS can't be negative")
+        if not 0 <= self.METRICS_PORT <= 65535:
+            raise ValueError("METRICS_PORT must be a port number or 0")
+        if self.DISTRIBUTED_ROLE not in ("single", "coordinator", "worker"):
+            raise ValueError(f"Unknown distributed role `{self.DISTRIBUTED_ROLE}`")
+        if self.DISTRIBUTED_ROLE != "single":
+            host, _, port = self.COORDINATOR_ADDRESS.rpartition(":")
+            if not host or not port.isdigit() or not 0 < int(port) <= 65535:
+                raise ValueError("COORDINATOR_ADDRESS must be host:port")
+            if not self.COORDINATOR_AUTHKEY:
+                raise ValueError("COORDINATOR_AUTHKEY is needed to run distributed")
+            if self.ASYNC_MODE:
+                raise ValueError("ASYNC_MODE can't be used for a coordinator or worker")
+        if self.TAG_BACKOFF_HOURS < 0:
+            raise ValueError("TAG_BACKOFF_HOURS can't be negative")
+        if self.PAGE_RATE < 0 or self.IMAGE_RATE < 0:
+            raise ValueError("PAGE_RATE and IMAGE_RATE can't be negative")
+        if self.IMAGE_MAX_SIZE < 0:
+            raise ValueError("IMAGE_MAX_SIZE can't be negative")
+        if self.IMAGE_LAYOUT not in ("sequential", "content"):
+            raise ValueError(f"Unknown image layout `{self.IMAGE_LAYOUT}`")
+        if self.PHASH_DEDUP and self.IMAGE_LAYOUT != "content":
+            raise ValueError("PHASH_DEDUP needs the `content` image layout")
         if self.SCRAPE_COMMENTS and (
             self.INSTAGRAM_LOGIN is None or self.INSTAGRAM_PASSWORD is None
         ):
             raise AttributeError(
-                "For scraping instagram comments authentication is needed, please provide login and password"
+                "For scraping instagram comments authentication is needed, please "
+                "provide login and password"
             )
 
     def _load_bool_var(self, name: str, default_value: bool | None = None) -> bool:
@@ -86,8 +321,37 @@ class Configuration:
             raise ValueError(f"Invalid value `{value}` for variable `{name}`")
         return value.lower() in true_
 
+    def _load_int_var(self, name: str, default_value: int | None = None) -> int:
+        value: str | None = os.getenv(name, None)
+        if value is None:
+            if default_value is None:
+                raise ValueError(f"Variable `{name}` not set!")
+            return default_value
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError(f"Invalid value `{value}` for variable `{name}`")
+
+    def _load_float_var(self, name: str, default_value: float | None = None) -> float:
+        value: str | None = os.getenv(name, None)
+        if value is None:
+            if default_value is None:
+                raise ValueError(f"Variable `{name}` not set!")
+            return default_value
+        try:
+            return float(value)
+        except ValueError:
+            raise ValueError(f"Invalid value `{value}` for variable `{name}`")
+
 
-def load_configuration(root_dir: str) -> Configuration:
+def load_configuration(
+    root_dir: str, args: tp.Optional[argparse.Namespace] = None
+) -> Configuration:
+    return Configuration(args if args is not None else parse_arguments(), root_dir)
+
+
+def parse_arguments(argv: tp.Optional[tp.List[str]] = None) -> argparse.Namespace:
+    # kept free of heavy imports: --help and bad options exit right away
     parser = argparse.ArgumentParser(description="args for Instagram scraper")
     parser.add_argument(
         "-il",
@@ -105,6 +369,15 @@ def load_configuration(root_dir: str) -> Configuration:
         help="Instagram password for authorization",
         required=False,
     )
+    parser.add_argument(
+        "--no-keep-session",
+        action="store_true",
+        required=False,
+        help=(
+            "Don't save login cookies to the output folder and always log in through the "
+            "login form.\n"
+        ),
+    )
     parser.add_argument(
         "-op",
         "--output-path",
@@ -117,13 +390,20 @@ def load_configuration(root_dir: str) -> Configuration:
         "--scrape-posts",
         action="store_true",
         required=False,
-        help="Turn on-off scraping posts. If on, firstly the general posts by tags will be scraped and stored in content.csv. Else, the future scraping will be applied to all empty fields found in the table.\n",
+        help=(
+            "Turn on-off scraping posts. If on, firstly the general posts by tags will "
+            "be scraped and stored in content.csv. Else, the future scraping will be "
+            "applied to all empty fields found in the table.\n"
+        ),
     )
     parser.add_argument(
         "--scrape-images",
         action="store_true",
         required=False,
-        help="Turn on-off scraping images. If on, they will be saved along with posts in the folder, but only AFTER the table of posts was formed.\n",
+        help=(
+            "Turn on-off scraping images. If on, they will be saved along with posts in "
+            "the folder, but only AFTER the table of posts was formed.\n"
+        ),
     )
     parser.add_argument(
         "--scrape-comments",
@@ -135,7 +415,257 @@ def load_configuration(root_dir: str) -> Configuration:
         "--companies",
         nargs="+",
         required=False,
-        help="List companies you wish to scrape from. They are expected to be keys in companies.json that lies in the root. If none provided, will use ALL comapnies found in the file.\n",
+        help=(
+            "List companies you wish to scrape from. They are expected to be keys in "
+            "companies.json that lies in the root. If none provided, will use ALL "
+            "comapnies found in the file.\n"
+        ),
+    )
+    parser.add_argument(
+        "--export-parquet",
+        metavar="dataset_path",
+        type=str,
+        required=False,
+        help=(
+            "After scraping, export all posts to a parquet dataset at this path, "
+            "partitioned by company and scrape date.\n"
+        ),
+    )
+    parser.add_argument(
+        "--storage-backend",
+        choices=["csv", "sqlite"],
+        required=False,
+        help=(
+            "Where to keep the content table: content.csv or indexed content.db. An "
+            "existing content.csv is migrated to sqlite on first run.\n"
+        ),
+    )
+    parser.add_argument(
+        "--storage-journal",
+        action="store_true",
+        required=False,
+        help=(
+            "Append changed posts to content.journal on save instead of rewriting "
+            "content.csv. The journal is compacted into the table periodically and "
+            "replayed after a crash.\n"
+        ),
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        metavar="posts",
+        type=int,
+        required=False,
+        help="Save table changes every N posts while scraping images and comments.\n",
+    )
+    parser.add_argument(
+        "--frontier",
+        action="store_true",
+        required=False,
+        help=(
+            "Keep tag pages, image downloads and comment fetches in a persistent work "
+            "queue (frontier.db) so an interrupted run resumes where it stopped and "
+            "several processes can share the work.\n"
+        ),
+    )
+    parser.add_argument(
+        "--frontier-max-attempts",
+        metavar="attempts",
+        type=int,
+        required=False,
+        help="Attempts per frontier item before it is marked failed and skipped.\n",
+    )
+    parser.add_argument(
+        "--max-scrolls",
+        metavar="scrolls",
+        type=int,
+        required=False,
+        help=(
+            "How many times a tag page is scrolled down to load more posts, 0 reads only "
+            "the first screen.\n"
+        ),
+    )
+    parser.add_argument(
+        "--no-incremental-tags",
+        action="store_true",
+        required=False,
+        help=(
+            "Read every tag page fully, ignoring what earlier runs have seen, and don't "
+            "skip tags that had no new posts.\n"
+        ),
+    )
+    parser.add_argument(
+        "--tag-backoff-hours",
+        metavar="hours",
+        type=float,
+        required=False,
+        help=(
+            "Skip a tag that brought no new posts for this many hours, doubled with "
+            "every further run without new posts. 0 never skips tags.\n"
+        ),
+    )
+    parser.add_argument(
+        "--extraction-mode",
+        choices=["script", "elements"],
+        required=False,
+        help=(
+            "How posts and comments are read from the page: one script call per page or "
+            "one webdriver call per element.\n"
+        ),
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        required=False,
+        help="Run browsers without a window.\n",
+    )
+    parser.add_argument(
+        "--block-resources",
+        action="store_true",
+        required=False,
+        help=(
+            "Don't load images, videos and fonts in the browser. Images are still "
+            "downloaded for posts.\n"
+        ),
+    )
+    parser.add_argument(
+        "--browser-workers",
+        metavar="workers",
+        type=int,
+        required=False,
+        help="Number of browser instances scraping tag pages and comments in parallel.\n",
+    )
+    parser.add_argument(
+        "--comment-tabs",
+        metavar="tabs",
+        type=int,
+        required=False,
+        help=(
+            "Number of post pages loaded at once, each in its own tab, while scraping "
+            "comments.\n"
+        ),
+    )
+    parser.add_argument(
+        "--debug-pages",
+        action="store_true",
+        required=False,
+        help=(
+            "Save the html of every scraped post page to the debug folder in the output "
+            "folder.\n"
+        ),
+    )
+    parser.add_argument(
+        "--metrics-port",
+        metavar="port",
+        type=int,
+        required=False,
+        help=(
+            "Serve the run's metrics in prometheus format on this port at /metrics while "
+            "scraping.\n"
+        ),
+    )
+    parser.add_argument(
+        "--download-workers",
+        metavar="workers",
+        type=int,
+        required=False,
+        help="Number of images downloaded in parallel.\n",
+    )
+    parser.add_argument(
+        "--async",
+        dest="async_mode",
+        action="store_true",
+        required=False,
+        help=(
+            "Run all stages on one asyncio event loop instead of threads, needs "
+            "aiohttp.\n"
+        ),
+    )
+    parser.add_argument(
+        "--async-downloads",
+        metavar="downloads",
+        type=int,
+        required=False,
+        help="With --async, number of images downloaded at once.\n",
+    )
+    parser.add_argument(
+        "--role",
+        choices=["single", "coordinator", "worker"],
+        required=False,
+        help=(
+            "Scrape on several nodes: the coordinator hands out tags and posts and "
+            "merges all results into its output folder, workers scrape them. Needs "
+            "--coordinator-authkey.\n"
+        ),
+    )
+    parser.add_argument(
+        "--coordinator-address",
+        metavar="host:port",
+        type=str,
+        required=False,
+        help=(
+            "Address the coordinator listens on (e.g. 0.0.0.0:50505) and workers connect "
+            "to.\n"
+        ),
+    )
+    parser.add_argument(
+        "--coordinator-authkey",
+        metavar="key",
+        type=str,
+        required=False,
+        help="Shared secret of the coordinator and its workers.\n",
+    )
+    parser.add_argument(
+        "--page-rate",
+        metavar="rate",
+        type=float,
+        required=False,
+        help=(
+            "Page loads per second, tag and post pages together, over all browsers, 0 "
+            "for no limit. Lowered automatically while pages time out.\n"
+        ),
+    )
+    parser.add_argument(
+        "--image-rate",
+        metavar="rate",
+        type=float,
+        required=False,
+        help=(
+            "Image downloads per second per cdn host, 0 for no limit. Lowered "
+            "automatically on 429 answers and timeouts.\n"
+        ),
+    )
+    parser.add_argument(
+        "--image-max-size",
+        metavar="pixels",
+        type=int,
+        required=False,
+        help=(
+            "Shrink saved images to fit this many pixels per side. By default images are "
+            "saved exactly as downloaded.\n"
+        ),
+    )
+    parser.add_argument(
+        "--image-layout",
+        choices=["sequential", "content"],
+        required=False,
+        help=(
+            "Name images img_<N>.jpg or by the hash of their content under images/, "
+            "storing identical images once and skipping downloads of known image urls.\n"
+        ),
+    )
+    parser.add_argument(
+        "--phash-dedup",
+        action="store_true",
+        required=False,
+        help=(
+            "With the content image layout also detect near-duplicate images by "
+            "perceptual hash and link them to the existing file.\n"
+        ),
+    )
+    parser.add_argument(
+        "--check-config",
+        action="store_true",
+        required=False,
+        help="Only load and validate the configuration, then exit.\n",
     )
-    args = parser.parse_args()
-    return Configuration(args, root_dir)
+    return parser.parse_args(argv)
@@ -0,0 +1,561 @@
+import typing as tp
+from collections import defaultdict
+from datetime import timedelta
+import logging
+from multiprocessing.connection import Client
+from multiprocessing.managers import BaseManager
+import os
+import queue
+import socket
+import tempfile
+import threading
+import time
+
+from .config import Configuration
+from .downloader import ImageDownloader
+from .frontier import Frontier
+from .metrics import METRICS, STAGE_SECONDS, WORKER_RESULTS
+from .post import Post
+from .scraping import (
+    _Checkpoint,
+    _create_instagrams,
+    _create_rate_limiter,
+    _filter_small_comments,
+    _load_companies,
+    _post_from_row,
+    _save_comments,
+    _save_downloaded_image,
+    _save_tag_posts,
+    _tag_is_due,
+    _write_metrics,
+)
+from .seen_index import SeenPostIndex
+from .storage import InstagramStorage
+
+if tp.TYPE_CHECKING:
+    from .instagram_api import InstagramApi
+
+# Scraping on several nodes. The coordinator owns the output folder: it puts
+# the tags, image downloads and comment fetches of every stage into its
+# frontier and leases them to workers over a multiprocessing manager (tcp,
+# authenticated with the shared key). Workers scrape what they lease and send
+# the results back; a single merger thread of the coordinator writes them to
+# storage, so storage is never used concurrently. A worker that dies loses
+# its lease, the items go to another worker once the lease expires.
+# Stages run one after another like in scrape_instagram, the workers follow.
+
+STAGES = (("tag", "posts"), ("image", "images"), ("comment", "comments"))
+# a dead worker's items are leased again after this long
+LEASE_SECONDS = 300
+# how often idle workers ask for work and the merger checks a stage is done
+POLL_SECONDS = 1.0
+# merged results are saved at least this often, besides CHECKPOINT_EVERY
+SAVE_SECONDS = 30
+# coordinator: how long workers get to hear the run is over before it exits
+RELEASE_SECONDS = 10
+# worker: how long to wait for the coordinator to come up
+CONNECT_SECONDS = 60
+
+
+class _CoordinatorServer(BaseManager):
+    pass
+
+
+class _CoordinatorClient(BaseManager):
+    pass
+
+
+_CoordinatorClient.register("coordinator")
+
+
+def _parse_address(address: str) -> tp.Tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host, int(port)
+
+
+class Coordinator:
+    # Methods in the first group are called by workers, on the manager's
+    # connection threads. They and the merger share one lock for storage,
+    # the seen index and the frontier.
+
+    def __init__(
+        self,
+        storage: InstagramStorage,
+        configuration: Configuration,
+        companies: tp.Dict[str, tp.List[str]],
+    ):
+        self.storage = storage
+        self.configuration = configuration
+        self.companies = companies
+        self.frontier = Frontier(
+            os.path.join(storage.folder_path, Frontier.FRONTIER_NAME),
+            max_attempts=configuration.FRONTIER_MAX_ATTEMPTS,
+            lease_seconds=LEASE_SECONDS,
+        )
+        self.seen_posts = SeenPostIndex(storage)
+        self.posts_per_company: tp.Dict[str, int] = defaultdict(int)
+        self.scraped_posts: tp.List[Post] = []
+        self._lock = threading.Lock()
+        # (kind, worker id, [(key, result)]) for the merger
+        self._results: queue.Queue = queue.Queue()
+        # kind of the stage being handed out, "done" once all are finished
+        self._stage: tp.Optional[str] = None
+        self._workers: tp.Set[str] = set()
+        self._released: tp.Set[str] = set()
+        self._server = None
+        self._serving = False
+
+    def stages(self) -> tp.Dict[str, bool]:
+        return {
+            "posts": self.configuration.SCRAPE_POSTS,
+            "images": self.configuration.SCRAPE_IMAGES,
+            "comments": self.configuration.SCRAPE_COMMENTS,
+        }
+
+    def lease(self, worker_id: str, limits: tp.Dict[str, int]) -> tp.Dict[str, tp.Any]:
+        # {"stage": kind, "items": [(key, payload)]}, no items if everything
+        # of the stage is leased; stage "wait" before the first one and
+        # "done" at the end
+        with self._lock:
+            self._workers.add(worker_id)
+            if self._stage == "done":
+                self._released.add(worker_id)
+            if self._stage in (None, "done"):
+                return {"stage": self._stage or "wait", "items": []}
+            kind = self._stage
+            # a worker asking for more is alive, its unmerged items stay its own
+            self.frontier.renew(kind, owner=worker_id)
+            items = self.frontier.lease(kind, limits.get(kind, 1), owner=worker_id)
+            return {
+                "stage": kind,
+                "items": [(item.key, self._work_payload(item.payload)) for item in items],
+            }
+
+    def is_seen(self, post_id: str) -> bool:
+        with self._lock:
+            return self.seen_posts.is_seen(post_id)
+
+    def submit(self, worker_id: str, kind: str, results: tp.List[tp.Tuple[str, tp.Any]]):
+        # merged later, the worker goes on scraping; its leases are renewed
+        # until the merger got to its results
+        with self._lock:
+            self.frontier.renew(kind, owner=worker_id)
+        self._results.put((kind, worker_id, results))
+
+    def fail(self, worker_id: str, kind: str, key: str, error: str):
+        logging.info(f"Worker {worker_id} failed {kind} {key}: {error}")
+        with self._lock:
+            self.frontier.fail(kind, key, f"{worker_id}: {error}", owner=worker_id)
+
+    def _work_payload(self, payload: tp.Dict[str, tp.Any]) -> tp.Dict[str, tp.Any]:
+        # tags get the company's remaining quota and the tag's known posts at
+        # the time they are handed out, like scraping.scrape_posts_by_tags
+        if self._stage != "tag":
+            return payload
+        incremental = self.configuration.INCREMENTAL_TAGS
+        return dict(
+            payload,
+            remaining=(
+                self.configuration.MAXIMUM_POSTS
+                - self.posts_per_company[payload["company"]]
+            ),
+            known_post_ids=(
+                self.storage.get_tag_state(payload["tag"]).recent_post_ids
+                if incremental
+                else None
+            ),
+        )
+
+    def serve(self, address: tp.Tuple[str, int], authkey: bytes):
+        _CoordinatorServer.register(
+            "coordinator",
+            callable=lambda: self,
+            exposed=("stages", "lease", "is_seen", "submit", "fail"),
+        )
+        self._server = _CoordinatorServer(address=address, authkey=authkey).get_server()
+        # set by serve_forever, ends the connection threads
+        self._server.stop_event = threading.Event()
+        self._serving = True
+        threading.Thread(
+            target=self._accept, name="coordinator-server", daemon=True
+        ).start()
+        logging.info(f"Coordinator listening on {address[0]}:{address[1]}")
+
+    def stop_serving(self):
+        self._serving = False
+        self._server.stop_event.set()
+        # wakes the accept loop up, like multiprocessing.resource_sharer
+        try:
+            Client(self._server.address).close()
+        except OSError:
+            pass
+
+    def _accept(self):
+        # Server.serve_forever's loop, one that can be stopped: a thread per
+        # worker connection, every call answered by handle_request
+        listener = self._server.listener
+        while True:
+            try:
+                connection = listener.accept()
+            except OSError:
+                if not self._serving:
+                    break
+                continue
+            if not self._serving:
+                connection.close()
+                break
+            threading.Thread(
+                target=self._server.handle_request, args=(connection,), daemon=True
+            ).start()
+        listener.close()
+
+    def run(self):
+        # the stages, then waits a little for the workers to hear about it
+        for kind, stage in STAGES:
+            if not self.stages()[stage]:
+                continue
+            with STAGE_SECONDS.time(stage=stage):
+                with self._lock:
+                    self._start_stage(kind)
+                self._merge_stage(kind)
+        with self._lock:
+            self._stage = "done"
+        deadline = time.monotonic() + RELEASE_SECONDS
+        while time.monotonic() < deadline:
+            with self._lock:
+                if self._released >= self._workers:
+                    break
+            time.sleep(POLL_SECONDS / 10)
+
+    def close(self):
+        self.seen_posts.close()
+        self.frontier.close()
+
+    def _start_stage(self, kind: str):
+        if kind == "tag":
+            incremental = self.configuration.INCREMENTAL_TAGS
+            tag_backoff = timedelta(hours=self.configuration.TAG_BACKOFF_HOURS)
+            self.frontier.start_round(
+                "tag",
+                (
+                    (f"{company}/{tag}", {"company": company, "tag": tag})
+                    for company, tags in self.companies.items()
+                    for tag in tags
+                    if _tag_is_due(self.storage, tag, incremental, tag_backoff)
+                ),
+            )
+        elif kind == "image":
+            if self.configuration.SCRAPE_POSTS:
+                posts: tp.Iterable[Post] = self.scraped_posts
+            else:
+                posts = self.storage.iter_posts_with_no_image()
+            self.frontier.enqueue("image", self._images_to_download(posts))
+            self.storage.save_table_changes()
+        else:
+            if self.configuration.SCRAPE_POSTS:
+                posts = self.scraped_posts
+            else:
+                posts = self.storage.iter_posts_with_no_comment()
+            self.frontier.enqueue("comment", ((post.id, post.to_row()) for post in posts))
+        logging.info(f"Frontier {kind} items: {self.frontier.counts(kind)}")
+        self._stage = kind
+
+    def _images_to_download(
+        self, posts: tp.Iterable[Post]
+    ) -> tp.Iterator[tp.Tuple[str, tp.Dict[str, tp.Any]]]:
+        # images already in the store are linked instead
+        for post in posts:
+            known_file = self.storage.known_image_file(post.image_url)
+            if known_file is None:
+                yield post.id, {"image_url": post.image_url}
+            else:
+                self.storage.link_image_for_post(post.id, known_file)
+
+    def _merge_stage(self, kind: str):
+        # the merger: returns once every item of the stage is merged and saved
+        checkpoint = _Checkpoint(
+            self.storage, self.configuration.CHECKPOINT_EVERY, self.frontier, kind
+        )
+        # an item whose lease expired is leased again, its results may come
+        # twice: only the first successful ones are merged
+        merged: tp.Set[str] = set()
+        saved_at = time.monotonic()
+        while True:
+            try:
+                result_kind, worker_id, results = self._results.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                results = None
+            with self._lock:
+                if results is not None and result_kind == kind:
+                    for key, result in results:
+                        if key in merged:
+                            logging.info(f"Ignoring repeated {kind} {key} of {worker_id}")
+                            continue
+                        if self._merge(kind, key, result, checkpoint):
+                            merged.add(key)
+                    WORKER_RESULTS.inc(len(results), kind=kind, worker=worker_id)
+                elif results is not None:
+                    # late answer to a lease of a finished stage
+                    logging.info(f"Ignoring {result_kind} results of {worker_id}")
+                counts = self.frontier.counts(kind)
+                open_items = counts.get("pending", 0) + counts.get("leased", 0)
+                # everything open may be merged, just not saved yet
+                if open_items <= checkpoint.unsaved or (
+                    time.monotonic() - saved_at >= SAVE_SECONDS
+                ):
+                    checkpoint.save()
+                    saved_at = time.monotonic()
+                    counts = self.frontier.counts(kind)
+                    open_items = counts.get("pending", 0) + counts.get("leased", 0)
+                if not open_items and self._results.empty():
+                    logging.info(f"Frontier {kind} items: {counts}")
+                    return
+
+    def _merge(
+        self, kind: str, key: str, result: tp.Dict[str, tp.Any], checkpoint
+    ) -> bool:
+        # False if the worker failed the item, it may be leased again
+        if kind == "tag":
+            scraped = None
+            if result["posts"] is not None:
+                scraped = (
+                    [_post_from_row(post_id, row) for post_id, row in result["posts"]],
+                    result["page_post_ids"],
+                )
+            self.scraped_posts.extend(
+                _save_tag_posts(
+                    self.storage,
+                    self.seen_posts,
+                    self.posts_per_company,
+                    self.configuration.MAXIMUM_POSTS,
+                    result["company"],
+                    result["tag"],
+                    scraped,
+                    self.configuration.INCREMENTAL_TAGS,
+                )
+            )
+            checkpoint.done(key)
+            return True
+        if kind == "image":
+            path = None
+            if result["content"] is not None:
+                descriptor, path = tempfile.mkstemp(
+                    suffix=".part", dir=self.storage.incoming_path
+                )
+                with os.fdopen(descriptor, "wb") as file:
+                    file.write(result["content"])
+            post = Post(key, result["image_url"], "")
+            _save_downloaded_image(post, path, self.storage, checkpoint)
+            return path is not None
+        post = _post_from_row(key, result["row"])
+        _save_comments(post, result["success"], self.storage, checkpoint)
+        return result["success"]
+
+
+def run_coordinator(storage: InstagramStorage, configuration: Configuration):
+    companies = _load_companies(
+        companies_file=configuration.COMPANIES_FILE_PATH,
+        list_of_companies=configuration.COMPANIES,
+    )
+    coordinator = Coordinator(storage, configuration, companies)
+    coordinator.serve(
+        _parse_address(configuration.COORDINATOR_ADDRESS),
+        configuration.COORDINATOR_AUTHKEY.encode(),
+    )
+
+    metrics_server = None
+    if configuration.METRICS_PORT:
+        metrics_server = METRICS.serve(configuration.METRICS_PORT)
+
+    status = "failed"
+    try:
+        coordinator.run()
+        status = "completed"
+    finally:
+        coordinator.stop_serving()
+        coordinator.close()
+        _write_metrics(storage, configuration, status)
+        if metrics_server is not None:
+            metrics_server.shutdown()
+    logging.info(f"Merged results per worker: {WORKER_RESULTS.summary()}")
+
+
+def _connect(address: tp.Tuple[str, int], authkey: bytes):
+    # the coordinator's proxy, waiting for it to come up
+    manager = _CoordinatorClient(address=address, authkey=authkey)
+    deadline = time.monotonic() + CONNECT_SECONDS
+    while True:
+        try:
+            manager.connect()
+            return manager.coordinator()
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(POLL_SECONDS)
+
+
+def run_worker(
+    configuration: Configuration,
+    driver_factory: tp.Optional[tp.Callable[[], tp.Any]] = None,
+):
+    # driver_factory starts a browser, only called if the coordinator runs
+    # the posts or comments stage
+    address = configuration.COORDINATOR_ADDRESS
+    coordinator = _connect(
+        _parse_address(address), configuration.COORDINATOR_AUTHKEY.encode()
+    )
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    logging.info(f"Worker {worker_id} connected to the coordinator at {address}")
+    # the coordinator decides what is scraped
+    stages = coordinator.stages()
+    configuration.SCRAPE_POSTS = stages["posts"]
+    configuration.SCRAPE_IMAGES = stages["images"]
+    configuration.SCRAPE_COMMENTS = stages["comments"]
+    if configuration.SCRAPE_COMMENTS and (
+        configuration.INSTAGRAM_LOGIN is None or configuration.INSTAGRAM_PASSWORD is None
+    ):
+        raise AttributeError("The coordinator scrapes comments, please provide login")
+
+    rate_limiter = _create_rate_limiter(configuration, configuration.DOWNLOAD_WORKERS)
+    image_downloader = ImageDownloader(
+        max_workers=configuration.DOWNLOAD_WORKERS, rate_limiter=rate_limiter
+    )
+    driver_pool = None
+    if configuration.SCRAPE_POSTS or configuration.SCRAPE_COMMENTS:
+        from .driver_pool import DriverPool
+
+        # one browser per worker, run more workers to use more browsers
+        driver_pool = DriverPool(1, driver_factory)
+    try:
+        with tempfile.TemporaryDirectory() as work_folder:
+            # sessions and debug pages are kept locally, downloads sent back
+            instagrams = _create_instagrams(
+                configuration.SCRAPER_OUTPUT_PATH or work_folder,
+                driver_pool,
+                configuration,
+                rate_limiter,
+                image_downloader,
+            )
+            _work(
+                coordinator,
+                worker_id,
+                instagrams[0] if instagrams else None,
+                image_downloader,
+                configuration,
+                work_folder,
+            )
+    except (EOFError, ConnectionError) as error:
+        # leased items go to other workers when their lease expires
+        logging.error(f"Lost the connection to the coordinator: {error!r}")
+    finally:
+        image_downloader.close()
+        if driver_pool is not None:
+            driver_pool.quit()
+    rate_limiter.log_stats()
+
+
+def _work(
+    coordinator,
+    worker_id: str,
+    api: tp.Optional["InstagramApi"],
+    image_downloader: ImageDownloader,
+    configuration: Configuration,
+    work_folder: str,
+):
+    limits = {
+        "tag": 1,
+        "image": configuration.DOWNLOAD_WORKERS * 4,
+        "comment": configuration.COMMENT_TABS,
+    }
+    while True:
+        work = coordinator.lease(worker_id, limits)
+        kind, items = work["stage"], work["items"]
+        if kind == "done":
+            logging.info("The coordinator has no more work")
+            return
+        if not items:
+            time.sleep(POLL_SECONDS)
+            continue
+        if kind == "tag":
+            _scrape_tags(coordinator, worker_id, api, items)
+            continue
+        try:
+            if kind == "image":
+                results = _download_images(image_downloader, items, work_folder)
+            else:
+                results = _scrape_comments(api, items, configuration.COMMENT_TABS)
+        except Exception as error:
+            logging.exception(f"Failed scraping {len(items)} {kind} items")
+            for key, _ in items:
+                coordinator.fail(worker_id, kind, key, repr(error))
+            continue
+        coordinator.submit(worker_id, kind, results)
+
+
+def _scrape_tags(
+    coordinator,
+    worker_id: str,
+    api: "InstagramApi",
+    items: tp.List[tp.Tuple[str, tp.Dict[str, tp.Any]]],
+):
+    # see scraping.scrape_posts_by_tags, posts are checked against the
+    # coordinator's seen index while the page is read
+    for key, payload in items:
+        result = dict(company=payload["company"], tag=payload["tag"], posts=None)
+        if payload["remaining"] > 0:
+            page_post_ids: tp.List[str] = []
+
+            def filter_tag_post(post: Post) -> bool:
+                page_post_ids.append(post.id)
+                return not coordinator.is_seen(post.id)
+
+            known_post_ids = payload["known_post_ids"]
+            try:
+                tag_posts = api.scrape_posts_by_tag(
+                    payload["tag"],
+                    filter_function=filter_tag_post,
+                    maximum_posts=payload["remaining"],
+                    known_post_ids=set(known_post_ids) if known_post_ids else None,
+                )
+            except Exception as error:
+                logging.exception(f"Failed scraping tag {payload['tag']}")
+                coordinator.fail(worker_id, "tag", key, repr(error))
+                continue
+            result["posts"] = [(post.id, post.to_row()) for post in tag_posts]
+            result["page_post_ids"] = page_post_ids
+        coordinator.submit(worker_id, "tag", [(key, result)])
+
+
+def _download_images(
+    image_downloader: ImageDownloader,
+    items: tp.List[tp.Tuple[str, tp.Dict[str, tp.Any]]],
+    work_folder: str,
+) -> tp.List[tp.Tuple[str, tp.Dict[str, tp.Any]]]:
+    # the images' content goes back to the coordinator, None if it failed
+    results = []
+    downloads = image_downloader.fetch_many(
+        (((key, payload["image_url"]), payload["image_url"]) for key, payload in items),
+        to_directory=work_folder,
+    )
+    for (key, image_url), path in downloads:
+        content = None
+        if path is not None:
+            with open(path, "rb") as file:
+                content = file.read()
+            os.remove(path)
+        results.append((key, {"image_url": image_url, "content": content}))
+    return results
+
+
+def _scrape_comments(
+    api: "InstagramApi",
+    items: tp.List[tp.Tuple[str, tp.Dict[str, tp.Any]]],
+    tabs: int,
+) -> tp.List[tp.Tuple[str, tp.Dict[str, tp.Any]]]:
+    posts = [_post_from_row(key, row) for key, row in items]
+    scraped = api.scrape_comments_batch(
+        posts, max_comments=100, filter=_filter_small_comments, tabs=tabs
+    )
+    return [
+        (post.id, {"success": success, "row": post.to_row()}) for post, success in scraped
+    ]
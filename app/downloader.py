@@ -0,0 +1,245 @@
+import typing as tp
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from functools import partial
+from io import BytesIO
+import logging
+import os
+import random
+import tempfile
+import time
+
+from PIL import Image
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from .images import image_format, SIGNATURE_LENGTH
+from .metrics import (
+    DOWNLOAD_BYTES,
+    DOWNLOAD_RETRIES,
+    DOWNLOAD_SECONDS,
+    DOWNLOADS,
+    HTTP_RESPONSES,
+    THROTTLED,
+)
+from .rate_limit import RateLimiter, retry_after_seconds
+
+Key = tp.TypeVar("Key")
+
+# answers that mean we are sending too fast
+THROTTLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+def _unreachable(error: requests.ConnectionError) -> bool:
+    # dns failure or refused connection, retrying won't resolve the host or
+    # open the port; resets and dropped connections are worth another try
+    if isinstance(error, requests.Timeout) or not error.args:
+        return False
+    return isinstance(getattr(error.args[0], "reason", None), NewConnectionError)
+
+
+class ImageDownloader:
+    # Downloads images concurrently through one keep-alive session.
+    # Results are handed back to the calling thread, which stays the only
+    # one writing to storage.
+
+    def __init__(
+        self,
+        max_workers: int = 8,
+        max_attempts: int = 3,
+        backoff_base: float = 1.0,
+        backoff_max: float = 30.0,
+        timeout: float = 30.0,
+        validate_format: bool = True,
+        chunk_size: int = 64 * 1024,
+        rate_limiter: tp.Optional[RateLimiter] = None,
+    ):
+        self.max_workers = max(1, max_workers)
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.validate_format = validate_format
+        self.chunk_size = chunk_size
+        # paces requests per cdn host, not limited by default
+        self.rate_limiter = rate_limiter or RateLimiter()
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.max_workers, pool_maxsize=self.max_workers
+        )
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._executor: tp.Optional[ThreadPoolExecutor] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        self._session.close()
+
+    def _backoff_delay(self, attempt: int) -> float:
+        # exponential backoff with full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    def _get(self, image_url: str, stream: bool = False) -> requests.Response:
+        # rate limited request, throttling answers slow the host's bucket down
+        bucket = self.rate_limiter.bucket(RateLimiter.url_endpoint("image", image_url))
+        bucket.acquire()
+        try:
+            response = self._session.get(image_url, stream=stream, timeout=self.timeout)
+        except requests.Timeout:
+            HTTP_RESPONSES.inc(status="error")
+            THROTTLED.inc(endpoint="image")
+            bucket.on_throttle()
+            raise
+        except requests.ConnectionError:
+            # dns failure, refused or reset connection: not throttling
+            HTTP_RESPONSES.inc(status="error")
+            raise
+        HTTP_RESPONSES.inc(status=response.status_code)
+        if response.status_code in THROTTLE_STATUS_CODES:
+            THROTTLED.inc(endpoint="image")
+            bucket.on_throttle(retry_after_seconds(response.headers.get("Retry-After")))
+        else:
+            bucket.on_success()
+        return response
+
+    def fetch(self, image_url: str) -> tp.Optional[Image.Image]:
+        with DOWNLOAD_SECONDS.time(target="memory"):
+            image = self._fetch(image_url)
+        DOWNLOADS.inc(result="ok" if image is not None else "failed")
+        return image
+
+    def _fetch(self, image_url: str) -> tp.Optional[Image.Image]:
+        logging.info(f"Downloading img: {image_url}")
+        for attempt in range(self.max_attempts):
+            if attempt:
+                DOWNLOAD_RETRIES.inc()
+            attempts = f"{attempt + 1}/{self.max_attempts}"
+            try:
+                response = self._get(image_url)
+                if response.status_code == 200:
+                    DOWNLOAD_BYTES.inc(len(response.content))
+                    image = Image.open(BytesIO(response.content))
+                    image.load()
+                    return image
+                logging.info(
+                    f"Failed to download image, attempt {attempts}: "
+                    f"bad request {response.status_code}"
+                )
+            except requests.ConnectionError as e:
+                if _unreachable(e):
+                    logging.info(f"Failed to download image: {e}")
+                    return None
+                logging.info(f"Failed to download image, attempt {attempts}: {e}")
+            except Exception as e:
+                logging.info(f"Failed to download image, attempt {attempts}: {e}")
+            if attempt + 1 < self.max_attempts:
+                time.sleep(self._backoff_delay(attempt))
+        return None
+
+    def fetch_to_file(self, image_url: str, directory: str) -> tp.Optional[str]:
+        # Streams the response body into a temporary file in directory without
+        # decoding it, returns its path. Same directory as the final location
+        # keeps the later rename atomic.
+        with DOWNLOAD_SECONDS.time(target="file"):
+            path = self._fetch_to_file(image_url, directory)
+        DOWNLOADS.inc(result="ok" if path is not None else "failed")
+        return path
+
+    def _fetch_to_file(self, image_url: str, directory: str) -> tp.Optional[str]:
+        logging.info(f"Downloading img: {image_url}")
+        for attempt in range(self.max_attempts):
+            if attempt:
+                DOWNLOAD_RETRIES.inc()
+            attempts = f"{attempt + 1}/{self.max_attempts}"
+            try:
+                with self._get(image_url, stream=True) as response:
+                    if response.status_code == 200:
+                        return self._stream_to_file(response, directory, image_url)
+                    logging.info(
+                        f"Failed to download image, attempt {attempts}: "
+                        f"bad request {response.status_code}"
+                    )
+            except requests.ConnectionError as e:
+                if _unreachable(e):
+                    logging.info(f"Failed to download image: {e}")
+                    return None
+                logging.info(f"Failed to download image, attempt {attempts}: {e}")
+            except Exception as e:
+                logging.info(f"Failed to download image, attempt {attempts}: {e}")
+            if attempt + 1 < self.max_attempts:
+                time.sleep(self._backoff_delay(attempt))
+        return None
+
+    def _stream_to_file(
+        self, response: requests.Response, directory: str, image_url: str
+    ) -> tp.Optional[str]:
+        descriptor, path = tempfile.mkstemp(suffix=".part", dir=directory)
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                header = b""
+                size = 0
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    if len(header) < SIGNATURE_LENGTH:
+                        header += chunk[: SIGNATURE_LENGTH - len(header)]
+                    file.write(chunk)
+                    size += len(chunk)
+        except Exception:
+            os.remove(path)
+            raise
+        DOWNLOAD_BYTES.inc(size)
+        if self.validate_format and image_format(header) is None:
+            # not worth retrying, the server answered with something else
+            logging.info(f"Downloaded file is not an image: {image_url}")
+            os.remove(path)
+            return None
+        return path
+
+    def fetch_many(
+        self,
+        items: tp.Iterable[tp.Tuple[Key, str]],
+        to_directory: tp.Optional[str] = None,
+    ) -> tp.Iterator[tp.Tuple[Key, tp.Any]]:
+        # Yields (key, result) pairs in completion order, the result is a
+        # decoded image, or a temporary file path if to_directory is given.
+        # At most twice the number of workers is in flight so finished images
+        # don't pile up while the consumer is busy saving.
+        if to_directory is None:
+            fetch_function = self.fetch
+        else:
+            fetch_function = partial(self.fetch_to_file, directory=to_directory)
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="image-download"
+            )
+        pending: tp.Dict[Future, Key] = {}
+        items = iter(items)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < 2 * self.max_workers:
+                try:
+                    key, url = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[self._executor.submit(fetch_function, url)] = key
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception:
+                    logging.exception(f"Unexpected error downloading image for {key}")
+                    result = None
+                yield key, result
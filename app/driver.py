@@ -0,0 +1,48 @@
+import logging
+from selenium import webdriver
+
+# Resources the scraper never needs in the browser: images are downloaded
+# separately over http, videos and fonts are not used at all. Instagram cdn
+# urls carry a query string, hence the trailing wildcard.
+BLOCKED_URL_PATTERNS = [
+    "*.mp4*",
+    "*.m4s*",
+    "*.webm*",
+    "*.woff*",
+    "*.ttf*",
+    "*.otf*",
+    "*.jpg*",
+    "*.jpeg*",
+    "*.png*",
+    "*.gif*",
+    "*.webp*",
+    "*.heic*",
+]
+
+
+def create_driver(
+    headless: bool = False, block_resources: bool = False
+) -> webdriver.Chrome:
+    options = webdriver.ChromeOptions()
+    # return from get() on DOMContentLoaded, elements are waited for anyway
+    options.page_load_strategy = "eager"
+    options.add_argument("--disable-gpu")
+    options.add_argument("--mute-audio")
+    if headless:
+        options.add_argument("--headless=new")
+        options.add_argument("--window-size=1280,2000")
+    if block_resources:
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        options.add_argument("--autoplay-policy=user-gesture-required")
+        options.add_experimental_option(
+            "prefs", {"profile.managed_default_content_settings.images": 2}
+        )
+
+    driver = webdriver.Chrome(options=options)
+    if block_resources:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+    logging.info(
+        f"Started chrome (headless: {headless}, blocking resources: {block_resources})"
+    )
+    return driver
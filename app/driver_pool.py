@@ -0,0 +1,39 @@
+import typing as tp
+import logging
+from selenium import webdriver
+
+
+class DriverPool:
+    # Owns several browser instances, so independent pages (tags, posts)
+    # can be loaded in parallel, one worker thread per driver.
+
+    def __init__(self, size: int, driver_factory: tp.Callable[[], webdriver.Chrome]):
+        self.drivers: tp.List[webdriver.Chrome] = []
+        try:
+            for _ in range(max(1, size)):
+                self.drivers.append(driver_factory())
+        except Exception:
+            self.quit()
+            raise
+        logging.info(f"Started {len(self.drivers)} browser instances")
+
+    @property
+    def main_driver(self) -> webdriver.Chrome:
+        return self.drivers[0]
+
+    def __len__(self):
+        return len(self.drivers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.quit()
+
+    def quit(self):
+        for driver in self.drivers:
+            try:
+                driver.quit()
+            except Exception:
+                logging.exception("Failed to quit browser")
+        self.drivers = []
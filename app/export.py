@@ -0,0 +1,75 @@
+import argparse
+import logging
+import typing as tp
+import pandas as pd
+from .storage import InstagramStorage, create_storage
+
+# Columnar export of the content table for analytics: a parquet dataset
+# partitioned by company and scrape date (hive layout,
+# <path>/company=<name>/scrape_date=<yyyy-mm-dd>/...). Unlike content.csv,
+# tags and comments are list columns and number_comments stays an integer.
+
+PARTITION_COLUMNS = ["company", "scrape_date"]
+UNKNOWN_PARTITION = "unknown"
+
+
+def _split(value, separator: str) -> tp.List[str]:
+    return value.split(separator) if isinstance(value, str) and value else []
+
+
+def storage_to_parquet_frame(storage: InstagramStorage) -> pd.DataFrame:
+    table = storage.to_dataframe()
+    return pd.DataFrame(
+        {
+            "post_id": table["post_id"].astype("string"),
+            "image_url": table["image_url"].astype("string"),
+            "image_file": table["image_file"].astype("string"),
+            "caption": table["caption"].astype("string"),
+            "tags": [_split(tags, ",") for tags in table["tags"]],
+            "comments": [_split(comments, "\n") for comments in table["comments"]],
+            "number_comments": table["number_comments"].astype("Int64"),
+            # json list of {text, author, timestamp, likes}
+            "comment_details": table["comment_details"].astype("string"),
+            "company": table["company"].fillna(UNKNOWN_PARTITION).astype(str),
+            # posts stored before scrape dates were kept
+            "scrape_date": table["scraped_at"].fillna(UNKNOWN_PARTITION).astype(str),
+        }
+    )
+
+
+def export_parquet(storage: InstagramStorage, dataset_path: str) -> int:
+    # writes (adds to) the dataset at dataset_path, returns the number of posts
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ImportError("Parquet export needs pyarrow, run `pip install pyarrow`")
+    frame = storage_to_parquet_frame(storage)
+    frame.to_parquet(
+        dataset_path,
+        engine="pyarrow",
+        partition_cols=PARTITION_COLUMNS,
+        index=False,
+        existing_data_behavior="delete_matching",
+    )
+    logging.info(f"Exported {len(frame)} posts to {dataset_path}")
+    return len(frame)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="export scraped posts to a parquet dataset"
+    )
+    parser.add_argument("output_path", help="Scraper output folder.")
+    parser.add_argument("dataset_path", help="Folder of the parquet dataset.")
+    parser.add_argument("--storage-backend", choices=["csv", "sqlite"], default="csv")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    storage = create_storage(args.output_path, backend=args.storage_backend)
+    try:
+        export_parquet(storage, args.dataset_path)
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import typing as tp
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+
+# Persistent work queue (crawl frontier) shared by runs and processes.
+# Every item is identified by (kind, key) - kinds are "tag", "image" and
+# "comment" - and goes pending -> leased -> done, or back to pending on
+# failure until max_attempts is used up (then failed). A lease that is not
+# completed in time (the worker died) makes the item available again.
+
+
+class WorkItem(tp.NamedTuple):
+    kind: str
+    key: str
+    payload: tp.Dict[str, tp.Any]
+    attempts: int
+
+
+class Frontier:
+    FRONTIER_NAME = "frontier.db"
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS frontier (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            payload TEXT,
+            state TEXT NOT NULL DEFAULT 'pending',
+            lease_owner TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            PRIMARY KEY (kind, key)
+        );
+        CREATE INDEX IF NOT EXISTS frontier_state ON frontier (kind, state);
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_attempts: int = 3,
+        lease_seconds: float = 600,
+        worker_id: tp.Optional[str] = None,
+    ):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        # autocommit, transactions are opened explicitly where needed
+        self._connection = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(self.SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def enqueue(self, kind: str, items: tp.Iterable[tp.Tuple[str, tp.Any]]) -> int:
+        # adds (key, payload) items, returns how many were added or retried:
+        # items failed by an earlier run get max_attempts again, other keys
+        # already in the frontier are kept as is
+        cursor = self._connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.executemany(
+                "INSERT INTO frontier (kind, key, payload) VALUES (?, ?, ?) "
+                "ON CONFLICT (kind, key) DO UPDATE SET state = 'pending', "
+                "attempts = 0, last_error = NULL, payload = excluded.payload "
+                "WHERE state = 'failed'",
+                ((kind, key, json.dumps(payload)) for key, payload in items),
+            )
+            added = cursor.rowcount
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        return added
+
+    def start_round(self, kind: str, items: tp.Iterable[tp.Tuple[str, tp.Any]]) -> bool:
+        # For work repeated on every run (tag pages): continues the previous
+        # round if it has unfinished items, otherwise starts over with items.
+        # Returns True if an interrupted round is resumed.
+        if self._count_open(kind):
+            counts = self.counts(kind)
+            logging.info(f"Resuming unfinished {kind} work: {counts}")
+            return True
+        self._connection.execute("DELETE FROM frontier WHERE kind = ?", (kind,))
+        self.enqueue(kind, items)
+        return False
+
+    def lease(
+        self, kind: str, limit: int, owner: tp.Optional[str] = None
+    ) -> tp.List[WorkItem]:
+        # owner: who the items are leased to, this worker by default
+        now = time.time()
+        cursor = self._connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # expired leases that already used up their attempts
+            cursor.execute(
+                "UPDATE frontier SET state = 'failed', last_error = 'lease expired' "
+                "WHERE kind = ? AND state = 'leased' AND lease_expires < ? "
+                "AND attempts >= ?",
+                (kind, now, self.max_attempts),
+            )
+            rows = cursor.execute(
+                "SELECT key, payload, attempts FROM frontier WHERE kind = ? AND "
+                "(state = 'pending' OR (state = 'leased' AND lease_expires < ?)) "
+                "ORDER BY rowid LIMIT ?",
+                (kind, now, limit),
+            ).fetchall()
+            cursor.executemany(
+                "UPDATE frontier SET state = 'leased', lease_owner = ?, "
+                "lease_expires = ?, attempts = attempts + 1 "
+                "WHERE kind = ? AND key = ?",
+                (
+                    (owner or self.worker_id, now + self.lease_seconds, kind, key)
+                    for key, _, _ in rows
+                ),
+            )
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        return [
+            WorkItem(kind, key, json.loads(payload), attempts + 1)
+            for key, payload, attempts in rows
+        ]
+
+    def iter_leased(self, kind: str, batch_size: int = 100) -> tp.Iterator[WorkItem]:
+        # leases batch after batch until nothing is available
+        while True:
+            items = self.lease(kind, batch_size)
+            if not items:
+                return
+            yield from items
+
+    def renew(self, kind: str, owner: tp.Optional[str] = None):
+        # extends every lease of owner (this worker by default), for items
+        # still being worked on or done but not completed yet
+        self._connection.execute(
+            "UPDATE frontier SET lease_expires = ? "
+            "WHERE kind = ? AND state = 'leased' AND lease_owner = ?",
+            (time.time() + self.lease_seconds, kind, owner or self.worker_id),
+        )
+
+    def complete(self, kind: str, keys: tp.Iterable[str]):
+        self._connection.executemany(
+            "UPDATE frontier SET state = 'done', lease_owner = NULL "
+            "WHERE kind = ? AND key = ?",
+            ((kind, key) for key in keys),
+        )
+
+    def fail(
+        self, kind: str, key: str, error: str = "", owner: tp.Optional[str] = None
+    ):
+        # owner: only if the item is still leased to it, not after its lease
+        # expired and the item went to someone else
+        self._connection.execute(
+            "UPDATE frontier SET lease_owner = NULL, last_error = ?, "
+            "state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END "
+            "WHERE kind = ? AND key = ? AND (? IS NULL OR "
+            "(state = 'leased' AND lease_owner = ?))",
+            (error, self.max_attempts, kind, key, owner, owner),
+        )
+
+    def counts(self, kind: str) -> tp.Dict[str, int]:
+        return dict(
+            self._connection.execute(
+                "SELECT state, COUNT(*) FROM frontier WHERE kind = ? GROUP BY state",
+                (kind,),
+            ).fetchall()
+        )
+
+    def _count_open(self, kind: str) -> int:
+        return self._connection.execute(
+            "SELECT COUNT(*) FROM frontier "
+            "WHERE kind = ? AND state IN ('pending', 'leased')",
+            (kind,),
+        ).fetchone()[0]
@@ -0,0 +1,112 @@
+import typing as tp
+from collections import defaultdict
+from urllib.parse import urlsplit
+import json
+import logging
+import os
+from PIL import Image  # type: ignore
+
+# Index of the content addressed image store, kept as an append-only
+# json lines file next to the images. It remembers which file every image
+# url was saved to, so known images are not downloaded again, and optionally
+# perceptual hashes of all files to recognize near-duplicates.
+
+PHASH_BITS = 64
+PHASH_CHUNKS = 4  # near-duplicates share at least one exact 16 bit chunk
+
+
+def perceptual_hash(img: Image.Image) -> int:
+    # difference hash: compares neighbouring pixels of a 9x8 grayscale copy
+    pixels = list(img.convert("L").resize((9, 8)).getdata())
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            left = pixels[row * 9 + column]
+            right = pixels[row * 9 + column + 1]
+            value = (value << 1) | int(left > right)
+    return value
+
+
+def _phash_chunks(phash: int) -> tp.List[int]:
+    chunk_bits = PHASH_BITS // PHASH_CHUNKS
+    mask = (1 << chunk_bits) - 1
+    return [(phash >> (i * chunk_bits)) & mask for i in range(PHASH_CHUNKS)]
+
+
+class ImageIndex:
+    INDEX_NAME = "image_index.jsonl"
+
+    def __init__(self, folder_path: str, phash_distance: tp.Optional[int] = None):
+        # phash_distance: maximum number of differing bits for two images to
+        # be treated as the same, None turns perceptual hashing off. Has to be
+        # below PHASH_CHUNKS for the chunk lookup to find every match.
+        if phash_distance is not None and phash_distance >= PHASH_CHUNKS:
+            raise ValueError(f"phash_distance must be below {PHASH_CHUNKS}")
+        self.phash_distance = phash_distance
+        self._path = os.path.join(folder_path, self.INDEX_NAME)
+        self._files_by_url: tp.Dict[str, str] = {}
+        self._phashes: tp.Dict[str, int] = {}
+        self._files_by_chunk: tp.List[tp.Dict[int, tp.List[str]]] = [
+            defaultdict(list) for _ in range(PHASH_CHUNKS)
+        ]
+        if os.path.exists(self._path):
+            self._load()
+        self._file = open(self._path, "a", encoding="utf-8")
+
+    def _load(self):
+        with open(self._path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self._remember(record["file"], record.get("url"), record.get("phash"))
+        logging.info(
+            f"Loaded image index: {len(self._files_by_url)} urls, "
+            f"{len(self._phashes)} perceptual hashes"
+        )
+
+    def close(self):
+        self._file.close()
+
+    @staticmethod
+    def url_key(image_url: str) -> str:
+        # cdn host and signed query parameters change between page loads,
+        # the path identifies the image
+        return urlsplit(image_url).path
+
+    def find_by_url(self, image_url: str) -> tp.Optional[str]:
+        return self._files_by_url.get(self.url_key(image_url))
+
+    def find_similar(self, phash: int) -> tp.Optional[str]:
+        candidates = set()
+        for chunk_index, chunk in enumerate(_phash_chunks(phash)):
+            candidates.update(self._files_by_chunk[chunk_index].get(chunk, ()))
+        for image_file in candidates:
+            if bin(self._phashes[image_file] ^ phash).count("1") <= self.phash_distance:
+                return image_file
+        return None
+
+    def add(
+        self,
+        image_file: str,
+        image_url: tp.Optional[str] = None,
+        phash: tp.Optional[int] = None,
+    ):
+        url_key = self.url_key(image_url) if image_url else None
+        if url_key in self._files_by_url and phash is None:
+            return
+        self._remember(image_file, url_key, phash)
+        record = {"file": image_file, "url": url_key, "phash": phash}
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def _remember(
+        self, image_file: str, url_key: tp.Optional[str], phash: tp.Optional[int]
+    ):
+        if url_key:
+            self._files_by_url[url_key] = image_file
+        if phash is not None and image_file not in self._phashes:
+            self._phashes[image_file] = phash
+            for chunk_index, chunk in enumerate(_phash_chunks(phash)):
+                self._files_by_chunk[chunk_index][chunk].append(image_file)
@@ -0,0 +1,22 @@
+import typing as tp
+
+# how many leading bytes are needed to recognize any of the formats below
+SIGNATURE_LENGTH = 12
+
+
+def image_format(header: bytes) -> tp.Optional[str]:
+    # recognizes image bytes by their magic number instead of decoding them
+    if header.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if header.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def file_image_format(path: str) -> tp.Optional[str]:
+    with open(path, "rb") as file:
+        return image_format(file.read(SIGNATURE_LENGTH))
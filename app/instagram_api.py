@@ -1,50 +1,106 @@
 import typing as tp
+from itertools import islice
 from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.keys import Keys
 from selenium.common.exceptions import TimeoutException
 from PIL import Image
+import os
 import re
 import time
 import logging
-import requests
-from io import BytesIO
 
-INSTAGRAM_POST_REGEX = "https://www.instagram.com/p/([a-zA-Z0-9_\-]+)/"
-INSTAGRAM_POST_URL_TEMPLATE = "https://www.instagram.com/p/{post_id}/"
-INSTAGRAM_TAG_EXPLORE_TEMPLATE = "https://www.instagram.com/explore/tags/{tag_name}/"
+from .downloader import ImageDownloader
+from .post import (  # noqa: F401 (re-exported, Post used to live here)
+    INSTAGRAM_POST_PATH,
+    INSTAGRAM_POST_URL_TEMPLATE,
+    INSTAGRAM_URL,
+    Comment,
+    Post,
+)
+from .metrics import (
+    COMMENTS_SCRAPED,
+    EXTRACTION_SECONDS,
+    PAGE_LOAD_SECONDS,
+    PAGES,
+    POSTS_FOUND,
+    THROTTLED,
+)
+from .rate_limit import RateLimiter, TokenBucket
+from .waits import Waiter
+from .session import SessionStore
 
+INSTAGRAM_POST_REGEX = r"/p/([a-zA-Z0-9_\-]+)/"
+INSTAGRAM_TAG_EXPLORE_PATH = "/explore/tags/{tag_name}/"
+INSTAGRAM_TAG_EXPLORE_TEMPLATE = INSTAGRAM_URL + INSTAGRAM_TAG_EXPLORE_PATH
 
-class Post:
-    def __init__(
-        self,
-        id: str,
-        image_url: str,
-        caption: str,
-        tags: tp.List[str] = [],
-        comments: tp.List[str] = [],
-    ):
-        self.id = id
-        self.image_url = image_url
-        self.caption = caption
-        self.tags = tags
-        self.comments = comments
-        self.company = None
-
-    @property
-    def url(self):
-        return INSTAGRAM_POST_URL_TEMPLATE.format(post_id=self.id)
-
-    def add_comment(self, text: str):
-        self.comments.append(text)
+POST_IMAGE_SELECTOR = "div._aagv > img"
+CAPTION_CLASS = "_a9zs"
+COMMENT_CLASS = "_a9ym"
+COMMENT_CONTAINER_CLASS = "_a9zr"
+COMMENT_AUTHOR_CLASS = "_a9zc"
+MORE_COMMENTS_XPATH = (
+    "/html/body/div[2]/div/div/div[2]/div/div/div/div[1]/div[1]/div[2]/section/main"
+    "/div/div[1]/div/div[2]/div/div[2]/div/div/ul/li/div/button"
+)
+LIKES_REGEX = re.compile(r"^([\d,.]+)\s+likes?$", re.IGNORECASE)
 
-    def __str__(self):
-        return f"Post(id: {self.id} url: {self.image_url})"
-
-    def __repr__(self):
-        return f"Post(id: {self.id} url: {self.image_url})"
+# Extraction scripts collect everything in one webdriver call instead of
+# several round-trips to chromedriver per element.
+# Tiles already returned are marked, so every call after a scroll only
+# reads the newly appeared part of the (growing) grid.
+EXTRACT_TAG_TILES_SCRIPT = """
+var selector = arguments[0] + ":not([data-scraped])";
+return Array.from(document.querySelectorAll(selector)).map(function (img) {
+    var link = img.closest("a");
+    img.setAttribute("data-scraped", "1");
+    return {
+        src: img.getAttribute("src"),
+        alt: img.getAttribute("alt"),
+        href: link ? link.href : null,
+    };
+});
+"""
+SCROLL_TO_BOTTOM_SCRIPT = """
+window.scrollTo(0, document.body.scrollHeight);
+return document.body.scrollHeight;
+"""
+PAGE_HEIGHT_SCRIPT = "return document.body.scrollHeight;"
+COUNT_ELEMENTS_SCRIPT = "return document.getElementsByClassName(arguments[0]).length;"
+EXTRACT_COMMENTS_SCRIPT = """
+var captionClass = arguments[0], commentClass = arguments[1];
+var containerClass = arguments[2], authorClass = arguments[3];
+var likesPattern = /^([\\d,.]+)\\s+likes?$/i;
+var caption = document.querySelector("." + captionClass);
+var comments = [];
+document.querySelectorAll("." + commentClass).forEach(function (comment) {
+    var span = comment.querySelector("." + containerClass + " span");
+    if (!span) {
+        return;
+    }
+    var author = comment.querySelector("." + authorClass);
+    var time = comment.querySelector("time");
+    var likes = null;
+    comment.querySelectorAll("button, span").forEach(function (element) {
+        var match = likesPattern.exec(element.innerText.trim());
+        if (match) {
+            likes = parseInt(match[1].replace(/[,.]/g, ""), 10);
+        }
+    });
+    comments.push({
+        text: span.innerText,
+        author: author ? author.innerText : null,
+        timestamp: time ? time.getAttribute("datetime") : null,
+        likes: likes,
+    });
+});
+return {caption: caption ? caption.innerText : null, comments: comments};
+"""
+OPEN_TAB_SCRIPT = "window.open(arguments[0], '_blank');"
+# rate limiter endpoint of every page load, tag and post pages alike: they go
+# to the same site from the same account
+PAGE_ENDPOINT = "page"
 
 
 class InstagramApi:
@@ -53,14 +109,49 @@ class InstagramApi:
         web_driver: tp.Optional[webdriver.Chrome],
         scape_comments: bool = False,
         scrape_tags: bool = False,
+        image_downloader: tp.Optional[ImageDownloader] = None,
+        extraction_mode: str = "script",
+        max_scrolls: int = 10,
+        scroll_timeout: float = 10,
+        wait_poll_frequency: float = 0.25,
+        rate_limiter: tp.Optional[RateLimiter] = None,
+        debug_folder: tp.Optional[str] = None,
+        base_url: str = INSTAGRAM_URL,
     ):
+        # extraction_mode: "script" - one execute_script per page,
+        # "elements" - per element webdriver calls (slow, kept as fallback)
         self.driver = web_driver
         self._scape_comments = scape_comments
         self._scrape_tags = scrape_tags
+        # created on first use, the async front brings its own downloader
+        self._image_downloader = image_downloader
+        self.waiter = Waiter(web_driver, poll_frequency=wait_poll_frequency)
+        # paces page loads (PAGE_ENDPOINT), shared between browsers
+        self.rate_limiter = rate_limiter or RateLimiter()
+        # page source of every post page is saved here if set
+        self.debug_folder = debug_folder
+        # pages are loaded from here, a local server for benchmarks
+        self.base_url = base_url.rstrip("/")
+        self.extraction_mode = extraction_mode
+        # tag pages load more posts on scroll, stop after max_scrolls or
+        # when a scroll brings nothing new within scroll_timeout seconds
+        self.max_scrolls = max_scrolls
+        self.scroll_timeout = scroll_timeout
+
+    def login(
+        self,
+        username: str,
+        password: str,
+        session_store: tp.Optional[SessionStore] = None,
+    ):
+        if session_store is not None and session_store.restore(
+            self.driver, self.waiter, self.base_url
+        ):
+            logging.info("Restored saved instagram session")
+            return
 
-    def login(self, username: str, password: str):
         try:
-            self.driver.get("https://www.instagram.com")
+            self.driver.get(self.base_url)
         except Exception:
             logging.info("Could not connect to instagram, check VPN!")
             raise
@@ -70,12 +161,17 @@ class InstagramApi:
             "/html/body/div[6]/div[1]/div/div[2]/div/div/div/div/div[2]/div/button[1]"
         )
         try:
-            WebDriverWait(self.driver, 2).until(
-                EC.presence_of_element_located((By.XPATH, pop_up_path))
+            cookie_button = self.waiter.until(
+                "cookie_popup",
+                EC.presence_of_element_located((By.XPATH, pop_up_path)),
+                timeout=2,
             )
-            cookie_button = self.driver.find_element(By.XPATH, pop_up_path)
             cookie_button.click()
-            time.sleep(2)
+            self.waiter.until(
+                "cookie_popup_closed",
+                EC.invisibility_of_element_located((By.XPATH, pop_up_path)),
+                timeout=2,
+            )
         except Exception:
             print("Cookie pop-up not found or already handled.")
             pass
@@ -88,11 +184,17 @@ class InstagramApi:
         password_input.send_keys(Keys.RETURN)
 
         try:
-            WebDriverWait(self.driver, 10).until(EC.url_contains("instagram.com/"))
+            self.waiter.until(
+                "login",
+                EC.invisibility_of_element_located((By.NAME, "password")),
+                timeout=10,
+            )
             print("Login successful!")
         except Exception:
             print("Login failed or timed out.")
             raise
+        if session_store is not None:
+            session_store.save(self.driver)
 
     def scrape_posts_by_tags(
         self,
@@ -104,135 +206,392 @@ class InstagramApi:
         for tag in tags:
             if len(posts) >= maximum_posts:
                 break
-            posts.extend(
-                self.scrape_posts_by_tag(
-                    tag,
-                    maximum_posts=maximum_posts - len(posts),
-                    filter_function=filter_function,
+            try:
+                posts.extend(
+                    self.scrape_posts_by_tag(
+                        tag,
+                        maximum_posts=maximum_posts - len(posts),
+                        filter_function=filter_function,
+                    )
                 )
-            )
+            except TimeoutException as error:
+                logging.info(f"{error.msg}, this tag will be ignored")
         return posts
 
     def scrape_posts_by_tag(
-        self, tag: str, filter_function, maximum_posts: int = 50
+        self,
+        tag: str,
+        filter_function,
+        maximum_posts: int = 50,
+        known_post_ids: tp.Optional[tp.Collection[str]] = None,
     ) -> tp.List[Post]:
-        logging.info(
-            f"scraping posts by tag, link: {INSTAGRAM_TAG_EXPLORE_TEMPLATE.format(tag_name=tag)}"
-        )
-        self.driver.get(INSTAGRAM_TAG_EXPLORE_TEMPLATE.format(tag_name=tag))
+        # known_post_ids: posts of an earlier run (the tag's high-water mark),
+        # the page is not scrolled past the screen they show up on. Raises
+        # TimeoutException if the page doesn't load.
+        tag_url = self.base_url + INSTAGRAM_TAG_EXPLORE_PATH.format(tag_name=tag)
+        logging.info(f"scraping posts by tag, link: {tag_url}")
         # Wait for the pictures to load
+        if not self._open_page(
+            PAGE_ENDPOINT,
+            tag_url,
+            "tag_page",
+            EC.presence_of_all_elements_located((By.CSS_SELECTOR, POST_IMAGE_SELECTOR)),
+            timeout=30,
+        ):
+            # not an empty page: the tag is left as it was, tried again later
+            raise TimeoutException(f"Error loading the page by timeout: {tag_url}")
+
+        page = _TagPage(self, tag, filter_function, maximum_posts, known_post_ids)
+        while True:
+            with EXTRACTION_SECONDS.time(kind="tag_tiles"):
+                tiles = self._extract_tag_tiles()
+            if not page.add_tiles(tiles) or not self._scroll_for_more():
+                break
+            page.scrolls += 1
+        POSTS_FOUND.inc(len(page.posts))
+        return page.posts
+
+    def _open_page(
+        self, endpoint: str, url: str, operation: str, condition, timeout: float
+    ) -> bool:
+        # Loads url once the endpoint's rate allows it and waits for condition.
+        # A page that doesn't load in time is counted as throttling.
+        bucket = self.rate_limiter.bucket(endpoint)
+        bucket.acquire()
+        started = time.perf_counter()
+        self.driver.get(url)
+        return self._wait_for_page(bucket, operation, condition, timeout, started)
+
+    def _wait_for_page(
+        self,
+        bucket: TokenBucket,
+        operation: str,
+        condition,
+        timeout: float,
+        started: tp.Optional[float] = None,
+    ) -> bool:
+        # started: when the page load began, defaults to now (tabs that were
+        # loading in the background are only timed from here)
+        if started is None:
+            started = time.perf_counter()
         try:
-            wait = WebDriverWait(self.driver, 30, poll_frequency=10)
-            wait.until(
-                EC.presence_of_all_elements_located(
-                    (By.CSS_SELECTOR, "div._aagv > img")
-                )
-            )
+            self.waiter.until(operation, condition, timeout=timeout)
         except TimeoutException:
-            logging.info(
-                f"Error loading the page by timeout: {INSTAGRAM_TAG_EXPLORE_TEMPLATE.format(tag_name=tag)}, this tag will be ignored"
+            self._record_page(bucket, operation, started, loaded=False)
+            return False
+        self._record_page(bucket, operation, started, loaded=True)
+        return True
+
+    @staticmethod
+    def _record_page(bucket: TokenBucket, operation: str, started: float, loaded: bool):
+        # a page that doesn't load in time slows the page rate down
+        if not loaded:
+            bucket.on_throttle()
+            PAGES.inc(page=operation, result="timeout")
+            THROTTLED.inc(endpoint="page")
+            return
+        PAGE_LOAD_SECONDS.observe(time.perf_counter() - started, page=operation)
+        PAGES.inc(page=operation, result="loaded")
+        bucket.on_success()
+
+    def _tile_to_post(self, tile: tp.Dict[str, tp.Optional[str]], tag: str) -> Post:
+        image_url = tile["src"]
+        if tile["href"] is None:
+            raise RuntimeError(f"Couldn't parse post, irregular picture: {image_url}")
+        post_url = tile["href"]
+        match = re.search(INSTAGRAM_POST_REGEX, post_url)
+        if not match:
+            raise RuntimeError(f"Couldn't parse post, irregular post link: {post_url}")
+        return Post(
+            id=match.group(1),
+            tags=[tag],
+            image_url=image_url,
+            caption=tile["alt"],
+        )
+
+    def _scroll_for_more(self) -> bool:
+        # returns False if the page didn't grow, i.e. there is nothing to load
+        height = self.driver.execute_script(SCROLL_TO_BOTTOM_SCRIPT)
+        return self.waiter.until_changed(
+            "scroll",
+            lambda: self.driver.execute_script(PAGE_HEIGHT_SCRIPT),
+            timeout=self.scroll_timeout,
+            initial_value=height,
+        )
+
+    def _extract_tag_tiles(self) -> tp.List[tp.Dict[str, tp.Optional[str]]]:
+        if self.extraction_mode == "script":
+            return self.driver.execute_script(
+                EXTRACT_TAG_TILES_SCRIPT, POST_IMAGE_SELECTOR
             )
-            return []
-
-        scraped_posts = []
-        images = self.driver.find_elements(By.CSS_SELECTOR, "div._aagv > img")
-        logging.info(f"scraping posts by tag, number posts: {len(images)}")
-        for image in images:
-            image_url = image.get_attribute("src")
-            caption = image.get_attribute("alt")
+        tiles = []
+        for image in self.driver.find_elements(By.CSS_SELECTOR, POST_IMAGE_SELECTOR):
             a_post_elements = list(image.find_elements(By.XPATH, "../../.."))
-            if len(a_post_elements) is None:
-                raise RuntimeError(
-                    f"Couldn't parse post, irregular picture: {image_url}"
-                )
-            post_url = a_post_elements[0].get_attribute("href")
-            match = re.search(INSTAGRAM_POST_REGEX, post_url)
-            if not match:
-                raise RuntimeError(
-                    f"Couldn't parse post, irregular post link: {post_url}"
-                )
-            post_id = match.group(1)
-            found_post = Post(
-                id=post_id,
-                tags=[tag],
-                image_url=image_url,
-                caption=caption,
+            tiles.append(
+                {
+                    "src": image.get_attribute("src"),
+                    "alt": image.get_attribute("alt"),
+                    "href": (
+                        a_post_elements[0].get_attribute("href")
+                        if a_post_elements
+                        else None
+                    ),
+                }
             )
-            # later use scrape_post_by_url --!
-            if filter_function(found_post):
-                scraped_posts.append(found_post)
-            if len(scraped_posts) == maximum_posts:
-                break
-        return scraped_posts
-
-    def scrape_image_by_url(
-        self, image_url: str, max_attempts=3
-    ) -> tp.Optional[Image.Image]:
-        logging.info(f"Downloading img: {image_url}")
-        attempts = 0
-        while attempts < max_attempts:
-            try:
-                response = requests.get(image_url, stream=True)
-                if response.status_code == 200:
-                    return Image.open(BytesIO(response.content))
-                else:
-                    logging.info(
-                        f"Failed to download image, attempt {attempts + 1}/{max_attempts}:"
-                        f"bad request {response.status_code}"
-                    )
-            except Exception as e:
-                logging.info(
-                    f"Failed to download image, attempt {attempts + 1}/{max_attempts}:"
-                    f"{e}"
-                )
-            attempts += 1
-            time.sleep(5)
-        return None
+        return tiles
+
+    @property
+    def image_downloader(self) -> ImageDownloader:
+        if self._image_downloader is None:
+            self._image_downloader = ImageDownloader()
+        return self._image_downloader
+
+    def scrape_image_by_url(self, image_url: str) -> tp.Optional[Image.Image]:
+        return self.image_downloader.fetch(image_url)
+
+    def scrape_images_for_posts(
+        self, posts: tp.Iterable[Post], to_directory: tp.Optional[str] = None
+    ) -> tp.Iterator[tp.Tuple[Post, tp.Any]]:
+        # downloads concurrently, yields (post, image) in completion order;
+        # with to_directory the image is a path to the raw downloaded file
+        return self.image_downloader.fetch_many(
+            ((post, post.image_url) for post in posts), to_directory=to_directory
+        )
 
     def scrape_comments(
         self,
         post: Post,
         max_comments: int = 400,
         filter=None,  # filter function
-    ) -> None:
-        # Scrapes comments inplace into the post
-        post_url = INSTAGRAM_POST_URL_TEMPLATE.format(post_id=post.id)
+    ) -> bool:
+        # Scrapes comments inplace into the post, in the current tab.
+        # Returns False if the post page didn't load.
+        post_url = self._post_url(post)
         logging.info(f"post_url: {post_url}")
-        self.driver.get(post_url)
-
-        more_comments_xpath = "/html/body/div[2]/div/div/div[2]/div/div/div/div[1]/div[1]/div[2]/section/main/div/div[1]/div/div[2]/div/div[2]/div/div/ul/li/div/button"
-        # Wait for the caption to load
-        try:
-            wait = WebDriverWait(self.driver, 20)
-            wait.until(EC.presence_of_all_elements_located((By.CLASS_NAME, "_a9zs")))
-        except TimeoutException:
+        if not self._open_page(
+            PAGE_ENDPOINT, post_url, "post_page", self._post_page_loaded, timeout=20
+        ):
             logging.info(
                 f"Couldn't scrape comments for post: {post_url}: Timeout, skipping"
             )
-            return
-        post.caption = self.driver.find_element(By.CLASS_NAME, "_a9zs").text
+            return False
+        self._collect_comments(post, max_comments, filter)
+        return True
+
+    def scrape_comments_batch(
+        self,
+        posts: tp.Iterable[Post],
+        max_comments: int = 400,
+        filter=None,  # filter function
+        tabs: int = 4,
+    ) -> tp.Iterator[tp.Tuple[Post, bool]]:
+        # Scrapes comments of `tabs` posts at a time: every post of a batch is
+        # opened in its own tab without waiting, so the pages load in
+        # parallel, then the tabs are read and closed one by one. Yields
+        # (post, False) for posts whose page didn't load or failed to scrape.
+        main_window = self.driver.current_window_handle
+        posts = iter(posts)
+        while True:
+            batch = list(islice(posts, tabs))
+            if not batch:
+                return
+            try:
+                opened = [(post, self._open_tab(self._post_url(post))) for post in batch]
+                for post, window in opened:
+                    yield post, self._scrape_comments_in_tab(
+                        post, window, max_comments, filter
+                    )
+            finally:
+                self._close_tabs(main_window)
+
+    def _close_tabs(self, main_window: str):
+        # closes the tabs a failed or abandoned batch left open and switches
+        # back to the main window
+        try:
+            for window in self.driver.window_handles:
+                if window != main_window:
+                    self.driver.switch_to.window(window)
+                    self.driver.close()
+            self.driver.switch_to.window(main_window)
+        except Exception:
+            logging.exception("Couldn't close the tabs of a comments batch")
+
+    def _post_url(self, post: Post) -> str:
+        return self.base_url + INSTAGRAM_POST_PATH.format(post_id=post.id)
+
+    def _open_tab(self, url: str) -> tp.Optional[str]:
+        # starts loading url in a new tab, returns its window handle
+        self.rate_limiter.bucket(PAGE_ENDPOINT).acquire()
+        windows = set(self.driver.window_handles)
+        self.driver.execute_script(OPEN_TAB_SCRIPT, url)
+        new_windows = set(self.driver.window_handles) - windows
+        if not new_windows:
+            logging.info(f"Couldn't open a tab for {url}")
+            return None
+        return new_windows.pop()
+
+    def _scrape_comments_in_tab(
+        self, post: Post, window: tp.Optional[str], max_comments: int, filter
+    ) -> bool:
+        if window is None:
+            return False
+        try:
+            self.driver.switch_to.window(window)
+        except Exception:
+            # the tab is gone, closing now would close the current window
+            logging.exception(f"Couldn't switch to the tab of post {post.id}")
+            return False
+        try:
+            if not self._wait_for_page(
+                self.rate_limiter.bucket(PAGE_ENDPOINT),
+                "post_page",
+                self._post_page_loaded,
+                timeout=20,
+            ):
+                logging.info(
+                    f"Couldn't scrape comments for post: {post.id}: Timeout, skipping"
+                )
+                return False
+            self._collect_comments(post, max_comments, filter)
+            return True
+        except Exception:
+            logging.exception(f"Failed scraping comments for post {post.id}")
+            return False
+        finally:
+            self.driver.close()
+
+    @staticmethod
+    def _post_page_loaded(driver) -> bool:
+        # the caption is the last part of a post page to render
+        return bool(driver.find_elements(By.CLASS_NAME, CAPTION_CLASS))
+
+    def _collect_comments(self, post: Post, max_comments: int, filter):
+        # reads the comments of the post page open in the current tab
+        if self.debug_folder is not None:
+            os.makedirs(self.debug_folder, exist_ok=True)
+            debug_path = os.path.join(self.debug_folder, f"{post.id}.html")
+            with open(debug_path, "w", encoding="utf-8") as f:
+                f.write(self.driver.page_source)
 
-        with open("page_source.html", "w", encoding="utf-8") as f:
-            f.write(self.driver.page_source)
+        def count_comments():
+            return self.driver.execute_script(COUNT_ELEMENTS_SCRIPT, COMMENT_CLASS)
 
         try:
-            load_more_comment = self.driver.find_element(By.XPATH, more_comments_xpath)
+            load_more_comment = self.driver.find_element(By.XPATH, MORE_COMMENTS_XPATH)
             i = 0
             while load_more_comment.is_displayed() and i * 5 < max_comments:
+                comments_before = count_comments()
                 load_more_comment.click()
-                time.sleep(7)
+                # wait for the new comments instead of a fixed sleep
+                if not self.waiter.until_changed(
+                    "more_comments",
+                    count_comments,
+                    timeout=7,
+                    initial_value=comments_before,
+                ):
+                    break
                 load_more_comment = self.driver.find_element(
-                    By.XPATH, more_comments_xpath
+                    By.XPATH, MORE_COMMENTS_XPATH
                 )
                 i += 1
         except Exception:
             logging.exception("We failed to load more comments")
 
-        # user_names = []
-        comment = self.driver.find_elements(By.CLASS_NAME, "_a9ym")
-        for c in comment[:max_comments]:
-            container = c.find_element(By.CLASS_NAME, "_a9zr")
-            # name = container.find_element(By.CLASS_NAME, "_a9zc").text
-            content = container.find_element(By.TAG_NAME, "span").text
-            content = content.replace("\n", " ").strip()
-            post.comments.append(content)
+        with EXTRACTION_SECONDS.time(kind="comments"):
+            caption, comments = self._extract_comments()
+        post.caption = caption if caption is not None else post.caption
+        added = 0
+        for comment in comments:
+            if added >= max_comments:
+                break
+            text = comment.text.replace("\n", " ").strip()
+            if filter is not None and not filter(text):
+                continue
+            post.add_comment(text, comment._replace(text=text))
+            added += 1
+        COMMENTS_SCRAPED.inc(added)
+
+    def _extract_comments(self) -> tp.Tuple[tp.Optional[str], tp.List[Comment]]:
+        if self.extraction_mode == "script":
+            result = self.driver.execute_script(
+                EXTRACT_COMMENTS_SCRIPT,
+                CAPTION_CLASS,
+                COMMENT_CLASS,
+                COMMENT_CONTAINER_CLASS,
+                COMMENT_AUTHOR_CLASS,
+            )
+            return result["caption"], [
+                Comment(**comment) for comment in result["comments"]
+            ]
+        caption = self.driver.find_element(By.CLASS_NAME, CAPTION_CLASS).text
+        comments = []
+        for c in self.driver.find_elements(By.CLASS_NAME, COMMENT_CLASS):
+            container = c.find_element(By.CLASS_NAME, COMMENT_CONTAINER_CLASS)
+            authors = c.find_elements(By.CLASS_NAME, COMMENT_AUTHOR_CLASS)
+            times = c.find_elements(By.TAG_NAME, "time")
+            likes = None
+            for line in c.text.split("\n"):
+                match = LIKES_REGEX.match(line.strip())
+                if match:
+                    likes = int(re.sub(r"[,.]", "", match.group(1)))
+            comments.append(
+                Comment(
+                    text=container.find_element(By.TAG_NAME, "span").text,
+                    author=authors[0].text if authors else None,
+                    timestamp=times[0].get_attribute("datetime") if times else None,
+                    likes=likes,
+                )
+            )
+        return caption, comments
+
+
+class _TagPage:
+    # Posts read from a tag page so far, shared by the blocking and the
+    # asyncio api. The page is read, scrolled and read again while
+    # add_tiles returns True.
+    def __init__(
+        self,
+        api: InstagramApi,
+        tag: str,
+        filter_function,
+        maximum_posts: int,
+        known_post_ids: tp.Optional[tp.Collection[str]],
+    ):
+        self.api = api
+        self.tag = tag
+        self.filter_function = filter_function
+        self.maximum_posts = maximum_posts
+        self.known_post_ids = known_post_ids
+        self.posts: tp.List[Post] = []
+        self.scrolls = 0
+        self._seen_post_ids: tp.Set[str] = set()
+        self._reached_known = False
+
+    def add_tiles(self, tiles: tp.List[tp.Dict[str, tp.Optional[str]]]) -> bool:
+        # returns whether scrolling for more is worth it
+        new_tiles = 0
+        for tile in tiles:
+            found_post = self.api._tile_to_post(tile, self.tag)
+            if found_post.id in self._seen_post_ids:
+                continue
+            self._seen_post_ids.add(found_post.id)
+            new_tiles += 1
+            if self.known_post_ids and found_post.id in self.known_post_ids:
+                self._reached_known = True
+            # later use scrape_post_by_url --!
+            if self.filter_function(found_post):
+                self.posts.append(found_post)
+            if len(self.posts) == self.maximum_posts:
+                break
+        logging.info(
+            f"scraping posts by tag, new posts: {new_tiles}, scrolls: {self.scrolls}"
+        )
+        if (
+            len(self.posts) >= self.maximum_posts
+            or self.scrolls >= self.api.max_scrolls
+        ):
+            return False
+        if self._reached_known:
+            logging.info(f"Reached posts known from the last run of tag {self.tag}")
+            return False
+        return not (self.scrolls > 0 and new_tiles == 0)
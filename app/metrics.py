@@ -0,0 +1,297 @@
+import typing as tp
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+import threading
+import time
+
+# Counters and histograms for a run, exported as Prometheus text (a file for
+# the node exporter textfile collector, or served over http) and as a json
+# summary. Recording is a dict lookup and a few additions under a lock, cheap
+# next to the page loads and downloads being measured, so it is always on.
+# Labels are passed as keyword arguments: PAGE_LOAD.observe(1.2, page="tag").
+
+LabelKey = tp.Tuple[tp.Tuple[str, str], ...]
+
+# seconds, from webdriver round-trips up to slow page loads
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _label_key(labels: tp.Dict[str, tp.Any]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: tp.Optional[tp.Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _summary_key(key: LabelKey) -> str:
+    return ",".join(f"{name}={value}" for name, value in key) or "total"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _timestamp(seconds: float) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(seconds))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: tp.Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def samples(self) -> tp.Iterator[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(key)} {value:g}"
+
+    def summary(self) -> tp.Dict[str, tp.Any]:
+        with self._lock:
+            return {
+                _summary_key(key): value
+                for key, value in self._values.items()
+            }
+
+
+class _HistogramValues:
+    __slots__ = ("buckets", "count", "sum", "max")
+
+    def __init__(self, number_buckets: int):
+        self.buckets = [0] * number_buckets
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, buckets: tp.Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.help = help
+        self.bounds = tuple(buckets)
+        self._values: tp.Dict[LabelKey, _HistogramValues] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        index = bisect_left(self.bounds, value)  # len(bounds) is +Inf
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = _HistogramValues(len(self.bounds) + 1)
+            values.buckets[index] += 1
+            values.count += 1
+            values.sum += value
+            values.max = max(values.max, value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> tp.Iterator[str]:
+        with self._lock:
+            values = [
+                (key, list(values.buckets), values.count, values.sum)
+                for key, values in self._values.items()
+            ]
+        for key, buckets, count, total in values:
+            cumulative = 0
+            for bound, bucket in zip(self.bounds + (float("inf"),), buckets):
+                cumulative += bucket
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                yield f"{self.name}_bucket{_format_labels(key, ('le', le))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(key)} {total:g}"
+            yield f"{self.name}_count{_format_labels(key)} {count}"
+
+    def quantile(self, q: float, **labels) -> float:
+        # upper bound of the bucket holding the q-quantile (max for +Inf)
+        with self._lock:
+            values = self._values.get(_label_key(labels))
+            if values is None or not values.count:
+                return 0.0
+            return self._quantile(values, q)
+
+    def _quantile(self, values: _HistogramValues, q: float) -> float:
+        rank = q * values.count
+        cumulative = 0
+        for bound, bucket in zip(self.bounds, values.buckets):
+            cumulative += bucket
+            if cumulative >= rank:
+                return min(bound, values.max)
+        return values.max
+
+    def summary(self) -> tp.Dict[str, tp.Any]:
+        with self._lock:
+            return {
+                _summary_key(key): {
+                    "count": values.count,
+                    "sum": round(values.sum, 6),
+                    "mean": round(values.sum / values.count, 6) if values.count else 0.0,
+                    "p50": round(self._quantile(values, 0.5), 6),
+                    "p90": round(self._quantile(values, 0.9), 6),
+                    "p99": round(self._quantile(values, 0.99), 6),
+                    "max": round(values.max, 6),
+                }
+                for key, values in self._values.items()
+            }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: tp.Dict[str, tp.Union[Counter, Histogram]] = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._register(Counter(name, help))
+
+    def histogram(
+        self, name: str, help: str, buckets: tp.Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, help, buckets))
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def to_prometheus_text(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        # written aside and renamed, collectors never read half a file
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            file.write(self.to_prometheus_text())
+        os.replace(temporary_path, path)
+
+    def summary(self) -> tp.Dict[str, tp.Any]:
+        with self._lock:
+            metrics = dict(self._metrics)
+        finished_at = time.time()
+        return {
+            "started_at": _timestamp(self.started_at),
+            "finished_at": _timestamp(finished_at),
+            "duration_seconds": round(finished_at - self.started_at, 3),
+            "counters": {
+                name: metric.summary()
+                for name, metric in sorted(metrics.items())
+                if isinstance(metric, Counter)
+            },
+            "histograms": {
+                name: metric.summary()
+                for name, metric in sorted(metrics.items())
+                if isinstance(metric, Histogram)
+            },
+        }
+
+    def write_summary(self, path: str, **extra):
+        summary = self.summary()
+        summary.update(extra)
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(summary, file, indent=2)
+        logging.info(f"Run summary written to {path}")
+
+    def serve(self, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+        # /metrics in Prometheus text format from a background thread
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(
+            target=server.serve_forever, name="metrics-server", daemon=True
+        ).start()
+        port = server.server_address[1]
+        logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+        return server
+
+
+# the registry of the process, metrics below are recorded by the scraper
+METRICS = MetricsRegistry()
+
+PAGE_LOAD_SECONDS = METRICS.histogram(
+    "scraper_page_load_seconds", "Page load until the awaited content showed up."
+)
+PAGES = METRICS.counter("scraper_pages_total", "Pages loaded, by page type and result.")
+EXTRACTION_SECONDS = METRICS.histogram(
+    "scraper_extraction_seconds", "Reading posts or comments out of a loaded page."
+)
+POSTS_FOUND = METRICS.counter("scraper_posts_found_total", "Posts read from tag pages.")
+COMMENTS_SCRAPED = METRICS.counter("scraper_comments_total", "Comments kept for posts.")
+DOWNLOAD_SECONDS = METRICS.histogram(
+    "scraper_image_download_seconds", "Image download, all attempts included."
+)
+DOWNLOAD_BYTES = METRICS.counter(
+    "scraper_image_downloaded_bytes_total", "Bytes of downloaded images."
+)
+DOWNLOADS = METRICS.counter("scraper_image_downloads_total", "Image downloads by result.")
+DOWNLOAD_RETRIES = METRICS.counter(
+    "scraper_image_download_retries_total", "Image download attempts that were retried."
+)
+HTTP_RESPONSES = METRICS.counter(
+    "scraper_http_responses_total", "Image http responses by status code."
+)
+THROTTLED = METRICS.counter(
+    "scraper_throttled_total", "Requests answered with throttling, by endpoint kind."
+)
+PERSIST_SECONDS = METRICS.histogram(
+    "scraper_persist_seconds", "Writing to storage, by operation."
+)
+WORKER_RESULTS = METRICS.counter(
+    "scraper_worker_results_total",
+    "Work results merged by the coordinator, by kind and worker.",
+)
+STAGE_SECONDS = METRICS.histogram(
+    "scraper_stage_seconds",
+    "Duration of the scraping stages.",
+    buckets=(1, 10, 60, 300, 900, 1800, 3600, 7200, 21600),
+)
@@ -0,0 +1,116 @@
+import typing as tp
+import json
+
+# Posts and comments as they are scraped and stored. Kept apart from
+# instagram_api, so storage, export and benchmarks can use them without
+# importing selenium.
+
+INSTAGRAM_URL = "https://www.instagram.com"
+INSTAGRAM_POST_PATH = "/p/{post_id}/"
+INSTAGRAM_POST_URL_TEMPLATE = INSTAGRAM_URL + INSTAGRAM_POST_PATH
+
+
+class Comment(tp.NamedTuple):
+    text: str
+    author: tp.Optional[str] = None
+    timestamp: tp.Optional[str] = None  # ISO 8601, from the comment's <time>
+    likes: tp.Optional[int] = None
+
+
+class Post:
+    # Slotted: millions of posts can be held during a run, and a per-instance
+    # __dict__ would roughly double their size. Tags are an immutable tuple,
+    # comments a list owned by the post since they grow while scraping.
+    # comment_details (author, time, likes of every comment) stays None until
+    # comments are scraped with them.
+    __slots__ = (
+        "id",
+        "image_url",
+        "caption",
+        "tags",
+        "comments",
+        "company",
+        "comment_details",
+    )
+
+    def __init__(
+        self,
+        id: str,
+        image_url: str,
+        caption: str,
+        tags: tp.Iterable[str] = (),
+        comments: tp.Iterable[str] = (),
+        company: tp.Optional[str] = None,
+        comment_details: tp.Optional[tp.Iterable[Comment]] = None,
+    ):
+        self.id = id
+        self.image_url = image_url
+        self.caption = caption
+        self.tags: tp.Tuple[str, ...] = tuple(tags)
+        self.comments: tp.List[str] = list(comments)
+        self.company = company
+        self.comment_details: tp.Optional[tp.List[Comment]] = (
+            list(comment_details) if comment_details is not None else None
+        )
+
+    @property
+    def url(self):
+        return INSTAGRAM_POST_URL_TEMPLATE.format(post_id=self.id)
+
+    def add_comment(self, text: str, details: tp.Optional[Comment] = None):
+        self.comments.append(text)
+        if details is not None:
+            if self.comment_details is None:
+                self.comment_details = []
+            self.comment_details.append(details)
+
+    def to_row(self) -> tp.Dict[str, tp.Any]:
+        # values of the storage table columns owned by the post
+        return {
+            "tags": ",".join(self.tags),
+            "image_url": self.image_url,
+            "caption": self.caption,
+            "comments": "\n".join(self.comments),
+            "number_comments": len(self.comments),
+            "company": self.company,
+            "comment_details": (
+                json.dumps([details._asdict() for details in self.comment_details])
+                if self.comment_details
+                else None
+            ),
+        }
+
+    @classmethod
+    def from_row(
+        cls,
+        post_id: str,
+        image_url: str,
+        caption: str,
+        tags: tp.Any,
+        comments: tp.Any,
+        company: tp.Any,
+        comment_details: tp.Any = None,
+    ) -> "Post":
+        # tags and comments as stored: joined strings, None or NaN if missing;
+        # comment_details a json list
+        return cls(
+            id=post_id,
+            image_url=image_url,
+            caption=caption,
+            tags=tags.split(",") if isinstance(tags, str) and tags else (),
+            comments=(
+                comments.split("\n") if isinstance(comments, str) and comments else ()
+            ),
+            company=company,
+            comment_details=(
+                [Comment(**details) for details in json.loads(comment_details)]
+                if isinstance(comment_details, str) and comment_details
+                else None
+            ),
+        )
+
+    def __str__(self):
+        return f"Post(id: {self.id} url: {self.image_url})"
+
+    def __repr__(self):
+        return f"Post(id: {self.id} url: {self.image_url})"
@@ -0,0 +1,148 @@
+import typing as tp
+import asyncio
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Request pacing shared by the image downloader and browser navigation.
+# Every endpoint ("page", "image:<cdn host>", ...) gets its own token
+# bucket, configured by its kind (the part before ":"). Rates adapt
+# AIMD style: a throttled request (429, timeout) halves the rate, every
+# successful one adds back a small step, up to the configured rate.
+
+
+class TokenBucket:
+    def __init__(
+        self,
+        rate: tp.Optional[float],
+        burst: float = 1,
+        min_rate_factor: float = 0.05,
+        increase_factor: float = 0.05,
+        decrease_factor: float = 0.5,
+    ):
+        # rate: tokens per second, None - unlimited
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = rate * min_rate_factor if rate else None
+        self.increase_step = rate * increase_factor if rate else None
+        self.decrease_factor = decrease_factor
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        # metrics
+        self.requests = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+        self._first_request: tp.Optional[float] = None
+        self._last_request: tp.Optional[float] = None
+
+    def acquire(self) -> float:
+        # blocks until a request may be sent, returns the seconds waited
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    async def acquire_async(self) -> float:
+        # same as acquire, waiting without blocking the event loop
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+    def _reserve(self) -> float:
+        # takes a token, returns how long to wait before using it
+        with self._lock:
+            now = time.monotonic()
+            self.requests += 1
+            if self._first_request is None:
+                self._first_request = now
+            if self.rate is None:
+                self._last_request = now
+                return 0.0
+            self._refill(now)
+            # tokens go negative for requests that reserved a future slot
+            self._tokens -= 1
+            delay = max(self._paused_until - now, 0.0)
+            if self._tokens < 0:
+                delay += -self._tokens / self.rate
+            self._last_request = now + delay
+            self.wait_seconds += delay
+        return delay
+
+    def on_success(self):
+        if self.rate is None:
+            return
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_throttle(self, retry_after: tp.Optional[float] = None):
+        with self._lock:
+            self.throttled += 1
+            if self.rate is None:
+                return
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            # no burst right after being throttled
+            self._tokens = min(self._tokens, 0.0)
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def achieved_rate(self) -> float:
+        if self._first_request is None or self._last_request is None:
+            return 0.0
+        elapsed = self._last_request - self._first_request
+        return (self.requests - 1) / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        rate = f"{self.rate:.2f}/s" if self.rate is not None else "unlimited"
+        return (
+            f"requests: {self.requests}, throttled: {self.throttled}, "
+            f"waited: {self.wait_seconds:.1f}s, rate: {rate}, "
+            f"achieved: {self.achieved_rate:.2f}/s"
+        )
+
+
+class RateLimiter:
+    def __init__(
+        self, limits: tp.Optional[tp.Dict[str, tp.Tuple[float, float]]] = None
+    ):
+        # limits: endpoint kind -> (requests per second, burst); kinds that
+        # are missing, or have a rate of 0, are not limited
+        self.limits = limits or {}
+        self._buckets: tp.Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, endpoint: str) -> TokenBucket:
+        with self._lock:
+            if endpoint not in self._buckets:
+                rate, burst = self.limits.get(endpoint.split(":")[0], (0, 1))
+                self._buckets[endpoint] = TokenBucket(rate or None, burst)
+            return self._buckets[endpoint]
+
+    @staticmethod
+    def url_endpoint(kind: str, url: str) -> str:
+        return f"{kind}:{urlsplit(url).hostname}"
+
+    def log_stats(self):
+        with self._lock:
+            buckets = sorted(self._buckets.items())
+        for endpoint, bucket in buckets:
+            logging.info(f"rate {endpoint}: {bucket}")
+
+
+def retry_after_seconds(value: tp.Optional[str]) -> tp.Optional[float]:
+    # Retry-After header in seconds, http dates are ignored
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
@@ -1,10 +1,28 @@
 import json
+import os
 from .config import Configuration
 from .storage import InstagramStorage
-from .instagram_api import InstagramApi, Post
+from .post import Post
+from .downloader import ImageDownloader
+from .frontier import Frontier
+from .metrics import METRICS, STAGE_SECONDS
+from .rate_limit import RateLimiter
+from .seen_index import SeenPostIndex
 import typing as tp
-from selenium import webdriver
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from collections import defaultdict
+from itertools import islice
+import contextlib
+from datetime import datetime, timedelta
+import threading
+import queue
 import logging
+import time
+
+if tp.TYPE_CHECKING:
+    # selenium is only imported when a stage needs a browser
+    from .driver_pool import DriverPool
+    from .instagram_api import InstagramApi
 
 
 def _load_companies(
@@ -20,11 +38,86 @@ def _load_companies(
     return relevant_companies
 
 
+class _Checkpoint:
+    # Saves storage every `every` finished items (0: only on save()) and only
+    # then marks them done in the frontier, so the frontier never considers
+    # done what a crash could still lose. Meanwhile the leases of this worker
+    # are renewed, or its finished items would be leased again once expired.
+    def __init__(
+        self,
+        storage: InstagramStorage,
+        every: int = 0,
+        frontier: tp.Optional[Frontier] = None,
+        kind: str = "",
+    ):
+        self.storage = storage
+        self.every = every
+        self.frontier = frontier
+        self.kind = kind
+        self._finished: tp.List[str] = []
+        self._count = 0
+        self._renewed_at = time.monotonic()
+
+    def done(self, key: str):
+        if self.frontier is not None:
+            self._finished.append(key)
+            self._renew_leases()
+        self._count += 1
+        if self.every and self._count % self.every == 0:
+            self.save()
+
+    def failed(self, key: str, error: str):
+        if self.frontier is not None:
+            self.frontier.fail(self.kind, key, error)
+            self._renew_leases()
+
+    def _renew_leases(self):
+        if time.monotonic() - self._renewed_at >= self.frontier.lease_seconds / 2:
+            self.frontier.renew(self.kind)
+            self._renewed_at = time.monotonic()
+
+    @property
+    def unsaved(self) -> int:
+        # finished items waiting for the next save
+        return len(self._finished)
+
+    def save(self):
+        self.storage.save_table_changes()
+        if self.frontier is not None and self._finished:
+            self.frontier.complete(self.kind, self._finished)
+        self._finished = []
+
+
+def _frontier_posts(
+    posts: tp.Iterable[Post], frontier: Frontier, kind: str
+) -> tp.Iterator[Post]:
+    # queues the posts (kept if already queued by an earlier run or another
+    # worker) and yields whatever this worker manages to lease
+    frontier.enqueue(kind, ((post.id, post.to_row()) for post in posts))
+    logging.info(f"Frontier {kind} items: {frontier.counts(kind)}")
+    for item in frontier.iter_leased(kind):
+        yield _post_from_row(item.key, item.payload)
+
+
+def _post_from_row(post_id: str, row: tp.Dict[str, tp.Any]) -> Post:
+    # back from Post.to_row, e.g. a frontier payload
+    return Post.from_row(
+        post_id,
+        row["image_url"],
+        row["caption"],
+        row["tags"],
+        row["comments"],
+        row["company"],
+        row.get("comment_details"),
+    )
+
+
 def scrape_instagram(
     storage: InstagramStorage,
-    web_driver: webdriver.Chrome,
+    driver_pool: tp.Optional["DriverPool"],
     configuration: Configuration,
 ):
+    # driver_pool: None if no stage needs a browser (images only)
     logging.info(
         "Startig app with "
         + ("scraping images" if configuration.SCRAPE_IMAGES else "no image scraping")
@@ -40,85 +133,512 @@ def scrape_instagram(
         companies_file=configuration.COMPANIES_FILE_PATH,
         list_of_companies=configuration.COMPANIES,
     )
+    rate_limiter = _create_rate_limiter(configuration, configuration.DOWNLOAD_WORKERS)
+    image_downloader = ImageDownloader(
+        max_workers=configuration.DOWNLOAD_WORKERS, rate_limiter=rate_limiter
+    )
+    instagrams = _create_instagrams(
+        storage.folder_path, driver_pool, configuration, rate_limiter, image_downloader
+    )
+    frontier = _open_frontier(storage, configuration)
+
+    metrics_server = None
+    if configuration.METRICS_PORT:
+        metrics_server = METRICS.serve(configuration.METRICS_PORT)
+
+    status = "failed"
+    try:
+        _scrape_stages(
+            storage, instagrams, image_downloader, companies, configuration, frontier
+        )
+        status = "completed"
+    finally:
+        if frontier is not None:
+            frontier.close()
+        _write_metrics(storage, configuration, status)
+        if metrics_server is not None:
+            metrics_server.shutdown()
+
+    for api in instagrams:
+        api.waiter.log_stats()
+    rate_limiter.log_stats()
 
-    instagram = InstagramApi(
-        web_driver=web_driver,
-        scape_comments=configuration.SCRAPE_COMMENTS,
-        scrape_tags=True,
+
+def _create_rate_limiter(configuration: Configuration, image_burst: int) -> RateLimiter:
+    # one limiter for all browsers and downloads, they share account and address
+    return RateLimiter(
+        {
+            "page": (configuration.PAGE_RATE, configuration.BROWSER_WORKERS),
+            "image": (configuration.IMAGE_RATE, image_burst),
+        }
     )
 
+
+def _create_instagrams(
+    folder_path: str,
+    driver_pool: tp.Optional["DriverPool"],
+    configuration: Configuration,
+    rate_limiter: RateLimiter,
+    image_downloader: tp.Optional[ImageDownloader] = None,
+) -> tp.List["InstagramApi"]:
+    # one api per browser, logged in if comments are scraped
+    if driver_pool is None:
+        return []
+    from .instagram_api import InstagramApi
+
+    instagrams = [
+        InstagramApi(
+            web_driver=driver,
+            scape_comments=configuration.SCRAPE_COMMENTS,
+            scrape_tags=True,
+            image_downloader=image_downloader,
+            extraction_mode=configuration.EXTRACTION_MODE,
+            max_scrolls=configuration.MAX_SCROLLS,
+            rate_limiter=rate_limiter,
+            debug_folder=(
+                os.path.join(folder_path, configuration.DEBUG_FOLDER_NAME)
+                if configuration.DEBUG_PAGES
+                else None
+            ),
+        )
+        for driver in driver_pool.drivers
+    ]
+
     if configuration.SCRAPE_COMMENTS:
+        from .session import SessionStore
+
         logging.info("Logging to instagram with provided cridentials")
-        instagram.login(
-            username=configuration.INSTAGRAM_LOGIN,
-            password=configuration.INSTAGRAM_PASSWORD,
+        session_store = None
+        if configuration.KEEP_SESSION:
+            session_store = SessionStore(
+                os.path.join(folder_path, configuration.SESSION_FILE_NAME)
+            )
+        # the first browser logs in (or restores the session), the rest reuse it
+        for api in instagrams:
+            api.login(
+                username=configuration.INSTAGRAM_LOGIN,
+                password=configuration.INSTAGRAM_PASSWORD,
+                session_store=session_store,
+            )
+    return instagrams
+
+
+def _open_frontier(
+    storage: InstagramStorage, configuration: Configuration
+) -> tp.Optional[Frontier]:
+    if not configuration.USE_FRONTIER:
+        return None
+    return Frontier(
+        os.path.join(storage.folder_path, Frontier.FRONTIER_NAME),
+        max_attempts=configuration.FRONTIER_MAX_ATTEMPTS,
+    )
+
+
+def _write_metrics(
+    storage: InstagramStorage, configuration: Configuration, status: str
+):
+    # prometheus text file and json summary of the run in the output folder,
+    # also after a failed run
+    try:
+        METRICS.write_prometheus(
+            os.path.join(storage.folder_path, configuration.METRICS_FILE_NAME)
+        )
+        METRICS.write_summary(
+            os.path.join(storage.folder_path, configuration.RUN_SUMMARY_FILE_NAME),
+            status=status,
+            stages={
+                "posts": configuration.SCRAPE_POSTS,
+                "images": configuration.SCRAPE_IMAGES,
+                "comments": configuration.SCRAPE_COMMENTS,
+            },
         )
+    except OSError:
+        logging.exception("Couldn't write the run metrics")
+
 
+def _scrape_stages(
+    storage: InstagramStorage,
+    instagrams: tp.List["InstagramApi"],
+    image_downloader: ImageDownloader,
+    companies: tp.Dict[str, tp.List[str]],
+    configuration: Configuration,
+    frontier: tp.Optional[Frontier],
+):
     if configuration.SCRAPE_POSTS:
-        scraped_posts = scrape_posts_by_tags(
-            storage, instagram, companies, maximum_posts=configuration.MAXIMUM_POSTS
-        )
+        with STAGE_SECONDS.time(stage="posts"):
+            scraped_posts = scrape_posts_by_tags(
+                storage,
+                instagrams,
+                companies,
+                maximum_posts=configuration.MAXIMUM_POSTS,
+                frontier=frontier,
+                incremental=configuration.INCREMENTAL_TAGS,
+                tag_backoff=timedelta(hours=configuration.TAG_BACKOFF_HOURS),
+            )
 
     if configuration.SCRAPE_IMAGES:
-        if not configuration.SCRAPE_POSTS:
-            scraped_posts = storage.get_all_with_no_image()
-        logging.info(f"Scraping images for {len(scraped_posts)} posts")
-        scrape_images_for_posts(scraped_posts, storage, instagram)
+        if configuration.SCRAPE_POSTS:
+            posts, number_posts = scraped_posts, len(scraped_posts)
+        else:
+            # posts are loaded lazily in batches while the stage runs
+            posts = storage.iter_posts_with_no_image()
+            number_posts = storage.count_with_no_image()
+        logging.info(f"Scraping images for {number_posts} posts")
+        with STAGE_SECONDS.time(stage="images"):
+            scrape_images_for_posts(
+                posts,
+                storage,
+                image_downloader,
+                checkpoint_every=configuration.CHECKPOINT_EVERY,
+                frontier=frontier,
+            )
 
     if configuration.SCRAPE_COMMENTS:
-        if not configuration.SCRAPE_POSTS:
-            scraped_posts = storage.get_all_with_no_comment()
-        logging.info(f"Scraping comments for {len(scraped_posts)} posts")
-        scrape_comments_for_posts(scraped_posts, storage, instagram)
+        if configuration.SCRAPE_POSTS:
+            posts, number_posts = scraped_posts, len(scraped_posts)
+        else:
+            posts = storage.iter_posts_with_no_comment()
+            number_posts = storage.count_with_no_comment()
+        logging.info(f"Scraping comments for {number_posts} posts")
+        with STAGE_SECONDS.time(stage="comments"):
+            scrape_comments_for_posts(
+                posts,
+                storage,
+                instagrams,
+                checkpoint_every=configuration.CHECKPOINT_EVERY,
+                frontier=frontier,
+                tabs=configuration.COMMENT_TABS,
+            )
 
 
 def scrape_posts_by_tags(
     storage: InstagramStorage,
-    instagram: InstagramApi,
+    instagrams: tp.List["InstagramApi"],
     companies: tp.Dict[str, tp.List[str]],
     maximum_posts=50,
+    frontier: tp.Optional[Frontier] = None,
+    incremental: bool = True,
+    tag_backoff: timedelta = timedelta(hours=1),
 ) -> tp.List[Post]:
+    # Every (company, tag) pair is a work item handed to whichever browser is
+    # free. Workers only read storage through the filter, all writes happen
+    # in this thread; both go under the same lock.
+    # Incrementally a tag page is only read down to the posts seen at its top
+    # last time, and tags without new posts are skipped for tag_backoff,
+    # doubled with every such run.
+    lock = threading.Lock()
+    # posts claimed in this run and everything stored before
+    seen_posts = SeenPostIndex(storage)
+    posts_per_company: tp.Dict[str, int] = defaultdict(int)
+    free_instagrams: queue.Queue = queue.Queue()
+    for api in instagrams:
+        free_instagrams.put(api)
+
     def filter_post(post: Post) -> bool:
         # returns true if post passes the filter
-        return not storage.is_post_present(post.id)
+        with lock:
+            return not seen_posts.is_seen(post.id)
+
+    def scrape_tag(
+        company: str, tag: str
+    ) -> tp.Optional[tp.Tuple[tp.List[Post], tp.List[str]]]:
+        # returns the posts and the ids of all posts on the page in page
+        # order, None if the company already has enough posts
+        with lock:
+            remaining = maximum_posts - posts_per_company[company]
+            known_post_ids = (
+                set(storage.get_tag_state(tag).recent_post_ids) if incremental else None
+            )
+        if remaining <= 0:
+            return None
+        page_post_ids: tp.List[str] = []
+
+        def filter_tag_post(post: Post) -> bool:
+            page_post_ids.append(post.id)
+            return filter_post(post)
+
+        api = free_instagrams.get()
+        try:
+            tag_posts = api.scrape_posts_by_tag(
+                tag,
+                filter_function=filter_tag_post,
+                maximum_posts=remaining,
+                known_post_ids=known_post_ids,
+            )
+        finally:
+            free_instagrams.put(api)
+        return tag_posts, page_post_ids
 
+    work = _tag_work(
+        storage, companies, frontier, incremental, tag_backoff, len(instagrams), lock
+    )
     posts = []  # tp.List[Post]
-    for company, tags in companies.items():
-        for post in instagram.scrape_posts_by_tags(
-            tags, filter_post, maximum_posts=maximum_posts
-        ):
-            post.company = company
-            storage.update_post_info(post)
-            posts.append(post)
+    try:
+        with ThreadPoolExecutor(
+            max_workers=len(instagrams), thread_name_prefix="tag-scraper"
+        ) as executor:
+            pending: tp.Dict[Future, tp.Tuple[str, str, str]] = {}
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < len(instagrams):
+                    try:
+                        key, company, tag = next(work)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending[executor.submit(scrape_tag, company, tag)] = (
+                        key,
+                        company,
+                        tag,
+                    )
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key, company, tag = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as error:
+                        logging.exception(f"Failed scraping a tag of company {company}")
+                        if frontier is not None:
+                            frontier.fail("tag", key, repr(error))
+                        continue
+                    with lock:
+                        posts.extend(
+                            _save_tag_posts(
+                                storage,
+                                seen_posts,
+                                posts_per_company,
+                                maximum_posts,
+                                company,
+                                tag,
+                                result,
+                                incremental,
+                            )
+                        )
+                        if frontier is not None:
+                            storage.save_table_changes()
+                            frontier.complete("tag", [key])
+    finally:
+        seen_posts.close()
     storage.save_table_changes()  # don't forget this step :)
     return posts
 
 
+def _tag_is_due(
+    storage: InstagramStorage, tag: str, incremental: bool, tag_backoff: timedelta
+) -> bool:
+    if not incremental:
+        return True
+    state = storage.get_tag_state(tag)
+    if state.is_due(datetime.now(), tag_backoff):
+        return True
+    logging.info(
+        f"Skipping tag {tag} until {state.next_due(tag_backoff)}, "
+        f"no new posts in the last {state.empty_runs} runs"
+    )
+    return False
+
+
+def _tag_work(
+    storage: InstagramStorage,
+    companies: tp.Dict[str, tp.List[str]],
+    frontier: tp.Optional[Frontier],
+    incremental: bool,
+    tag_backoff: timedelta,
+    batch_size: int,
+    lock: tp.ContextManager = contextlib.nullcontext(),
+) -> tp.Iterator[tp.Tuple[str, str, str]]:
+    # (key, company, tag) of the tags that are due; with a frontier a tag is
+    # leased right before it is scraped and completed once its posts are
+    # saved, so an interrupted round continues with the tags it did not finish
+    def tag_is_due(tag: str) -> bool:
+        with lock:
+            return _tag_is_due(storage, tag, incremental, tag_backoff)
+
+    work: tp.Iterator[tp.Tuple[str, str, str]] = (
+        (f"{company}/{tag}", company, tag)
+        for company, tags in companies.items()
+        for tag in tags
+        if tag_is_due(tag)
+    )
+    if frontier is None:
+        return work
+    frontier.start_round("tag", ((key, {"company": c, "tag": t}) for key, c, t in work))
+    return (
+        (item.key, item.payload["company"], item.payload["tag"])
+        for item in frontier.iter_leased("tag", batch_size=batch_size)
+    )
+
+
+def _save_tag_posts(
+    storage: InstagramStorage,
+    seen_posts: SeenPostIndex,
+    posts_per_company: tp.Dict[str, int],
+    maximum_posts: int,
+    company: str,
+    tag: str,
+    result: tp.Optional[tp.Tuple[tp.List[Post], tp.List[str]]],
+    incremental: bool,
+) -> tp.List[Post]:
+    # stores the new posts of a scraped tag page up to the company's quota
+    # and the tag's state, returns the stored posts. The tag had new posts if
+    # any on the page weren't seen before, even if the quota dropped them;
+    # dropped ones are left out of its mark, the next run reads them again.
+    tag_posts, page_post_ids = result or ([], [])
+    saved = []
+    dropped = set()
+    for post in tag_posts:
+        if posts_per_company[company] >= maximum_posts:
+            dropped.add(post.id)
+            continue
+        if seen_posts.is_claimed(post.id):
+            continue
+        seen_posts.add(post.id)
+        posts_per_company[company] += 1
+        post.company = company
+        storage.update_post_info(post)
+        saved.append(post)
+    if incremental and result is not None:
+        state = storage.get_tag_state(tag)
+        state.record_run(
+            [post_id for post_id in page_post_ids if post_id not in dropped],
+            len(tag_posts),
+            datetime.now(),
+        )
+        storage.update_tag_state(state)
+    return saved
+
+
 def scrape_images_for_posts(
-    posts: tp.List[Post], storage: InstagramStorage, instagram: InstagramApi
+    posts: tp.Iterable[Post],
+    storage: InstagramStorage,
+    image_downloader: ImageDownloader,
+    checkpoint_every: int = 0,
+    frontier: tp.Optional[Frontier] = None,
 ):
+    checkpoint = _Checkpoint(storage, checkpoint_every, frontier, "image")
+    if frontier is not None:
+        posts = _frontier_posts(posts, frontier, "image")
+
+    # downloads run in a thread pool and stream straight to files,
+    # moving them in place and updating the table stays in this thread
+    downloads = image_downloader.fetch_many(
+        _images_to_download(posts, storage, checkpoint),
+        to_directory=storage.incoming_path,
+    )
     try:
-        for post in posts:
-            image = instagram.scrape_image_by_url(post.image_url)
-            storage.save_image_for_post(post.id, image)
+        for post, downloaded_path in downloads:
+            _save_downloaded_image(post, downloaded_path, storage, checkpoint)
     finally:
-        storage.save_table_changes()  # don't forget this step :)
+        image_downloader.close()
+        checkpoint.save()  # don't forget this step :)
 
 
 def scrape_comments_for_posts(
-    posts: tp.List[Post], storage: InstagramStorage, instagram: InstagramApi
+    posts: tp.Iterable[Post],
+    storage: InstagramStorage,
+    instagrams: tp.List["InstagramApi"],
+    checkpoint_every: int = 0,
+    frontier: tp.Optional[Frontier] = None,
+    tabs: int = 4,
 ):
-    def filter_small_comments(comment: str):
-        if len(comment) < 2:
-            return False
-        return True
+    # Posts are loaded `tabs` at a time in tabs of one browser, every batch
+    # goes to whichever browser is free. Batches are read and saved in this
+    # thread, browsers only scrape.
+    checkpoint = _Checkpoint(storage, checkpoint_every, frontier, "comment")
+    if frontier is not None:
+        posts = _frontier_posts(posts, frontier, "comment")
+    posts = iter(posts)
+    free_instagrams: queue.Queue = queue.Queue()
+    for api in instagrams:
+        free_instagrams.put(api)
 
-    try:
-        for post in posts:
-            instagram.scrape_comments(
-                post, max_comments=100, filter=filter_small_comments
+    def scrape_batch(batch: tp.List[Post]) -> tp.List[tp.Tuple[Post, bool]]:
+        api = free_instagrams.get()
+        try:
+            return list(
+                api.scrape_comments_batch(
+                    batch, max_comments=100, filter=_filter_small_comments, tabs=tabs
+                )
             )
-            logging.info(f"comments: {post.comments}")
-            storage.update_post_info(post)
+        finally:
+            free_instagrams.put(api)
+
+    try:
+        with ThreadPoolExecutor(
+            max_workers=len(instagrams), thread_name_prefix="comment-scraper"
+        ) as executor:
+            pending: tp.Dict[Future, tp.List[Post]] = {}
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < len(instagrams):
+                    batch = list(islice(posts, tabs))
+                    if not batch:
+                        exhausted = True
+                        break
+                    pending[executor.submit(scrape_batch, batch)] = batch
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = pending.pop(future)
+                    try:
+                        scraped = future.result()
+                    except Exception as error:
+                        # a dead browser fails its batch, not the whole stage
+                        logging.exception(
+                            f"Failed scraping comments of {len(batch)} posts"
+                        )
+                        for post in batch:
+                            checkpoint.failed(post.id, repr(error))
+                        continue
+                    for post, success in scraped:
+                        _save_comments(post, success, storage, checkpoint)
     finally:
-        storage.save_table_changes()  # don't forget this step :)
+        checkpoint.save()  # don't forget this step :)
+
+
+def _images_to_download(
+    posts: tp.Iterable[Post], storage: InstagramStorage, checkpoint: _Checkpoint
+) -> tp.Iterator[tp.Tuple[Post, str]]:
+    # (post, image url) to download; images already in the store are linked
+    # instead
+    for post in posts:
+        known_file = storage.known_image_file(post.image_url)
+        if known_file is None:
+            yield post, post.image_url
+        else:
+            storage.link_image_for_post(post.id, known_file)
+            checkpoint.done(post.id)
+
+
+def _save_downloaded_image(
+    post: Post,
+    downloaded_path: tp.Optional[str],
+    storage: InstagramStorage,
+    checkpoint: _Checkpoint,
+):
+    storage.save_image_file_for_post(post.id, downloaded_path, post.image_url)
+    if downloaded_path is None:
+        checkpoint.failed(post.id, "download failed")
+    else:
+        checkpoint.done(post.id)
+
+
+def _filter_small_comments(comment: str) -> bool:
+    if len(comment) < 2:
+        return False
+    return True
+
+
+def _save_comments(
+    post: Post, success: bool, storage: InstagramStorage, checkpoint: _Checkpoint
+):
+    if not success:
+        # left without comments, tried again by the next run
+        checkpoint.failed(post.id, "post page did not load")
+        return
+    logging.info(f"comments: {post.comments}")
+    storage.update_post_info(post)
+    checkpoint.done(post.id)
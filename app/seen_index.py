@@ -0,0 +1,196 @@
+import typing as tp
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+
+try:
+    import fcntl
+except ImportError:  # windows, bits set concurrently may get lost
+    fcntl = None  # type: ignore
+
+# Answers "was this post scraped already?" without going to the content
+# table for every tile of a tag page. Posts claimed by this process are kept
+# in a set; everything ever stored is added to a Bloom filter kept in a file
+# (seen_posts.bloom) and mapped into memory, so several worker processes can
+# share it without loading the table. A Bloom filter has no false negatives:
+# "not in the filter" means new, "in the filter" is confirmed with storage
+# when there is one. The filter file records how many rows of the table
+# (in table order) it has indexed, later rows are added on startup.
+
+
+class BloomFilter:
+    MAGIC = b"IGBF"
+    # magic, version, bits, hashes, indexed rows
+    HEADER = struct.Struct("<4sIQIQ")
+    VERSION = 2
+
+    def __init__(self, path: str, capacity: int = 1_000_000, error_rate: float = 0.001):
+        # capacity and error_rate only size a new file, an existing one is
+        # opened with the sizes it was created with
+        self.path = path
+        if os.path.exists(path) and self._is_older_version(path):
+            # the filter is rebuilt from storage
+            logging.info(f"Recreating {path}, written by an older version")
+            os.remove(path)
+        if not os.path.exists(path):
+            self._create(path, capacity, error_rate)
+        self._file = open(path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        header = self.HEADER.unpack_from(self._map)
+        magic, version, self.number_bits, self.number_hashes, _ = header
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(f"{path} is not a bloom filter file")
+
+    @classmethod
+    def _is_older_version(cls, path: str) -> bool:
+        with open(path, "rb") as file:
+            header = file.read(cls.HEADER.size)
+        if len(header) < cls.HEADER.size:
+            return False
+        magic, version = cls.HEADER.unpack(header)[:2]
+        return magic == cls.MAGIC and version < cls.VERSION
+
+    @classmethod
+    def _create(cls, path: str, capacity: int, error_rate: float):
+        number_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        number_bits = (number_bits + 7) // 8 * 8
+        number_hashes = max(1, round(number_bits / capacity * math.log(2)))
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(
+                cls.HEADER.pack(cls.MAGIC, cls.VERSION, number_bits, number_hashes, 0)
+            )
+            file.truncate(cls.HEADER.size + number_bits // 8)
+        os.replace(temporary_path, path)
+
+    @property
+    def indexed_rows(self) -> int:
+        # rows of the table added so far, kept by SeenPostIndex
+        return self.HEADER.unpack_from(self._map)[4]
+
+    def set_indexed_rows(self, rows: int):
+        with _FileLock(self._file):
+            header = list(self.HEADER.unpack_from(self._map))
+            header[4] = rows
+            self.HEADER.pack_into(self._map, 0, *header)
+
+    def _positions(self, key: str) -> tp.Iterator[int]:
+        # double hashing: k positions from two 64 bit halves of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.number_hashes):
+            yield (first + i * second) % self.number_bits
+
+    def __contains__(self, key: str) -> bool:
+        offset = self.HEADER.size
+        return all(
+            self._map[offset + (position >> 3)] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+    def add_many(self, keys: tp.Iterable[str]) -> int:
+        # returns the number of keys that were not in the filter yet
+        offset = self.HEADER.size
+        added = 0
+        with _FileLock(self._file):
+            for key in keys:
+                changed = False
+                for position in self._positions(key):
+                    index = offset + (position >> 3)
+                    value = self._map[index]
+                    bit = 1 << (position & 7)
+                    if not value & bit:
+                        self._map[index] = value | bit
+                        changed = True
+                added += int(changed)
+        return added
+
+    def add(self, key: str) -> bool:
+        return self.add_many((key,)) == 1
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+        self._file.close()
+
+
+class _FileLock:
+    # exclusive lock between processes sharing the filter file
+    def __init__(self, file):
+        self._file = file
+
+    def __enter__(self):
+        if fcntl is not None:
+            fcntl.lockf(self._file, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.lockf(self._file, fcntl.LOCK_UN)
+
+
+class SeenPostIndex:
+    BLOOM_NAME = "seen_posts.bloom"
+    MINIMUM_CAPACITY = 1_000_000
+
+    def __init__(self, storage=None, bloom_path: tp.Optional[str] = None):
+        # storage: InstagramStorage to fill the filter from and to confirm
+        # its positives with, None trusts the filter alone (for workers that
+        # have no table, at the filter's false positive rate)
+        self.storage = storage
+        if bloom_path is None:
+            bloom_path = os.path.join(storage.folder_path, self.BLOOM_NAME)
+        self._claimed: tp.Set[str] = set()
+        number_posts = storage.count_posts() if storage is not None else 0
+        self._bloom = BloomFilter(
+            bloom_path, capacity=max(self.MINIMUM_CAPACITY, 2 * number_posts)
+        )
+        if storage is not None:
+            self._add_stored_posts(bloom_path)
+
+    def _add_stored_posts(self, bloom_path: str):
+        # rows stored since the filter was last brought up to date: posts of
+        # this and other processes, or stored while the filter wasn't used
+        indexed = self._bloom.indexed_rows
+        if indexed > self.storage.count_posts():
+            # a table that was replaced, its rows are all added again; bits
+            # of posts no longer stored only cost a storage lookup
+            indexed = 0
+        rows = 0
+
+        def counted(post_ids: tp.Iterator[str]) -> tp.Iterator[str]:
+            nonlocal rows
+            for post_id in post_ids:
+                rows += 1
+                yield post_id
+
+        added = self._bloom.add_many(counted(self.storage.iter_post_ids(start=indexed)))
+        if rows:
+            self._bloom.set_indexed_rows(indexed + rows)
+            logging.info(f"Added {added} of {rows} stored posts to {bloom_path}")
+
+    def is_seen(self, post_id: str) -> bool:
+        if post_id in self._claimed:
+            return True
+        if post_id not in self._bloom:
+            return False
+        if self.storage is None:
+            return True
+        return self.storage.is_post_present(post_id)
+
+    def is_claimed(self, post_id: str) -> bool:
+        # claimed by this process
+        return post_id in self._claimed
+
+    def add(self, post_id: str):
+        self._claimed.add(post_id)
+        self._bloom.add(post_id)
+
+    def close(self):
+        self._bloom.close()
@@ -0,0 +1,116 @@
+import typing as tp
+import json
+import logging
+import os
+import time
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
+
+from .post import INSTAGRAM_URL
+from .waits import Waiter
+
+SESSION_COOKIE = "sessionid"
+# only rendered for a logged in user: the home and direct messages links
+LOGGED_IN_SELECTOR = 'svg[aria-label="Home"], a[href="/direct/inbox/"]'
+
+
+class SessionStore:
+    # Keeps the cookies of a logged in browser in a file, so later runs and
+    # other pooled browsers can skip the UI login until the session expires.
+
+    def __init__(self, path: str, check_timeout: float = 10):
+        self.path = path
+        self.check_timeout = check_timeout
+
+    def load(self) -> tp.Optional[tp.List[tp.Dict[str, tp.Any]]]:
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                cookies = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            logging.info(f"Couldn't read saved session {self.path}, ignoring it")
+            return None
+        now = time.time()
+        cookies = [c for c in cookies if c.get("expiry") is None or c["expiry"] > now]
+        if not any(cookie["name"] == SESSION_COOKIE for cookie in cookies):
+            logging.info("Saved session has expired")
+            return None
+        return cookies
+
+    def save(self, driver: webdriver.Chrome):
+        cookies = driver.get_cookies()
+        temporary_path = self.path + ".tmp"
+        # cookies give full access to the account, keep them private
+        descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+            json.dump(cookies, file)
+        os.replace(temporary_path, self.path)
+        logging.info(f"Saved instagram session to {self.path}")
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def restore(
+        self, driver: webdriver.Chrome, waiter: Waiter, base_url: str = INSTAGRAM_URL
+    ) -> bool:
+        # returns True if the browser is logged in with the saved session
+        cookies = self.load()
+        if cookies is None:
+            return False
+        if hasattr(driver, "execute_cdp_cmd"):
+            # chrome can take cookies before any page is open
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd(
+                "Network.setCookies",
+                {"cookies": [self._to_cdp_cookie(cookie) for cookie in cookies]},
+            )
+            driver.get(base_url)
+        else:
+            driver.get(base_url)
+            for cookie in cookies:
+                driver.add_cookie(cookie)
+            driver.refresh()
+
+        # the page shows either the login form or the logged in navigation
+        try:
+            waiter.until(
+                "session_check",
+                EC.any_of(
+                    EC.presence_of_element_located((By.NAME, "password")),
+                    EC.presence_of_element_located((By.CSS_SELECTOR, LOGGED_IN_SELECTOR)),
+                ),
+                timeout=self.check_timeout,
+            )
+        except TimeoutException:
+            logging.info("Couldn't tell if the saved session is valid from the page")
+        # instagram drops the session cookie of a session it rejects
+        logged_in = not driver.find_elements(By.NAME, "password") and any(
+            cookie["name"] == SESSION_COOKIE for cookie in driver.get_cookies()
+        )
+        if not logged_in:
+            logging.info("Saved session was rejected, logging in again")
+            self.clear()
+            return False
+        # keeps the cookies instagram refreshed on this load
+        self.save(driver)
+        return True
+
+    @staticmethod
+    def _to_cdp_cookie(cookie: tp.Dict[str, tp.Any]) -> tp.Dict[str, tp.Any]:
+        cdp_cookie = {
+            "name": cookie["name"],
+            "value": cookie["value"],
+            "domain": cookie.get("domain", ".instagram.com"),
+            "path": cookie.get("path", "/"),
+            "secure": cookie.get("secure", False),
+            "httpOnly": cookie.get("httpOnly", False),
+        }
+        if cookie.get("expiry") is not None:
+            cdp_cookie["expires"] = cookie["expiry"]
+        if cookie.get("sameSite") is not None:
+            cdp_cookie["sameSite"] = cookie["sameSite"]
+        return cdp_cookie
@@ -0,0 +1,246 @@
+import sqlite3
+import json
+import os
+import logging
+import typing as tp
+from datetime import date
+import pandas as pd
+from .post import Post
+from .metrics import PERSIST_SECONDS
+from .storage import InstagramStorage
+from .tag_state import TagState
+
+# Same API as InstagramStorage, but rows live in an indexed SQLite table
+# (content.db) so upserts and lookups don't scan or rewrite the whole table.
+# An existing content.csv (and content.journal) is imported once on first open.
+
+
+class SqliteInstagramStorage(InstagramStorage):
+    DATABASE_NAME = "content.db"
+    MIGRATED_TABLE_SUFFIX = ".migrated"
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS content (
+            post_id TEXT PRIMARY KEY,
+            tags TEXT,
+            company TEXT,
+            image_url TEXT,
+            image_file TEXT,
+            caption TEXT,
+            comments TEXT,
+            number_comments INTEGER,
+            scraped_at TEXT,
+            comment_details TEXT
+        );
+        CREATE INDEX IF NOT EXISTS content_company ON content (company);
+        CREATE INDEX IF NOT EXISTS content_no_image
+            ON content (post_id) WHERE image_file IS NULL;
+        CREATE INDEX IF NOT EXISTS content_no_comments
+            ON content (post_id) WHERE comments IS NULL;
+        CREATE TABLE IF NOT EXISTS tag_state (
+            tag TEXT PRIMARY KEY,
+            state TEXT NOT NULL
+        );
+    """
+    POST_COLUMNS = (
+        "post_id, image_url, caption, tags, comments, company, comment_details"
+    )
+
+    def _open_table(self):
+        self._database_path = os.path.join(self.folder_path, self.DATABASE_NAME)
+        self._connection = sqlite3.connect(
+            self._database_path, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(self.SCHEMA)
+        self._add_missing_columns()
+        self._journal_path = os.path.join(self.folder_path, self.JOURNAL_NAME)
+        if os.path.exists(self._table_path) or os.path.exists(self._journal_path):
+            self._migrate_from_csv()
+        tag_state_path = os.path.join(self.folder_path, self.TAG_STATE_NAME)
+        if os.path.exists(tag_state_path):
+            self._migrate_tag_states(tag_state_path)
+
+    def _add_missing_columns(self):
+        # databases created before a column was added
+        existing = {
+            row[1] for row in self._connection.execute("PRAGMA table_info(content)")
+        }
+        for column in self.TABLE_COLUMNS:
+            if column not in existing:
+                self._connection.execute(f"ALTER TABLE content ADD COLUMN {column}")
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
+        if self.image_index is not None:
+            self.image_index.close()
+
+    def _migrate_from_csv(self):
+        # content.csv with the records of a content.journal that a crashed
+        # journal mode run left behind replayed over it
+        logging.info(f"Migrating {self._table_path} to {self._database_path}")
+        if os.path.exists(self._table_path):
+            # index_col would parse numeric looking post ids as numbers
+            self.contents_table = pd.read_csv(
+                self._table_path, dtype=str, keep_default_na=False
+            ).set_index("post_id")
+        else:
+            self.contents_table = pd.DataFrame(
+                columns=list(self.TABLE_COLUMNS)
+            ).set_index("post_id")
+        if os.path.exists(self._journal_path):
+            self._replay_journal()
+        table = self.contents_table.reset_index()
+        del self.contents_table
+        columns = [column for column in self.TABLE_COLUMNS if column in table.columns]
+        rows = (
+            tuple(None if pd.isna(value) or value == "" else value for value in row)
+            for row in table[columns].itertuples(index=False, name=None)
+        )
+        with self._connection:
+            self._connection.executemany(
+                f"INSERT OR IGNORE INTO content ({', '.join(columns)}) "
+                f"VALUES ({', '.join('?' * len(columns))})",
+                rows,
+            )
+        for path in (self._table_path, self._journal_path):
+            if os.path.exists(path):
+                os.replace(path, path + self.MIGRATED_TABLE_SUFFIX)
+        logging.info(f"Migrated {len(table)} posts")
+
+    def _migrate_tag_states(self, tag_state_path: str):
+        with open(tag_state_path, "r", encoding="utf-8") as file:
+            states = json.load(file)
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO tag_state (tag, state) VALUES (?, ?)",
+                ((tag, json.dumps(values)) for tag, values in states.items()),
+            )
+        os.replace(tag_state_path, tag_state_path + self.MIGRATED_TABLE_SUFFIX)
+
+    def _rows_to_posts(self, rows) -> tp.List[Post]:
+        # rows are selected as POST_COLUMNS, the order Post.from_row takes
+        return [Post.from_row(*row) for row in rows]
+
+    def is_post_present(self, post_id: str) -> bool:
+        cursor = self._connection.execute(
+            "SELECT 1 FROM content WHERE post_id = ?", (post_id,)
+        )
+        return cursor.fetchone() is not None
+
+    def count_posts(self) -> int:
+        return self._count_where("1")
+
+    def iter_post_ids(self, start: int = 0) -> tp.Iterator[str]:
+        # rows are never deleted and upserts keep their rowid: new posts
+        # come last in rowid order
+        cursor = self._connection.execute(
+            "SELECT post_id FROM content ORDER BY rowid LIMIT -1 OFFSET ?", (start,)
+        )
+        return (row[0] for row in cursor)
+
+    def get_post(self, post_id: str) -> tp.Optional[Post]:
+        cursor = self._connection.execute(
+            f"SELECT {self.POST_COLUMNS} FROM content WHERE post_id = ?", (post_id,)
+        )
+        posts = self._rows_to_posts(cursor.fetchall())
+        return posts[0] if posts else None
+
+    def update_post_info(self, post: Post):
+        # empty comments are stored as NULL, same as an empty cell in content.csv
+        row = post.to_row()
+        self._connection.execute(
+            """
+            INSERT INTO content (
+                post_id, tags, company, image_url, caption, comments,
+                number_comments, scraped_at, comment_details
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (post_id) DO UPDATE SET
+                tags = excluded.tags,
+                company = excluded.company,
+                image_url = excluded.image_url,
+                caption = excluded.caption,
+                comments = excluded.comments,
+                number_comments = excluded.number_comments,
+                comment_details = excluded.comment_details
+            """,
+            (
+                post.id,
+                row["tags"],
+                row["company"],
+                row["image_url"],
+                row["caption"],
+                row["comments"] or None,
+                row["number_comments"],
+                date.today().isoformat(),
+                row["comment_details"],
+            ),
+        )
+
+    def get_tag_state(self, tag: str) -> TagState:
+        row = self._connection.execute(
+            "SELECT state FROM tag_state WHERE tag = ?", (tag,)
+        ).fetchone()
+        return TagState.from_dict(tag, json.loads(row[0])) if row else TagState(tag)
+
+    def update_tag_state(self, state: TagState):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO tag_state (tag, state) VALUES (?, ?)",
+            (state.tag, json.dumps(state.to_dict())),
+        )
+
+    def save_table_changes(self):
+        with PERSIST_SECONDS.time(operation="save_table"):
+            self._connection.commit()
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.read_sql_query("SELECT * FROM content", self._connection)
+
+    def _set_image_file(self, post_id: str, image_file_name: str):
+        cursor = self._connection.execute(
+            "SELECT image_file FROM content WHERE post_id = ?", (post_id,)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            print(f"Tried saving image for unknown post: {post_id}")
+            raise KeyError(post_id)
+        if row[0] is not None:
+            logging.info(f"Attempted replacing image file for post: {post_id}")
+        self._connection.execute(
+            "UPDATE content SET image_file = ? WHERE post_id = ?",
+            (image_file_name, post_id),
+        )
+
+    def iter_posts_with_no_image(self, batch_size: int = 1000) -> tp.Iterator[Post]:
+        return self._iter_posts_where("image_file IS NULL", batch_size)
+
+    def iter_posts_with_no_comment(self, batch_size: int = 1000) -> tp.Iterator[Post]:
+        return self._iter_posts_where("comments IS NULL", batch_size)
+
+    def count_with_no_image(self) -> int:
+        return self._count_where("image_file IS NULL")
+
+    def count_with_no_comment(self) -> int:
+        return self._count_where("comments IS NULL")
+
+    def _iter_posts_where(self, condition: str, batch_size: int) -> tp.Iterator[Post]:
+        # Pages by post_id (served by the partial indexes) rather than holding
+        # a cursor open, since the caller updates the same rows meanwhile.
+        last_post_id = ""
+        while True:
+            rows = self._connection.execute(
+                f"SELECT {self.POST_COLUMNS} FROM content "
+                f"WHERE {condition} AND post_id > ? ORDER BY post_id LIMIT ?",
+                (last_post_id, batch_size),
+            ).fetchall()
+            if not rows:
+                return
+            last_post_id = rows[-1][0]
+            yield from self._rows_to_posts(rows)
+
+    def _count_where(self, condition: str) -> int:
+        return self._connection.execute(
+            f"SELECT COUNT(*) FROM content WHERE {condition}"
+        ).fetchone()[0]
@@ -1,20 +1,82 @@
 import pandas as pd
+import hashlib
+import json
 import os
 import re
+import tempfile
+import time
 from PIL import Image  # type: ignore
-from .instagram_api import Post  # type: ignore
+from .post import Post
+from .images import file_image_format
+from .image_index import ImageIndex, perceptual_hash
+from .metrics import PERSIST_SECONDS
+from .tag_state import TagState
 import typing as tp
 import logging
+from contextlib import contextmanager
+from datetime import date
+
+try:
+    import fcntl
+except ImportError:  # windows: output folders can't be shared by processes
+    fcntl = None  # type: ignore
 
 # WARNING! Does not support concurrency calls
 # Preferrable use:
 # 1. load posts with comments and save them to storage
 # 2. save table
 # 3. begin loading images one by one and saving each one
+#
+# In journal mode save_table_changes only appends the posts changed since the
+# previous save to content.journal (one json record per line, fsynced once per
+# save). The journal is compacted into content.csv every
+# JOURNAL_COMPACT_RECORDS records and on close, and replayed on startup if the
+# previous run didn't get that far.
+#
+# Images are named img_<N>.jpg by default and sharded into images/<N // 1000>/.
+# Ids are handed out in blocks reserved in image_counter, so startup doesn't
+# scan the folder (ids skipped after a crash are simply never used). Blocks
+# are reserved under image_counter.lock, so processes sharing the folder
+# (sqlite backend) never get the same ids. The csv table is rewritten whole
+# on save, a csv folder is locked by the first process using it. With the
+# "content" image layout
+# they are named by the sha256 of their bytes and sharded into
+# images/<ab>/<cd>/, so identical images are stored once; see ImageIndex for
+# skipping known urls and perceptual (near-duplicate) matching.
+#
+# Per tag scraping state (see TagState) is kept in tag_state.json and written
+# by save_table_changes together with the table.
+
+# (pid, folder) of the csv locks this process holds, reopening them is fine;
+# a forked child is another process
+_LOCKED_FOLDERS: tp.Dict[tp.Tuple[int, str], tp.IO] = {}
+
+
+@contextmanager
+def _file_lock(path: str):
+    # exclusive between processes, held until the block ends
+    with open(path, "a") as file:
+        if fcntl is not None:
+            fcntl.flock(file, fcntl.LOCK_EX)
+        yield
 
 
 class InstagramStorage:
     CONTENT_TABLE_NAME = "content.csv"
+    JOURNAL_NAME = "content.journal"
+    JOURNAL_COMPACT_RECORDS = 10000
+    TAG_STATE_NAME = "tag_state.json"
+    INCOMING_FOLDER_NAME = ".incoming"  # images being downloaded
+    # incoming files untouched this long are leftovers of a crash, newer ones
+    # may belong to another process sharing the folder
+    INCOMING_STALE_SECONDS = 3600
+    IMAGES_FOLDER_NAME = "images"
+    IMAGE_SHARD_FORMAT = "{shard:04d}"
+    IMAGE_SHARD_SIZE = 1000
+    IMAGE_COUNTER_NAME = "image_counter"
+    LOCK_SUFFIX = ".lock"
+    IMAGE_ID_BLOCK = 1000  # ids reserved per counter write
+    PHASH_DISTANCE = 3
     IMAGE_NAME_REGEX = re.compile(r"img_(\d+)\.jpg")
     IMAGE_NAME_FORMAT = "img_{image_id}.jpg"
     TABLE_COLUMNS = {  # column : pandas dtype
@@ -26,17 +88,92 @@ class InstagramStorage:
         "caption": "str",  # necessary
         "comments": "str",
         "number_comments": "int",
+        "scraped_at": "str",  # date the post was first stored
+        "comment_details": "str",  # json: author, timestamp, likes per comment
     }
 
-    def __init__(self, folder_path: str = "../data", clear_old=False):
+    def __init__(
+        self,
+        folder_path: str = "../data",
+        clear_old=False,
+        journal=False,
+        image_max_size: tp.Optional[int] = None,
+        image_layout: str = "sequential",
+        phash_dedup: bool = False,
+    ):
+        self.journal = journal
+        # images are stored as downloaded unless they have to be resized
+        self.image_max_size = image_max_size
         self.folder_path = os.path.abspath(folder_path)
         if clear_old:
             self._clear_folder_contents()
         os.makedirs(self.folder_path, exist_ok=True)
+        self.incoming_path = os.path.join(self.folder_path, self.INCOMING_FOLDER_NAME)
+        os.makedirs(self.incoming_path, exist_ok=True)
+        self._remove_stale_incoming()
+
+        if image_layout not in ("sequential", "content"):
+            raise ValueError(f"Unknown image layout: {image_layout}")
+        self.image_index: tp.Optional[ImageIndex] = None
+        if image_layout == "content":
+            self.image_index = ImageIndex(
+                self.folder_path, self.PHASH_DISTANCE if phash_dedup else None
+            )
 
         self._table_path = os.path.join(self.folder_path, self.CONTENT_TABLE_NAME)
+        self._open_table()
+
+        self._image_counter_path = os.path.join(
+            self.folder_path, self.IMAGE_COUNTER_NAME
+        )
+        with _file_lock(self._image_counter_path + self.LOCK_SUFFIX):
+            self._current_image_count = self._load_image_counter()
+        self._reserved_image_count = self._current_image_count
+
+    def _remove_stale_incoming(self):
+        stale_before = time.time() - self.INCOMING_STALE_SECONDS
+        for entry in os.scandir(self.incoming_path):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < stale_before:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass  # moved in place by its owner meanwhile
+
+    def _lock_folder(self):
+        # the table is rewritten whole on save, a second process would
+        # overwrite what the first one saved
+        key = (os.getpid(), self.folder_path)
+        if fcntl is None or key in _LOCKED_FOLDERS:
+            return
+        file = open(self._table_path + self.LOCK_SUFFIX, "a")
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            raise RuntimeError(
+                f"{self.folder_path} is used by another process, only the sqlite "
+                "backend can share an output folder"
+            )
+        _LOCKED_FOLDERS[key] = file
+
+    def _open_table(self):
+        self._lock_folder()
         if os.path.exists(self._table_path):
-            self.contents_table = pd.read_csv(self._table_path, index_col="post_id")
+            # text columns stay text: numeric looking post ids, all empty
+            # image_file or comments columns aren't parsed as numbers
+            self.contents_table = pd.read_csv(
+                self._table_path,
+                index_col="post_id",
+                dtype={
+                    column: object
+                    for column, column_type in self.TABLE_COLUMNS.items()
+                    if column_type == "str"
+                },
+            )
+            # tables written before a column was added
+            for column in self.TABLE_COLUMNS:
+                if column != "post_id" and column not in self.contents_table:
+                    self.contents_table[column] = None
         else:
             self.contents_table = pd.DataFrame(
                 {
@@ -46,83 +183,332 @@ class InstagramStorage:
             )
             self.contents_table.set_index("post_id", inplace=True)
 
-        self._current_image_count = self._last_existing_image_id() + 1
+        self._journal_path = os.path.join(self.folder_path, self.JOURNAL_NAME)
+        self._journal_records = 0
+        # a dict as an ordered set: journal records follow the order posts
+        # were added in, a table rebuilt from the journal alone keeps it
+        self._dirty_posts: tp.Dict[str, None] = {}
+        if os.path.exists(self._journal_path):
+            self._replay_journal()
+            if not self.journal:
+                self._compact()
+
+        self._tag_state_path = os.path.join(self.folder_path, self.TAG_STATE_NAME)
+        self._tag_states: tp.Dict[str, TagState] = {}
+        self._tag_states_changed = False
+        if os.path.exists(self._tag_state_path):
+            with open(self._tag_state_path, "r", encoding="utf-8") as file:
+                for tag, values in json.load(file).items():
+                    self._tag_states[tag] = TagState.from_dict(tag, values)
+
+    def close(self):
+        if self.journal:
+            self.save_table_changes()
+            self._compact()
+        if self.image_index is not None:
+            self.image_index.close()
+
+    def _replay_journal(self):
+        records = {}
+        with open(self._journal_path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # a torn last line from a crash mid-append
+                    logging.info("Skipping corrupted journal record")
+                    continue
+                records[record.pop("post_id")] = record
+        self._journal_records = len(records)
+        if not records:
+            return
+        logging.info(f"Recovering {len(records)} posts from {self._journal_path}")
+        changed = pd.DataFrame.from_dict(records, orient="index")
+        changed.index.name = "post_id"
+        # rows keep their place, new posts are appended (see iter_post_ids)
+        order = self.contents_table.index.append(
+            changed.index.difference(self.contents_table.index, sort=False)
+        )
+        self.contents_table = pd.concat(
+            [self.contents_table.drop(index=changed.index, errors="ignore"), changed]
+        ).reindex(order)
+
+    def _append_to_journal(self):
+        with open(self._journal_path, "a", encoding="utf-8") as file:
+            for post_id in self._dirty_posts:
+                row = self.contents_table.loc[post_id]
+                record = {"post_id": post_id}
+                for column, value in row.items():
+                    record[column] = None if pd.isna(value) else value
+                file.write(json.dumps(record, default=str) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        self._journal_records += len(self._dirty_posts)
+
+    def _compact(self):
+        self._write_table()
+        if os.path.exists(self._journal_path):
+            os.remove(self._journal_path)
+        self._journal_records = 0
+
+    def _write_table(self):
+        # write next to the table and swap, so a crash never leaves half a csv
+        temporary_path = self._table_path + ".tmp"
+        self.contents_table.to_csv(temporary_path)
+        os.replace(temporary_path, self._table_path)
 
     def is_post_present(self, post_id: str) -> bool:
         return post_id in self.contents_table.index
 
+    def count_posts(self) -> int:
+        return len(self.contents_table)
+
+    def iter_post_ids(self, start: int = 0) -> tp.Iterator[str]:
+        # in table order, new posts are appended: from row `start` on
+        return iter(self.contents_table.index[start:].to_list())
+
     def get_post(self, post_id: str) -> tp.Optional[Post]:
-        if self.is_post_present:
+        if self.is_post_present(post_id):
             post_row = self.contents_table.loc[post_id]
-            return Post(
-                id=post_id,
-                image_url=post_row.image_url,
-                caption=post_row.caption,
-                comments=post_row.comments.split("\n"),
+            return Post.from_row(
+                post_id,
+                post_row["image_url"],
+                post_row["caption"],
+                post_row["tags"],
+                post_row["comments"],
+                post_row["company"],
+                post_row["comment_details"],
             )
         return None
 
     def _rows_to_posts(self, rows) -> tp.List[Post]:
-        post_objects = []
-        for index, row in rows.iterrows():
-            post = Post(
-                id=index,
-                image_url=row["image_url"],
-                caption=row["caption"],
-                tags=row["tags"].split(",") if pd.notna(row["tags"]) else [],
-                comments=(
-                    row["comments"].split("\n") if pd.notna(row["comments"]) else []
-                ),
+        return list(self._iter_rows_as_posts(rows))
+
+    def _iter_rows_as_posts(self, rows, batch_size: int = 1000) -> tp.Iterator[Post]:
+        # reads the frame column-wise batch by batch, building Post objects
+        # only as they are consumed (no per-row Series like iterrows)
+        for start in range(0, len(rows), batch_size):
+            batch = rows.iloc[start:start + batch_size]
+            columns = zip(
+                batch.index.to_numpy(),
+                batch["image_url"].to_numpy(),
+                batch["caption"].to_numpy(),
+                batch["tags"].to_numpy(),
+                batch["comments"].to_numpy(),
+                batch["company"].to_numpy(),
+                batch["comment_details"].to_numpy(),
             )
-            post.company = row["company"]
-            post_objects.append(post)
-        return post_objects
+            for values in columns:
+                yield Post.from_row(*values)
 
     def update_post_info(self, post: Post):
-        new_row = {
-            "image_url": post.image_url,
-            "caption": post.caption,
-            "comments": "\n".join(post.comments),
-            "number_comments": len(post.comments),
-            "company": post.company,
-        }
-        self.contents_table.loc[post.id] = new_row
+        row = post.to_row()
+        if post.id in self.contents_table.index:
+            # only the post's own columns, image_file and scraped_at are kept
+            self.contents_table.loc[post.id, list(row)] = list(row.values())
+        else:
+            row["scraped_at"] = date.today().isoformat()
+            # a missing key would make an all empty image_file column float
+            row["image_file"] = None
+            self.contents_table.loc[post.id] = row
+        self._dirty_posts[post.id] = None
+
+    def to_dataframe(self) -> pd.DataFrame:
+        # the whole table with post_id as a column
+        return self.contents_table.reset_index()
+
+    def get_tag_state(self, tag: str) -> TagState:
+        return self._tag_states.get(tag) or TagState(tag)
+
+    def update_tag_state(self, state: TagState):
+        self._tag_states[state.tag] = state
+        self._tag_states_changed = True
+
+    def _write_tag_states(self):
+        temporary_path = self._tag_state_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(
+                {tag: state.to_dict() for tag, state in self._tag_states.items()},
+                file,
+            )
+        os.replace(temporary_path, self._tag_state_path)
+        self._tag_states_changed = False
 
     def save_table_changes(self):
-        self.contents_table.to_csv(self._table_path)
+        with PERSIST_SECONDS.time(operation="save_table"):
+            if self._tag_states_changed:
+                self._write_tag_states()
+            if not self.journal:
+                self._write_table()
+            elif self._dirty_posts:
+                self._append_to_journal()
+                if self._journal_records >= self.JOURNAL_COMPACT_RECORDS:
+                    self._compact()
+            self._dirty_posts.clear()
 
     def save_image_for_post(self, post_id: str, img: Image):
-        # saving image
-        image_file_name = self.IMAGE_NAME_FORMAT.format(
-            image_id=self._current_image_count
-        )
         if img is None:
             logging.info(
                 f"Cant's save image for post: {post_id}, it seems it could not be loaded"
             )
-        img.save(os.path.join(self.folder_path, image_file_name))
+            return
+        descriptor, path = tempfile.mkstemp(suffix=".jpg", dir=self.incoming_path)
+        with os.fdopen(descriptor, "wb") as file:
+            img.convert("RGB").save(file, "JPEG")
+        self.save_image_file_for_post(post_id, path)
+
+    def save_image_file_for_post(
+        self,
+        post_id: str,
+        downloaded_path: tp.Optional[str],
+        image_url: tp.Optional[str] = None,
+    ):
+        # takes ownership of a downloaded file (see incoming_path) and moves it
+        # in place; PIL is only used if the image has to be converted
+        if downloaded_path is None:
+            logging.info(
+                f"Cant's save image for post: {post_id}, it seems it could not be loaded"
+            )
+            return
+        with PERSIST_SECONDS.time(operation="save_image"):
+            if self.image_max_size or file_image_format(downloaded_path) != "jpeg":
+                self._convert_to_jpeg(downloaded_path)
+            if self.image_index is not None:
+                image_file_name = self._store_content_addressed(
+                    downloaded_path, image_url
+                )
+            else:
+                image_file_name = self._store_sequential(downloaded_path)
+
+            # updating image file info for post
+            self._set_image_file(post_id, image_file_name)
+
+    def known_image_file(self, image_url: str) -> tp.Optional[str]:
+        # file an image url was already saved to, content layout only
+        if self.image_index is None:
+            return None
+        return self.image_index.find_by_url(image_url)
+
+    def link_image_for_post(self, post_id: str, image_file_name: str):
+        self._set_image_file(post_id, image_file_name)
+
+    def _convert_to_jpeg(self, path: str):
+        with Image.open(path) as img:
+            img = img.convert("RGB")
+            if self.image_max_size:
+                img.thumbnail((self.image_max_size, self.image_max_size))
+            converted_path = path + ".jpg"
+            img.save(converted_path, "JPEG")
+        os.replace(converted_path, path)
+
+    def _store_sequential(self, path: str) -> str:
+        image_id = self._allocate_image_id()
+        image_file_name = "/".join(
+            (
+                self.IMAGES_FOLDER_NAME,
+                self.IMAGE_SHARD_FORMAT.format(shard=image_id // self.IMAGE_SHARD_SIZE),
+                self.IMAGE_NAME_FORMAT.format(image_id=image_id),
+            )
+        )
+        image_path = os.path.join(self.folder_path, image_file_name)
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+        os.replace(path, image_path)
+        return image_file_name
+
+    def _allocate_image_id(self) -> int:
+        if self._current_image_count >= self._reserved_image_count:
+            # the next block after whatever other processes reserved meanwhile
+            with _file_lock(self._image_counter_path + self.LOCK_SUFFIX):
+                self._current_image_count = self._load_image_counter()
+                self._reserved_image_count = (
+                    self._current_image_count + self.IMAGE_ID_BLOCK
+                )
+                self._write_image_counter(self._reserved_image_count)
+        image_id = self._current_image_count
         self._current_image_count += 1
+        return image_id
 
-        # updating image file info for post
+    def _load_image_counter(self) -> int:
+        if os.path.exists(self._image_counter_path):
+            with open(self._image_counter_path, "r") as file:
+                return int(file.read().strip())
+        # folders from before the counter existed, scanned only once
+        next_image_id = self._last_existing_image_id() + 1
+        self._write_image_counter(next_image_id)
+        return next_image_id
+
+    def _write_image_counter(self, value: int):
+        temporary_path = self._image_counter_path + ".tmp"
+        with open(temporary_path, "w") as file:
+            file.write(str(value))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self._image_counter_path)
+
+    def _store_content_addressed(self, path: str, image_url: tp.Optional[str]) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        name = digest.hexdigest()
+        image_file_name = "/".join(
+            (self.IMAGES_FOLDER_NAME, name[:2], name[2:4], name + ".jpg")
+        )
+        image_path = os.path.join(self.folder_path, image_file_name)
+        if os.path.exists(image_path):
+            os.remove(path)
+            self.image_index.add(image_file_name, image_url=image_url)
+            return image_file_name
+
+        phash = None
+        if self.image_index.phash_distance is not None:
+            with Image.open(path) as img:
+                phash = perceptual_hash(img)
+            similar_file = self.image_index.find_similar(phash)
+            if similar_file is not None:
+                logging.info(f"Image is a near-duplicate of {similar_file}")
+                os.remove(path)
+                self.image_index.add(similar_file, image_url=image_url)
+                return similar_file
+
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+        os.replace(path, image_path)
+        self.image_index.add(image_file_name, image_url=image_url, phash=phash)
+        return image_file_name
+
+    def _set_image_file(self, post_id: str, image_file_name: str):
         try:
             old_file = self.contents_table.loc[post_id, "image_file"]
             if pd.notna(old_file):
                 logging.info(f"Attempted replacing image file for post: {post_id}")
             self.contents_table.loc[post_id, "image_file"] = image_file_name
+            self._dirty_posts[post_id] = None
         except KeyError:
             print(f"Tried saving image for unknown post: {post_id}")
             raise
 
     def get_all_with_no_image(self) -> tp.List[Post]:
-        return self._rows_to_posts(
-            self.contents_table[self.contents_table["image_file"].isna()]
-        )
+        return list(self.iter_posts_with_no_image())
 
     def get_all_with_no_comment(self) -> tp.List[Post]:
-        return self._rows_to_posts(
-            self.contents_table[self.contents_table["comments"].isna()]
+        return list(self.iter_posts_with_no_comment())
+
+    def iter_posts_with_no_image(self, batch_size: int = 1000) -> tp.Iterator[Post]:
+        return self._iter_rows_as_posts(
+            self.contents_table[self.contents_table["image_file"].isna()], batch_size
         )
 
+    def iter_posts_with_no_comment(self, batch_size: int = 1000) -> tp.Iterator[Post]:
+        return self._iter_rows_as_posts(
+            self.contents_table[self.contents_table["comments"].isna()], batch_size
+        )
+
+    def count_with_no_image(self) -> int:
+        return int(self.contents_table["image_file"].isna().sum())
+
+    def count_with_no_comment(self) -> int:
+        return int(self.contents_table["comments"].isna().sum())
+
     def _clear_old_contents(self):
         content_extentions = ("jpg", "jpeg", "png", "gif", "bmp", "csv")
         if os.path.exists(self.folder_path):
@@ -139,11 +525,34 @@ class InstagramStorage:
             print(f"Contents of {self.folder_path} cleared.")
 
     def _last_existing_image_id(self):
+        last_image_id = -1
         if os.path.exists(self.folder_path):
             for entry in os.scandir(self.folder_path):
                 if not entry.is_file():
-                    pass
+                    continue
                 match = self.IMAGE_NAME_REGEX.match(entry.name)
                 if match:
-                    return int(match.group(1))
-        return -1
+                    last_image_id = max(last_image_id, int(match.group(1)))
+        return last_image_id
+
+
+def create_storage(
+    folder_path: str,
+    backend: str = "csv",
+    journal: bool = False,
+    image_max_size: tp.Optional[int] = None,
+    image_layout: str = "sequential",
+    phash_dedup: bool = False,
+) -> InstagramStorage:
+    image_options = dict(
+        image_max_size=image_max_size,
+        image_layout=image_layout,
+        phash_dedup=phash_dedup,
+    )
+    if backend == "csv":
+        return InstagramStorage(folder_path=folder_path, journal=journal, **image_options)
+    if backend == "sqlite":
+        from .sqlite_storage import SqliteInstagramStorage
+
+        return SqliteInstagramStorage(folder_path=folder_path, **image_options)
+    raise ValueError(f"Unknown storage backend: {backend}")
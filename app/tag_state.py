@@ -0,0 +1,69 @@
+import typing as tp
+from datetime import datetime, timedelta
+
+# What previous runs learned about a tag page, kept by the storage. The ids
+# at the top of the page in the last run are its high-water mark: scrolling
+# stops once the page gets back to them. Tags that brought no new posts for
+# several runs in a row are scraped less and less often.
+
+
+class TagState:
+    __slots__ = ("tag", "recent_post_ids", "last_scraped", "empty_runs")
+
+    RECENT_POSTS = 30  # ids kept from the top of the page
+    MAX_BACKOFF = timedelta(days=7)
+
+    def __init__(
+        self,
+        tag: str,
+        recent_post_ids: tp.Sequence[str] = (),
+        last_scraped: tp.Optional[datetime] = None,
+        empty_runs: int = 0,
+    ):
+        self.tag = tag
+        self.recent_post_ids = tuple(recent_post_ids)
+        self.last_scraped = last_scraped
+        self.empty_runs = empty_runs
+
+    def next_due(self, backoff: timedelta) -> tp.Optional[datetime]:
+        # backoff doubles with every run in a row without new posts
+        if self.last_scraped is None or self.empty_runs == 0 or not backoff:
+            return None
+        return self.last_scraped + min(
+            backoff * 2 ** (self.empty_runs - 1), self.MAX_BACKOFF
+        )
+
+    def is_due(self, now: datetime, backoff: timedelta) -> bool:
+        next_due = self.next_due(backoff)
+        return next_due is None or now >= next_due
+
+    def record_run(self, seen_post_ids: tp.Sequence[str], new_posts: int, now: datetime):
+        # newest first; a run that stopped early at the mark keeps the
+        # older known ids behind the new ones
+        seen = set(seen_post_ids)
+        recent_post_ids = list(seen_post_ids) + [
+            post_id for post_id in self.recent_post_ids if post_id not in seen
+        ]
+        self.recent_post_ids = tuple(recent_post_ids[: self.RECENT_POSTS])
+        self.last_scraped = now
+        self.empty_runs = 0 if new_posts else self.empty_runs + 1
+
+    def to_dict(self) -> tp.Dict[str, tp.Any]:
+        return {
+            "recent_post_ids": list(self.recent_post_ids),
+            "last_scraped": self.last_scraped.isoformat() if self.last_scraped else None,
+            "empty_runs": self.empty_runs,
+        }
+
+    @classmethod
+    def from_dict(cls, tag: str, values: tp.Dict[str, tp.Any]) -> "TagState":
+        last_scraped = values.get("last_scraped")
+        return cls(
+            tag,
+            recent_post_ids=values.get("recent_post_ids", ()),
+            last_scraped=datetime.fromisoformat(last_scraped) if last_scraped else None,
+            empty_runs=values.get("empty_runs", 0),
+        )
+
+    def __repr__(self):
+        return f"TagState(tag: {self.tag} empty runs: {self.empty_runs})"
@@ -0,0 +1,120 @@
+import typing as tp
+import asyncio
+import logging
+import time
+from selenium import webdriver
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
+
+_CURRENT = object()
+
+
+class WaitStats:
+    def __init__(self):
+        self.count = 0
+        self.timeouts = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def add(self, seconds: float, timed_out: bool):
+        self.count += 1
+        self.timeouts += int(timed_out)
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.total_seconds / self.count if self.count else 0.0
+
+    def __str__(self):
+        return (
+            f"count: {self.count}, timeouts: {self.timeouts}, "
+            f"mean: {self.mean_seconds:.2f}s, max: {self.max_seconds:.2f}s"
+        )
+
+
+class Waiter:
+    # Polls page conditions at a short interval instead of sleeping a fixed
+    # time, and keeps per operation timings so timeouts can be tuned.
+
+    def __init__(self, driver: webdriver.Chrome, poll_frequency: float = 0.25):
+        self.driver = driver
+        self.poll_frequency = poll_frequency
+        self.stats: tp.Dict[str, WaitStats] = {}
+
+    def until(self, operation: str, condition, timeout: float):
+        # raises TimeoutException like WebDriverWait.until
+        started = time.monotonic()
+        timed_out = False
+        try:
+            return WebDriverWait(
+                self.driver, timeout, poll_frequency=self.poll_frequency
+            ).until(condition)
+        except TimeoutException:
+            timed_out = True
+            raise
+        finally:
+            self._record(operation, time.monotonic() - started, timed_out)
+
+    def until_changed(
+        self,
+        operation: str,
+        value_function: tp.Callable[[], tp.Any],
+        timeout: float,
+        initial_value: tp.Any = _CURRENT,
+    ) -> bool:
+        # waits until value_function() differs from initial_value (by default
+        # its current value), returns False on timeout
+        if initial_value is _CURRENT:
+            initial_value = value_function()
+        try:
+            self.until(operation, lambda _: value_function() != initial_value, timeout)
+        except TimeoutException:
+            return False
+        return True
+
+    async def until_async(self, operation: str, condition, timeout: float):
+        # until for asyncio: the condition is checked in a worker thread and
+        # the poll interval is awaited, the event loop is never blocked
+        started = time.monotonic()
+        timed_out = False
+        try:
+            while True:
+                try:
+                    value = await asyncio.to_thread(condition, self.driver)
+                except NoSuchElementException:
+                    value = None
+                if value:
+                    return value
+                if time.monotonic() - started >= timeout:
+                    timed_out = True
+                    raise TimeoutException(f"{operation} timed out after {timeout}s")
+                await asyncio.sleep(self.poll_frequency)
+        finally:
+            self._record(operation, time.monotonic() - started, timed_out)
+
+    async def until_changed_async(
+        self,
+        operation: str,
+        value_function: tp.Callable[[], tp.Any],
+        timeout: float,
+        initial_value: tp.Any = _CURRENT,
+    ) -> bool:
+        if initial_value is _CURRENT:
+            initial_value = await asyncio.to_thread(value_function)
+        try:
+            await self.until_async(
+                operation, lambda _: value_function() != initial_value, timeout
+            )
+        except TimeoutException:
+            return False
+        return True
+
+    def _record(self, operation: str, seconds: float, timed_out: bool):
+        if operation not in self.stats:
+            self.stats[operation] = WaitStats()
+        self.stats[operation].add(seconds, timed_out)
+
+    def log_stats(self):
+        for operation, stats in sorted(self.stats.items()):
+            logging.info(f"wait {operation}: {stats}")
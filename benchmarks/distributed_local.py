@@ -0,0 +1,105 @@
+# A coordinator and several worker processes on one machine, against
+# benchmarks.fake_instagram: the images of --posts stored posts are
+# downloaded by --workers worker processes and merged by the coordinator
+# into a fresh output folder. Prints the stage time and the results every
+# worker sent, exits with an error if a post is left without its image.
+# Tag and comment stages are handed out the same way but need chrome.
+# usage: python -m benchmarks.distributed_local [--workers N] [--posts N]
+#     [--latency SECONDS] [--storage-backend {csv,sqlite}]
+import argparse
+import logging
+import multiprocessing
+import os
+import secrets
+import socket
+import sys
+import tempfile
+import typing as tp
+
+from app.config import load_configuration, parse_arguments
+from app.distributed import run_coordinator, run_worker
+from app.metrics import STAGE_SECONDS, WORKER_RESULTS
+from app.post import Post
+from app.storage import create_storage
+from benchmarks.fake_instagram import FakeInstagram
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def worker_main(argv: tp.List[str]):
+    logging.basicConfig(level=logging.WARNING)
+    run_worker(load_configuration(ROOT_DIR, parse_arguments(argv)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="distributed scraping on one machine")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--posts", type=int, default=600)
+    parser.add_argument("--download-workers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--storage-backend", choices=["csv", "sqlite"], default="csv")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    shared = [
+        "--coordinator-address",
+        f"127.0.0.1:{free_port()}",
+        "--coordinator-authkey",
+        secrets.token_hex(16),
+        "--download-workers",
+        str(args.download_workers),
+        "--image-rate",
+        "0",
+    ]
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=worker_main, args=(["--role", "worker"] + shared,))
+        for _ in range(args.workers)
+    ]
+    with FakeInstagram(posts_per_tag=args.posts, latency=args.latency) as fake:
+        with tempfile.TemporaryDirectory() as folder:
+            storage = create_storage(folder, backend=args.storage_backend)
+            for post_id in fake.post_ids("tag0"):
+                storage.update_post_info(
+                    Post(post_id, fake.image_url(post_id), "caption", tags=["tag0"])
+                )
+            storage.save_table_changes()
+            configuration = load_configuration(
+                ROOT_DIR,
+                parse_arguments(
+                    ["--role", "coordinator", "-op", folder, "--scrape-images"] + shared
+                ),
+            )
+            # images of the stored posts only
+            configuration.SCRAPE_POSTS = False
+            configuration.SCRAPE_COMMENTS = False
+
+            for worker in workers:
+                worker.start()
+            try:
+                run_coordinator(storage, configuration)
+            finally:
+                for worker in workers:
+                    worker.join(timeout=30)
+            missing = storage.count_with_no_image()
+            storage.close()
+
+    seconds = STAGE_SECONDS.summary()["stage=images"]["sum"]
+    print(f"{args.posts} images with {args.workers} workers in {seconds:.2f}s")
+    print(f"{'worker':<32}{'images':>8}")
+    for labels, count in sorted(WORKER_RESULTS.summary().items()):
+        worker = dict(pair.split("=", 1) for pair in labels.split(","))["worker"]
+        print(f"{worker:<32}{count:>8g}")
+    if missing:
+        print(f"{missing} posts without an image")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+# Local stand-in for instagram, serving tag pages, post pages and images with
+# the markup InstagramApi reads, so the scraper can be driven end to end
+# without network or account. Pages are generated from the tag and post id
+# (same content on every run); pages saved with --debug-pages can be served
+# instead by pointing --recorded at their folder (<post_id>.html for posts,
+# tag_<tag>.html for tag pages).
+# usage: python -m benchmarks.fake_instagram [--port PORT] [--recorded FOLDER]
+import argparse
+import html
+import json
+import os
+import random
+import re
+import threading
+import time
+import typing as tp
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+from PIL import Image
+
+from app.instagram_api import (
+    CAPTION_CLASS,
+    COMMENT_AUTHOR_CLASS,
+    COMMENT_CLASS,
+    COMMENT_CONTAINER_CLASS,
+)
+
+TAG_PATH_REGEX = re.compile(r"^/explore/tags/([^/]+)/$")
+POST_PATH_REGEX = re.compile(r"^/p/([a-zA-Z0-9_\-]+)/$")
+IMAGE_PATH_REGEX = re.compile(r"^/img/([a-zA-Z0-9_\-]+)\.jpg$")
+
+# tiles are rendered like instagram's grid: a > div > div._aagv > img.
+# More tiles are appended when the page is scrolled to the bottom.
+TAG_PAGE_TEMPLATE = """<!DOCTYPE html>
+<html><head><title>#{tag}</title></head>
+<body style="margin:0">
+<main id="grid"></main>
+<script>
+var tiles = {tiles};
+var pageSize = {page_size};
+var shown = 0;
+function showMore() {{
+    var grid = document.getElementById("grid");
+    tiles.slice(shown, shown + pageSize).forEach(function (tile) {{
+        var link = document.createElement("a");
+        link.href = tile.href;
+        link.style.display = "block";
+        link.style.height = "300px";
+        link.innerHTML = '<div><div class="_aagv"><img></div></div>';
+        var img = link.querySelector("img");
+        img.src = tile.src;
+        img.alt = tile.alt;
+        grid.appendChild(link);
+    }});
+    shown += pageSize;
+}}
+showMore();
+window.addEventListener("scroll", function () {{
+    if (window.innerHeight + window.scrollY >= document.body.scrollHeight - 10) {{
+        setTimeout(showMore, {scroll_delay_ms});
+    }}
+}});
+</script>
+</body></html>
+"""
+POST_PAGE_TEMPLATE = """<!DOCTYPE html>
+<html><head><title>{post_id}</title></head>
+<body>
+<main>
+<h1 class="{caption_class}">{caption}</h1>
+<ul>
+{comments}
+</ul>
+</main>
+</body></html>
+"""
+COMMENT_TEMPLATE = """<li class="{comment_class}">
+<h3 class="{author_class}">{author}</h3>
+<div class="{container_class}"><span>{text}</span></div>
+<time datetime="{timestamp}"></time>
+<button>{likes} likes</button>
+</li>"""
+
+
+class FakeInstagram:
+    def __init__(
+        self,
+        posts_per_tag: int = 120,
+        comments_per_post: int = 30,
+        page_size: int = 24,
+        latency: float = 0.0,
+        scroll_delay: float = 0.2,
+        image_size: int = 320,
+        recorded_folder: tp.Optional[str] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        # latency: seconds added to every answer
+        self.posts_per_tag = posts_per_tag
+        self.comments_per_post = comments_per_post
+        self.page_size = page_size
+        self.latency = latency
+        self.scroll_delay = scroll_delay
+        self.recorded_folder = recorded_folder
+        self._images = [self._make_image(i, image_size) for i in range(16)]
+        self.requests: tp.Dict[str, int] = {"tag": 0, "post": 0, "image": 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: tp.Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self) -> str:
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="fake-instagram", daemon=True
+        )
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def post_ids(self, tag: str) -> tp.List[str]:
+        return [f"{tag}_{i:05d}" for i in range(self.posts_per_tag)]
+
+    def image_url(self, post_id: str) -> str:
+        return f"{self.base_url}/img/{post_id}.jpg"
+
+    @staticmethod
+    def _make_image(seed: int, size: int) -> bytes:
+        # noise, so the JPEG has a realistic size for its dimensions
+        generator = random.Random(seed)
+        image = Image.frombytes("RGB", (size, size), generator.randbytes(size * size * 3))
+        buffer = BytesIO()
+        image.save(buffer, "JPEG", quality=85)
+        return buffer.getvalue()
+
+    def _recorded_page(self, name: str) -> tp.Optional[bytes]:
+        if self.recorded_folder is None:
+            return None
+        path = os.path.join(self.recorded_folder, name)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as file:
+            return file.read()
+
+    def tag_page(self, tag: str) -> bytes:
+        recorded = self._recorded_page(f"tag_{tag}.html")
+        if recorded is not None:
+            return recorded
+        tiles = [
+            {
+                "href": f"{self.base_url}/p/{post_id}/",
+                "src": self.image_url(post_id),
+                "alt": f"post {post_id} #{tag}",
+            }
+            for post_id in self.post_ids(tag)
+        ]
+        return TAG_PAGE_TEMPLATE.format(
+            tag=html.escape(tag),
+            tiles=json.dumps(tiles),
+            page_size=self.page_size,
+            scroll_delay_ms=int(self.scroll_delay * 1000),
+        ).encode()
+
+    def post_page(self, post_id: str) -> bytes:
+        recorded = self._recorded_page(f"{post_id}.html")
+        if recorded is not None:
+            return recorded
+        generator = random.Random(post_id)
+        comments = "\n".join(
+            COMMENT_TEMPLATE.format(
+                comment_class=COMMENT_CLASS,
+                author_class=COMMENT_AUTHOR_CLASS,
+                container_class=COMMENT_CONTAINER_CLASS,
+                author=f"user{generator.randrange(10000)}",
+                text=f"comment {i} on {post_id}",
+                timestamp=f"2024-01-{1 + i % 28:02d}T12:00:00.000Z",
+                likes=generator.randrange(100),
+            )
+            for i in range(self.comments_per_post)
+        )
+        return POST_PAGE_TEMPLATE.format(
+            post_id=post_id,
+            caption_class=CAPTION_CLASS,
+            caption=f"caption of {post_id}",
+            comments=comments,
+        ).encode()
+
+    def image(self, post_id: str) -> bytes:
+        return self._images[sum(map(ord, post_id)) % len(self._images)]
+
+    def _count(self, kind: str):
+        with self._lock:
+            self.requests[kind] += 1
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if fake.latency:
+                    time.sleep(fake.latency)
+                path = self.path.split("?")[0]
+                match = TAG_PATH_REGEX.match(path)
+                if match:
+                    fake._count("tag")
+                    return self._send(fake.tag_page(match.group(1)), "text/html")
+                match = POST_PATH_REGEX.match(path)
+                if match:
+                    fake._count("post")
+                    return self._send(fake.post_page(match.group(1)), "text/html")
+                match = IMAGE_PATH_REGEX.match(path)
+                if match:
+                    fake._count("image")
+                    return self._send(fake.image(match.group(1)), "image/jpeg")
+                if path == "/":
+                    return self._send(b"<html><body></body></html>", "text/html")
+                self.send_error(404)
+
+            def _send(self, body: bytes, content_type: str):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="local fake instagram server")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--recorded", metavar="folder", default=None)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    fake = FakeInstagram(
+        latency=args.latency, recorded_folder=args.recorded, port=args.port
+    )
+    print(f"serving on {fake.base_url}, e.g. {fake.base_url}/explore/tags/netflix/")
+    fake._server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# Memory held per Post object, compared to a plain (dict based) class.
+# usage: python -m benchmarks.post_memory [number_posts]
+import sys
+import tracemalloc
+import typing as tp
+
+from app.post import Post
+
+
+class DictPost:
+    # the previous Post layout: per-instance __dict__, list fields
+    def __init__(self, id, image_url, caption, tags, comments):
+        self.id = id
+        self.image_url = image_url
+        self.caption = caption
+        self.tags = tags
+        self.comments = comments
+        self.company = None
+
+
+def _values(i: int) -> tp.Tuple[str, str, str]:
+    return (
+        f"C{i:010d}",
+        f"https://scontent.cdninstagram.com/v/t51.29350-15/{i}_n.jpg",
+        f"caption of post {i}",
+    )
+
+
+def _measure(build: tp.Callable[[int], object], number_posts: int) -> float:
+    # the strings are created up front so only the objects themselves count
+    values = [_values(i) for i in range(number_posts)]
+    tracemalloc.start()
+    posts = [build(*value) for value in values]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del posts
+    return size / number_posts
+
+
+def main():
+    number_posts = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    slotted = _measure(
+        lambda id, url, caption: Post(id, url, caption, tags=("tag",)), number_posts
+    )
+    plain = _measure(
+        lambda id, url, caption: DictPost(id, url, caption, ["tag"], []), number_posts
+    )
+    print(f"posts: {number_posts}")
+    print(f"Post (slots):    {slotted:.0f} bytes per post")
+    print(f"dict based post: {plain:.0f} bytes per post")
+    print(f"saved:           {(1 - slotted / plain) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
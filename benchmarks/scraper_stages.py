@@ -0,0 +1,286 @@
+# Throughput and latency percentiles of every scraping stage, run end to end
+# against benchmarks.fake_instagram: tag pages, comments (one tab and
+# batched tabs), image downloads and storage. Every run is appended to a
+# history file and compared with the previous runs of the same settings;
+# stages whose throughput dropped by more than --threshold are reported.
+# Browser stages need chrome, --no-browser runs the rest only.
+# usage: python -m benchmarks.scraper_stages [--tags N] [--posts-per-tag N]
+#     [--storage-backend {csv,sqlite}] [--history FILE] [--fail-on-regression]
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import typing as tp
+from contextlib import contextmanager
+from datetime import datetime
+
+from app.downloader import ImageDownloader
+from app.instagram_api import InstagramApi, Post
+from app.storage import create_storage
+from benchmarks.fake_instagram import FakeInstagram
+
+HISTORY_BASELINE_RUNS = 5  # baseline: median of this many earlier runs
+HISTORY_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "bench_history.jsonl"
+)
+
+
+def percentile(values: tp.List[float], q: float) -> float:
+    # nearest rank
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+class Stage:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: tp.List[float] = []
+        self.items = 0
+        self._started = time.perf_counter()
+        self.seconds = 0.0
+
+    @contextmanager
+    def item(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+            self.items += 1
+
+    def finish(self) -> "Stage":
+        self.seconds = time.perf_counter() - self._started
+        return self
+
+    def to_dict(self) -> tp.Dict[str, float]:
+        return {
+            "items": self.items,
+            "seconds": round(self.seconds, 4),
+            "throughput": round(self.items / self.seconds, 3) if self.seconds else 0.0,
+            "p50_ms": round(percentile(self.latencies, 50) * 1000, 2),
+            "p90_ms": round(percentile(self.latencies, 90) * 1000, 2),
+            "p99_ms": round(percentile(self.latencies, 99) * 1000, 2),
+        }
+
+
+def _timed(stage: Stage, function: tp.Callable) -> tp.Callable:
+    def wrapper(*args, **kwargs):
+        with stage.item():
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def run_browser_stages(
+    fake: FakeInstagram, tags: tp.List[str], comment_posts: int, comment_tabs: int
+) -> tp.List[Stage]:
+    from app.driver import create_driver
+
+    driver = create_driver(headless=True)
+    try:
+        api = InstagramApi(driver, base_url=fake.base_url, max_scrolls=100)
+        stage = Stage("tag_pages")
+        posts: tp.List[Post] = []
+        for tag in tags:
+            with stage.item():
+                posts.extend(
+                    api.scrape_posts_by_tag(
+                        tag, filter_function=lambda post: True, maximum_posts=10**6
+                    )
+                )
+        stages = [stage.finish()]
+        logging.info(f"tag pages: {len(posts)} posts")
+
+        stage = Stage("comments")
+        for post in posts[:comment_posts]:
+            with stage.item():
+                api.scrape_comments(post, max_comments=100)
+        stages.append(stage.finish())
+
+        # per item latency of the batched engine is the time between results
+        stage = Stage("comments_batch")
+        last = time.perf_counter()
+        batch_posts = [Post(post.id, post.image_url, post.caption) for post in posts]
+        for _ in api.scrape_comments_batch(
+            batch_posts[:comment_posts], max_comments=100, tabs=comment_tabs
+        ):
+            now = time.perf_counter()
+            stage.latencies.append(now - last)
+            stage.items += 1
+            last = now
+        stages.append(stage.finish())
+        return stages
+    finally:
+        driver.quit()
+
+
+def run_http_stages(
+    fake: FakeInstagram,
+    posts: tp.List[Post],
+    storage_backend: str,
+    download_workers: int,
+) -> tp.List[Stage]:
+    stages = []
+    downloader = ImageDownloader(max_workers=download_workers)
+    api = InstagramApi(None, image_downloader=downloader, base_url=fake.base_url)
+
+    stage = Stage("image_fetch")
+    for post in posts[:50]:
+        with stage.item():
+            api.scrape_image_by_url(post.image_url)
+    stages.append(stage.finish())
+
+    with tempfile.TemporaryDirectory() as folder:
+        storage = create_storage(folder, backend=storage_backend)
+
+        stage = Stage("storage_update")
+        for post in posts:
+            with stage.item():
+                storage.update_post_info(post)
+        stages.append(stage.finish())
+
+        stage = Stage("storage_save")
+        with stage.item():
+            storage.save_table_changes()
+        stages.append(stage.finish())
+
+        # per request latency inside the pool, throughput of the whole stage
+        stage = Stage("image_download")
+        downloader.fetch_to_file = _timed(stage, downloader.fetch_to_file)
+        downloaded = list(
+            api.scrape_images_for_posts(posts, to_directory=storage.incoming_path)
+        )
+        stages.append(stage.finish())
+
+        stage = Stage("storage_images")
+        for post, path in downloaded:
+            with stage.item():
+                storage.save_image_file_for_post(post.id, path, post.image_url)
+        with stage.item():
+            storage.save_table_changes()
+        stages.append(stage.finish())
+        storage.close()
+    downloader.close()
+    return stages
+
+
+def _git_commit() -> tp.Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path: str) -> tp.List[tp.Dict[str, tp.Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return [json.loads(line) for line in file if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def find_regressions(
+    run: tp.Dict[str, tp.Any],
+    history: tp.List[tp.Dict[str, tp.Any]],
+    threshold: float,
+) -> tp.List[str]:
+    # compares throughput with the median of the last runs of the same settings
+    earlier = [old for old in history if old["settings"] == run["settings"]]
+    earlier = earlier[-HISTORY_BASELINE_RUNS:]
+    regressions = []
+    for name, result in run["stages"].items():
+        baseline = [
+            old["stages"][name]["throughput"] for old in earlier if name in old["stages"]
+        ]
+        if not baseline:
+            continue
+        expected = statistics.median(baseline)
+        if expected and result["throughput"] < expected * (1 - threshold):
+            regressions.append(
+                f"{name}: {result['throughput']:.2f}/s, "
+                f"baseline {expected:.2f}/s over {len(baseline)} runs"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="scraper stage benchmarks")
+    parser.add_argument("--tags", type=int, default=3)
+    parser.add_argument("--posts-per-tag", type=int, default=120)
+    parser.add_argument("--comment-posts", type=int, default=40)
+    parser.add_argument("--comment-tabs", type=int, default=4)
+    parser.add_argument("--download-workers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--storage-backend", choices=["csv", "sqlite"], default="csv")
+    parser.add_argument("--recorded", metavar="folder", default=None)
+    parser.add_argument("--no-browser", action="store_true")
+    parser.add_argument("--history", default=HISTORY_PATH)
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    settings = {
+        key: value
+        for key, value in vars(args).items()
+        if key not in ("history", "threshold", "fail_on_regression")
+    }
+    tags = [f"tag{i}" for i in range(args.tags)]
+    stages: tp.List[Stage] = []
+    with FakeInstagram(
+        posts_per_tag=args.posts_per_tag,
+        latency=args.latency,
+        recorded_folder=args.recorded,
+    ) as fake:
+        if not args.no_browser:
+            stages.extend(
+                run_browser_stages(fake, tags, args.comment_posts, args.comment_tabs)
+            )
+        posts = [
+            Post(post_id, fake.image_url(post_id), f"caption of {post_id}", tags=[tag])
+            for tag in tags
+            for post_id in fake.post_ids(tag)
+        ]
+        stages.extend(
+            run_http_stages(fake, posts, args.storage_backend, args.download_workers)
+        )
+
+    run = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "settings": settings,
+        "stages": {stage.name: stage.to_dict() for stage in stages},
+    }
+    print(f"{'stage':<16}{'items':>7}{'items/s':>10}", end="")
+    print(f"{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}")
+    for name, result in run["stages"].items():
+        print(
+            f"{name:<16}{result['items']:>7}{result['throughput']:>10.2f}"
+            f"{result['p50_ms']:>10.2f}{result['p90_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+        )
+
+    regressions = find_regressions(run, load_history(args.history), args.threshold)
+    with open(args.history, "a", encoding="utf-8") as file:
+        file.write(json.dumps(run) + "\n")
+    if regressions:
+        print("regressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# Wall time from starting python to the point where each kind of run can
+# begin its work, for the short cron runs where startup is a large part of
+# the run: `app.py --help`, the imports of an images-only run and of a run
+# with browsers. Every scenario is a fresh interpreter, the median of --runs
+# is reported. The --help path is also checked with -X importtime for heavy
+# dependencies (pandas, selenium, ...) it should not import.
+# usage: python -m benchmarks.startup_time [--runs N] [--budget SECONDS]
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import typing as tp
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+SCENARIOS = {
+    "python": ["-c", "pass"],
+    "help": ["app.py", "--help"],
+    "images_only": ["-c", "import app.storage, app.scraping"],
+    "browser_run": [
+        "-c",
+        "import app.storage, app.scraping, app.instagram_api, app.driver_pool",
+    ],
+    "export": ["-c", "import app.export"],
+}
+# not needed before a stage runs
+HEAVY_MODULES = ("pandas", "numpy", "pyarrow", "selenium", "PIL", "requests")
+
+
+def run_once(arguments: tp.List[str]) -> float:
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable] + arguments,
+        cwd=ROOT_DIR,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - started
+
+
+def imported_modules(arguments: tp.List[str]) -> tp.Dict[str, int]:
+    # top-level package -> cumulative import time in microseconds
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime"] + arguments,
+        cwd=ROOT_DIR,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    modules: tp.Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header
+        package = name.strip().split(".")[0]
+        modules[package] = max(modules.get(package, 0), int(cumulative))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="startup time benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=None,
+        help="exit with an error if `app.py --help` takes longer (seconds)",
+    )
+    args = parser.parse_args()
+
+    results = {}
+    for name, arguments in SCENARIOS.items():
+        times = [run_once(arguments) for _ in range(args.runs)]
+        results[name] = (statistics.median(times), min(times))
+    print(f"{'scenario':<14}{'median ms':>11}{'min ms':>9}")
+    for name, (median, minimum) in results.items():
+        print(f"{name:<14}{median * 1000:>11.1f}{minimum * 1000:>9.1f}")
+
+    failed = False
+    heavy = {
+        module: microseconds
+        for module, microseconds in imported_modules(SCENARIOS["help"]).items()
+        if module in HEAVY_MODULES
+    }
+    if heavy:
+        failed = True
+        print("--help imports heavy dependencies:")
+        for module, microseconds in sorted(heavy.items(), key=lambda item: -item[1]):
+            print(f"  {module}: {microseconds / 1000:.1f} ms")
+    if args.budget is not None and results["help"][0] > args.budget:
+        failed = True
+        print(f"--help took {results['help'][0]:.3f}s, budget {args.budget:.3f}s")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
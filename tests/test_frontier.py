@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+from app.frontier import Frontier
+
+
+@pytest.fixture
+def frontier(tmp_path):
+    frontier = Frontier(str(tmp_path / Frontier.FRONTIER_NAME), max_attempts=2)
+    yield frontier
+    frontier.close()
+
+
+def _expire_leases(frontier: Frontier):
+    frontier._connection.execute("UPDATE frontier SET lease_expires = 0")
+
+
+def test_leased_items_are_not_leased_again(frontier):
+    assert frontier.enqueue("image", [("a", {}), ("b", {}), ("c", {})]) == 3
+    assert [item.key for item in frontier.lease("image", 2)] == ["a", "b"]
+    assert [item.key for item in frontier.lease("image", 2)] == ["c"]
+    assert frontier.lease("image", 2) == []
+    frontier.complete("image", ["a", "b", "c"])
+    assert frontier.counts("image") == {"done": 3}
+
+
+def test_expired_lease_is_leased_again(frontier):
+    frontier.enqueue("image", [("a", {"url": "u"})])
+    frontier.lease("image", 1, owner="dead")
+    _expire_leases(frontier)
+    (item,) = frontier.lease("image", 1)
+    assert item.payload == {"url": "u"}
+    assert item.attempts == 2
+
+
+def test_renewed_lease_does_not_expire(frontier):
+    frontier.lease_seconds = 1
+    frontier.enqueue("image", [("a", {})])
+    frontier.lease("image", 1)
+    time.sleep(0.6)
+    frontier.renew("image")
+    time.sleep(0.6)
+    assert frontier.lease("image", 1) == []
+
+
+def test_items_fail_after_max_attempts(frontier):
+    frontier.enqueue("comment", [("a", {}), ("b", {})])
+    for _ in range(2):
+        frontier.lease("comment", 1)
+        frontier.fail("comment", "a", "error")
+    assert frontier.counts("comment") == {"failed": 1, "pending": 1}
+
+    # an expired lease with no attempts left fails too
+    frontier.lease("comment", 1, owner="dead")
+    _expire_leases(frontier)
+    frontier.lease("comment", 1, owner="dead")
+    _expire_leases(frontier)
+    assert frontier.lease("comment", 1) == []
+    assert frontier.counts("comment") == {"failed": 2}
+
+
+def test_fail_of_another_owner_is_ignored(frontier):
+    frontier.enqueue("tag", [("a", {})])
+    frontier.lease("tag", 1, owner="first")
+    _expire_leases(frontier)
+    frontier.lease("tag", 1, owner="second")
+    frontier.fail("tag", "a", "late", owner="first")
+    assert frontier.counts("tag") == {"leased": 1}
+
+
+def test_enqueue_retries_failed_items(frontier):
+    frontier.enqueue("image", [("a", {}), ("b", {})])
+    for _ in range(2):
+        frontier.lease("image", 1)
+        frontier.fail("image", "a")
+    frontier.lease("image", 1)
+    frontier.complete("image", ["b"])
+
+    assert frontier.enqueue("image", [("a", {}), ("b", {}), ("c", {})]) == 2
+    assert frontier.counts("image") == {"done": 1, "pending": 2}
+    assert [item.attempts for item in frontier.lease("image", 2)] == [1, 1]
+
+
+def test_start_round_resumes_unfinished_round(frontier):
+    assert not frontier.start_round("tag", [("a", {}), ("b", {})])
+    frontier.lease("tag", 1)
+    frontier.complete("tag", ["a"])
+    assert frontier.start_round("tag", [("c", {})])
+    assert [item.key for item in frontier.lease("tag", 5)] == ["b"]
+    frontier.complete("tag", ["b"])
+    assert not frontier.start_round("tag", [("c", {})])
+    assert frontier.counts("tag") == {"pending": 1}
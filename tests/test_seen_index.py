@@ -0,0 +1,79 @@
+import pytest
+
+from app.post import Post
+from app.seen_index import BloomFilter, SeenPostIndex
+from app.storage import create_storage
+
+
+def _store_posts(storage, post_ids):
+    for post_id in post_ids:
+        storage.update_post_info(Post(post_id, f"http://images/{post_id}.jpg", "c"))
+    storage.save_table_changes()
+
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+def test_filter_is_filled_from_storage(tmp_path, backend):
+    storage = create_storage(str(tmp_path), backend=backend)
+    _store_posts(storage, ["1", "2"])
+    seen = SeenPostIndex(storage)
+    assert seen.is_seen("1") and seen.is_seen("2")
+    assert not seen.is_seen("3")
+    seen.add("3")
+    assert seen.is_seen("3") and seen.is_claimed("3")
+    seen.close()
+
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+def test_only_rows_after_the_watermark_are_added(tmp_path, backend, monkeypatch):
+    storage = create_storage(str(tmp_path), backend=backend)
+    _store_posts(storage, ["1", "2"])
+    SeenPostIndex(storage).close()
+
+    _store_posts(storage, ["3"])
+    added = []
+    add_many = BloomFilter.add_many
+
+    def recording_add_many(self, keys):
+        keys = list(keys)
+        added.extend(keys)
+        return add_many(self, keys)
+
+    monkeypatch.setattr(BloomFilter, "add_many", recording_add_many)
+    seen = SeenPostIndex(storage)
+    assert added == ["3"]
+    assert seen._bloom.indexed_rows == 3
+    assert seen.is_seen("3")
+    seen.close()
+
+
+def test_replaced_table_is_added_again(tmp_path):
+    storage = create_storage(str(tmp_path / "first"))
+    _store_posts(storage, ["1", "2", "3"])
+    bloom_path = str(tmp_path / SeenPostIndex.BLOOM_NAME)
+    SeenPostIndex(storage, bloom_path=bloom_path).close()
+
+    # a smaller table than the filter was brought up to date with
+    replaced = create_storage(str(tmp_path / "second"))
+    _store_posts(replaced, ["4"])
+    seen = SeenPostIndex(replaced, bloom_path=bloom_path)
+    assert seen.is_seen("4")
+    assert not seen.is_seen("1")  # in the filter, but not stored any more
+    assert seen._bloom.indexed_rows == 1
+    seen.close()
+
+
+def test_older_filter_version_is_recreated(tmp_path):
+    path = str(tmp_path / SeenPostIndex.BLOOM_NAME)
+    BloomFilter(path, capacity=1000).close()
+    with open(path, "r+b") as file:
+        header = list(BloomFilter.HEADER.unpack(file.read(BloomFilter.HEADER.size)))
+        header[1] = BloomFilter.VERSION - 1
+        file.seek(0)
+        file.write(BloomFilter.HEADER.pack(*header))
+
+    storage = create_storage(str(tmp_path / "posts"))
+    _store_posts(storage, ["1"])
+    seen = SeenPostIndex(storage, bloom_path=path)
+    assert seen._bloom.indexed_rows == 1
+    assert seen.is_seen("1")
+    seen.close()
@@ -0,0 +1,128 @@
+import json
+import multiprocessing
+import os
+
+from app.post import Post
+from app.sqlite_storage import SqliteInstagramStorage
+from app.storage import InstagramStorage, create_storage
+
+
+def _post(post_id: str, caption: str = "caption") -> Post:
+    return Post(post_id, f"http://images/{post_id}.jpg", caption, tags=("tag",))
+
+
+def _journal_records(folder) -> int:
+    path = os.path.join(folder, InstagramStorage.JOURNAL_NAME)
+    if not os.path.exists(path):
+        return 0
+    with open(path, encoding="utf-8") as file:
+        return len(file.readlines())
+
+
+def test_journal_is_replayed_after_a_crash(tmp_path):
+    storage = create_storage(str(tmp_path), journal=True)
+    for post_id in ("1", "2", "3"):
+        storage.update_post_info(_post(post_id))
+    storage.save_table_changes()
+    storage.update_post_info(_post("2", "edited"))
+    storage.save_table_changes()
+    assert _journal_records(tmp_path) == 4
+    # no close: the csv was never written
+
+    reopened = InstagramStorage(str(tmp_path / "."), journal=True)
+    assert list(reopened.iter_post_ids()) == ["1", "2", "3"]
+    assert reopened.get_post("2").caption == "edited"
+
+
+def test_journal_skips_a_torn_last_record(tmp_path):
+    storage = create_storage(str(tmp_path), journal=True)
+    storage.update_post_info(_post("1"))
+    storage.save_table_changes()
+    with open(tmp_path / InstagramStorage.JOURNAL_NAME, "a") as file:
+        file.write('{"post_id": "2", "capt')
+
+    reopened = InstagramStorage(str(tmp_path / "."), journal=True)
+    assert list(reopened.iter_post_ids()) == ["1"]
+
+
+def test_journal_is_compacted(tmp_path, monkeypatch):
+    monkeypatch.setattr(InstagramStorage, "JOURNAL_COMPACT_RECORDS", 3)
+    storage = create_storage(str(tmp_path), journal=True)
+    storage.update_post_info(_post("1"))
+    storage.save_table_changes()
+    assert _journal_records(tmp_path) == 1
+    storage.update_post_info(_post("2"))
+    storage.update_post_info(_post("3"))
+    storage.save_table_changes()
+    assert _journal_records(tmp_path) == 0
+    assert (tmp_path / InstagramStorage.CONTENT_TABLE_NAME).exists()
+
+    storage.update_post_info(_post("4"))
+    storage.close()
+    assert _journal_records(tmp_path) == 0
+    reopened = InstagramStorage(str(tmp_path / "."))
+    assert list(reopened.iter_post_ids()) == ["1", "2", "3", "4"]
+
+
+def test_csv_is_migrated_to_sqlite_with_its_journal(tmp_path):
+    storage = create_storage(str(tmp_path), journal=True)
+    storage.update_post_info(_post("1"))
+    storage.update_post_info(_post("2"))
+    storage.close()
+    storage = InstagramStorage(str(tmp_path / "."), journal=True)
+    storage.update_post_info(_post("2", "edited"))
+    storage.update_post_info(_post("3"))
+    storage.save_table_changes()
+
+    migrated = create_storage(str(tmp_path), backend="sqlite")
+    assert isinstance(migrated, SqliteInstagramStorage)
+    assert list(migrated.iter_post_ids()) == ["1", "2", "3"]
+    assert migrated.get_post("2").caption == "edited"
+    assert migrated.count_with_no_image() == 3
+    for name in (InstagramStorage.CONTENT_TABLE_NAME, InstagramStorage.JOURNAL_NAME):
+        assert not (tmp_path / name).exists()
+        assert (tmp_path / (name + SqliteInstagramStorage.MIGRATED_TABLE_SUFFIX)).exists()
+
+
+def test_journal_without_csv_is_migrated(tmp_path):
+    with open(tmp_path / InstagramStorage.JOURNAL_NAME, "w") as file:
+        file.write(json.dumps({"post_id": "1", "image_url": "u", "caption": "c"}) + "\n")
+
+    migrated = create_storage(str(tmp_path), backend="sqlite")
+    assert list(migrated.iter_post_ids()) == ["1"]
+    assert migrated.get_post("1").caption == "c"
+
+
+def test_image_ids_are_reserved_in_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(InstagramStorage, "IMAGE_ID_BLOCK", 10)
+    storage = create_storage(str(tmp_path), backend="sqlite")
+    assert [storage._allocate_image_id() for _ in range(3)] == [0, 1, 2]
+    assert storage._load_image_counter() == 10
+
+    # a restart continues after the reserved block, its unused ids are skipped
+    reopened = create_storage(str(tmp_path), backend="sqlite")
+    assert reopened._allocate_image_id() == 10
+    assert storage._allocate_image_id() == 3
+    assert reopened._load_image_counter() == 20
+
+
+def _allocate_image_ids(folder: str, number: int, result: multiprocessing.Queue):
+    InstagramStorage.IMAGE_ID_BLOCK = 5
+    storage = create_storage(folder, backend="sqlite")
+    result.put([storage._allocate_image_id() for _ in range(number)])
+
+
+def test_processes_sharing_a_folder_get_different_image_ids(tmp_path):
+    result: multiprocessing.Queue = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=_allocate_image_ids, args=(str(tmp_path), 50, result)
+        )
+        for _ in range(4)
+    ]
+    for process in processes:
+        process.start()
+    image_ids = [image_id for _ in processes for image_id in result.get(timeout=60)]
+    for process in processes:
+        process.join()
+    assert len(image_ids) == len(set(image_ids)) == 200
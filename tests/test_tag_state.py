@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+
+from selenium.common.exceptions import TimeoutException
+
+from app.post import Post
+from app.scraping import scrape_posts_by_tags
+from app.storage import create_storage
+from app.tag_state import TagState
+
+NOW = datetime(2026, 1, 1)
+HOUR = timedelta(hours=1)
+
+
+class FakeInstagramApi:
+    # tag pages as lists of post ids, newest first
+    def __init__(self, pages, failing_tags=()):
+        self.pages = pages
+        self.failing_tags = failing_tags
+
+    def scrape_posts_by_tag(
+        self, tag, filter_function, maximum_posts, known_post_ids=None
+    ):
+        if tag in self.failing_tags:
+            raise TimeoutException(f"Error loading the page by timeout: {tag}")
+        posts = []
+        for post_id in self.pages[tag]:
+            if known_post_ids and post_id in known_post_ids:
+                break
+            post = Post(post_id, f"http://images/{post_id}.jpg", "c", tags=(tag,))
+            if filter_function(post):
+                posts.append(post)
+        return posts
+
+
+def test_backoff_doubles_with_every_empty_run():
+    state = TagState("tag")
+    assert state.is_due(NOW, HOUR)
+    state.record_run(["1"], 1, NOW)
+    assert state.is_due(NOW, HOUR)
+    state.record_run(["1"], 0, NOW)
+    assert state.next_due(HOUR) == NOW + HOUR
+    state.record_run(["1"], 0, NOW)
+    assert state.next_due(HOUR) == NOW + 2 * HOUR
+    assert not state.is_due(NOW + HOUR, HOUR)
+    state.empty_runs = 20
+    assert state.next_due(HOUR) == NOW + TagState.MAX_BACKOFF
+    state.record_run(["2", "1"], 1, NOW)
+    assert state.empty_runs == 0
+    assert state.recent_post_ids == ("2", "1")
+
+
+def test_tag_without_new_posts_is_backed_off(tmp_path):
+    storage = create_storage(str(tmp_path))
+    api = FakeInstagramApi({"a": ["1", "2"]})
+    scrape_posts_by_tags(storage, [api], {"company": ["a"]}, 10, tag_backoff=HOUR)
+    state = storage.get_tag_state("a")
+    assert state.recent_post_ids == ("1", "2")
+    assert state.empty_runs == 0
+
+    assert scrape_posts_by_tags(storage, [api], {"company": ["a"]}, 10) == []
+    assert storage.get_tag_state("a").empty_runs == 1
+
+    # skipped until the backoff is over
+    api.pages["a"] = ["3", "1", "2"]
+    assert scrape_posts_by_tags(storage, [api], {"company": ["a"]}, 10) == []
+    assert storage.get_tag_state("a").empty_runs == 1
+
+
+def test_failed_tag_page_is_not_backed_off(tmp_path):
+    storage = create_storage(str(tmp_path))
+    api = FakeInstagramApi({"a": ["1"]}, failing_tags={"a"})
+    scrape_posts_by_tags(storage, [api], {"company": ["a"]}, 10, tag_backoff=HOUR)
+    state = storage.get_tag_state("a")
+    assert state.last_scraped is None
+    assert state.empty_runs == 0
+
+
+def test_posts_dropped_by_the_quota_stay_out_of_the_mark(tmp_path):
+    storage = create_storage(str(tmp_path))
+    api = FakeInstagramApi({"a": ["1", "2", "3"]})
+    posts = scrape_posts_by_tags(storage, [api], {"company": ["a"]}, 2)
+    assert [post.id for post in posts] == ["1", "2"]
+    state = storage.get_tag_state("a")
+    assert state.recent_post_ids == ("1", "2")
+    assert state.empty_runs == 0